@@ -5,10 +5,11 @@ __author__ = ("Sébastien BARTHÉLEMY <barthelemy@crans.org>")
 
 __all__ = ['adjointmatrix', 'collisions', 'constraints', 'controllers',
            'homogeneousmatrix', 'joints', 'massmatrix',
-           'observers', 'rigidmotion', 'robots', 'shapes', 'twistvector',
+           'observers', 'profiling', 'rigidmotion', 'robots', 'shapes',
+           'solvers', 'twistvector',
            'visu']
 
 
 from arboris.core import World, Body, Joint, JointsList, NamedObjectsList, \
                          Frame, SubFrame, MovingSubFrame, simulate, \
-                         Constraint, Controller, Observer
+                         Constraint, ConstraintSolver, Controller, Observer
@@ -6,128 +6,309 @@
 
 __author__ = ("Sébastien BARTHÉLEMY <barthelemy@crans.org>")
 
-from numpy.linalg import norm
-from numpy        import zeros, argmin, dot, sign, arange
+from numpy.linalg import norm, det, solve
+from numpy        import zeros, argmin, argmax, argsort, dot, arange, \
+                         array, eye, cross, where, concatenate, sqrt, pi, \
+                         floor, inf, newaxis, isfinite, ndarray
+from itertools    import combinations
+from weakref      import WeakKeyDictionary
 import arboris.homogeneousmatrix as Hg
+import arboris.twistvector as Tw
 from   arboris.core   import Shape
-from   arboris.shapes import Plane, Point, Box, Sphere
+from   arboris.shapes import Plane, Point, Box, Sphere, Cylinder, \
+                              ConvexHull, TriangleMesh, HeightField
 import warnings
 
 
-def choose_solver(shape0, shape1):
+_solvers = {}          # (type0, type1) -> solver
+_manifold_solvers = {} # (type0, type1) -> manifold solver
+_convex_solvers = {}   # (type0, type1) -> solver, see choose_solver()
+_dispatch = {}         # (registry id, type0, type1) -> (swap, solver)
+_instances = WeakKeyDictionary() # shape0 -> {shape1: {class: instance}}
+
+def register_solver(type0, type1, solver, manifold=False):
+    """Register a collision solver for a pair of shape types.
+
+    :param type0: the type of the first shape given to the solver
+    :param type1: the type of the second shape given to the solver
+    :param solver: the collision solver, a function ``solver(shapes,
+                   poses=None)`` as :func:`sphere_sphere_collision`.
+                   If it is a class, such as :class:`ConvexCollision`,
+                   an instance is created for each pair of shapes, at
+                   the first lookup, and returned by the next ones, so
+                   that it may keep a state from a call to the next.
+    :param bool manifold: if True, the solver is a manifold solver, see
+                          :func:`choose_manifold_solver`
+
+    The solver is then returned by :func:`choose_solver` (or
+    :func:`choose_manifold_solver`) for the shapes of these types, or of
+    their subclasses, in any order. A solver registered for the exact
+    types overrides the ones of their base classes.
+
+    **Example:**
+
+    >>> from arboris.core import World
+    >>> class Ball(Sphere):
+    ...     pass
+    >>> def ball_plane_collision(shapes, poses=None):
+    ...     return plane_sphere_collision((shapes[1], shapes[0]), poses)
+    >>> register_solver(Ball, Plane, ball_plane_collision)
+    >>> w = World()
+    >>> (p, b) = (Plane(w.ground), Ball(w.ground))
+    >>> choose_solver(p, b) == ((b, p), ball_plane_collision)
+    True
+    >>> choose_solver(Sphere(w.ground), p)[1] is plane_sphere_collision
+    True
+
+    """
+    registry = _manifold_solvers if manifold else _solvers
+    registry[type0, type1] = solver
+    _dispatch.clear()
+
+def _lookup(registry, type0, type1):
+    """Return a (swap, solver) tuple for a pair of shape types, where
+    swap is True if the shapes must be given in reverse order, or None.
+
+    The result is computed once per pair of types.
+    """
+    key = (id(registry), type0, type1)
+    try:
+        return _dispatch[key]
+    except KeyError:
+        pass
+    found = None
+    for t0 in type0.__mro__:
+        for t1 in type1.__mro__:
+            if (t0, t1) in registry:
+                found = (False, registry[t0, t1])
+            elif (t1, t0) in registry:
+                found = (True, registry[t1, t0])
+            if found is not None:
+                break
+        if found is not None:
+            break
+    _dispatch[key] = found
+    return found
+
+def _choose(registry, shape0, shape1):
+    assert isinstance(shape0, Shape)
+    assert isinstance(shape1, Shape)
+    found = _lookup(registry, type(shape0), type(shape1))
+    if found is None:
+        raise NotImplementedError()
+    (swap, solver) = found
+    if swap:
+        (shape0, shape1) = (shape1, shape0)
+    if isinstance(solver, type):
+        solver = _instance(solver, shape0, shape1)
+    return ((shape0, shape1), solver)
+
+def _instance(cls, shape0, shape1):
+    """Return the instance of a solver class for a pair of shapes,
+    created at the first call.
+
+    The instances are kept in weak dicts, so that they do not keep the
+    shapes alive.
+    """
+    instances = _instances.get(shape0)
+    if instances is None:
+        instances = _instances[shape0] = WeakKeyDictionary()
+    solvers = instances.get(shape1)
+    if solvers is None:
+        solvers = instances[shape1] = {}
+    try:
+        return solvers[cls]
+    except KeyError:
+        solver = solvers[cls] = cls()
+        return solver
+
+def choose_solver(shape0, shape1, convex=False):
     """Choose a suitable solver for the two shapes.
 
     :param shape0: first shape to select the proper solver.
     :type  shape0: :class:`~arboris.core.Shape`
     :param shape1: second shape.
     :type  shape1: :class:`~arboris.core.Shape`
+    :param bool convex: if True, fall back on :class:`ConvexCollision`
+                        for the pairs of convex shapes
     :return: a tuple ((shape0', shape1'), solver). the shapes are the same as
              in inputs arguments, but they can be sorted differently.
 
-    For now, the number of solvers is limited. Implemented solvers are:
+    The solvers are looked up by the types of the shapes, among those
+    given to :func:`register_solver`. The implemented solvers are:
 
     * Sphere / Sphere
     * Sphere / Point
     * Sphere / Plane
     * Sphere / Box
     * Point / Plane
+    * Plane / Box
+    * TriangleMesh / Sphere
+    * TriangleMesh / Point
+    * HeightField / Sphere
+    * HeightField / Point
+
+    If ``convex`` is True, any other pair of boxes, cylinders, convex
+    hulls, spheres and points (but two points) is handled by a
+    :class:`ConvexCollision` instance, which is specific to the pair.
+    This is not the default, since it gives contacts to pairs of shapes
+    which used to be ignored by
+    :func:`~arboris.constraints.get_all_contacts`, such as the shapes of
+    the adjacent links of a robot.
 
     """
-    assert isinstance(shape0, Shape)
-    assert isinstance(shape1, Shape)
+    try:
+        return _choose(_solvers, shape0, shape1)
+    except NotImplementedError:
+        if not convex:
+            raise
+    return _choose(_convex_solvers, shape0, shape1)
 
-    if isinstance(shape0, Sphere):
-        if isinstance(shape1, Sphere):
-            shapes = (shape0, shape1)
-            solver = sphere_sphere_collision
-        elif isinstance(shape1, Point):
-            shapes = (shape0, shape1)
-            solver = sphere_point_collision
-        elif isinstance(shape1, Plane):
-            shapes = (shape1, shape0)
-            solver = plane_sphere_collision
-        elif isinstance(shape1, Box):
-            shapes = (shape1, shape0)
-            solver = box_sphere_collision
-        else:
-            raise NotImplementedError()
-    elif isinstance(shape0, Point):
-        if isinstance(shape1, Sphere):
-            shapes = (shape1, shape0)
-            solver = sphere_point_collision
-        elif isinstance(shape1, Plane):
-            shapes = (shape1, shape0)
-            solver = plane_point_collision
-        else:
-            raise NotImplementedError()
-    elif isinstance(shape0, Plane):
-        if isinstance(shape1, Sphere):
-            shapes = (shape0, shape1)
-            solver = plane_sphere_collision
-        elif isinstance(shape1, Point):
-            shapes = (shape0, shape1)
-            solver = plane_point_collision
-        else:
-            raise NotImplementedError()
-    elif isinstance(shape0, Box):
-        if isinstance(shape1, Sphere):
-            shapes = (shape0, shape1)
-            solver = box_sphere_collision
-        elif isinstance(shape1, Point):
-            shapes = (shape0, shape1)
-            solver = box_point_collision
-        else:
-            raise NotImplementedError()
+def choose_manifold_solver(shape0, shape1):
+    """Choose a suitable manifold solver for the two shapes.
+
+    :param shape0: first shape to select the proper solver.
+    :type  shape0: :class:`~arboris.core.Shape`
+    :param shape1: second shape.
+    :type  shape1: :class:`~arboris.core.Shape`
+    :return: a tuple ((shape0', shape1'), solver), as for
+             :func:`choose_solver`.
+
+    A manifold solver returns a list of up to 4 contact points, each one
+    described as for the other solvers, for shapes which may touch each
+    other on a surface. Implemented solvers are:
+
+    * Plane / Box
+    * Box / Box
+
+    """
+    return _choose(_manifold_solvers, shape0, shape1)
+
+def _poses(shapes, poses=None):
+    """ Return the poses of the shapes frames.
+
+    :param shapes: a tuple of two shapes
+    :param poses: None, or a tuple of two homogeneous matrices which are
+                  then returned. This allows the collision solvers to be
+                  queried at any configuration, see :func:`time_of_impact`.
+    :return: a tuple of the frames poses
+
+    """
+    if poses is None:
+        return (shapes[0].frame.pose, shapes[1].frame.pose)
     else:
-        raise NotImplementedError()
-    return (shapes, solver)
+        return poses
+
+def collide(shapes, collision_solver):
+    """ Call the collision solver on the shapes, at most once per stamp.
+
+    The result is kept until the :attr:`~arboris.core.Body.stamp` of one
+    of the shapes frames changes, so that a pair of shapes queried by
+    several constraints or observers with the same solver during a time
+    step is solved only once. The result must not be modified: its
+    arrays are read-only views.
+
+    :param shapes: a tuple of two shapes
+    :param collision_solver: the collision solver, as returned by
+                             :func:`choose_solver`
+    :return: the result of ``collision_solver(shapes)``
+
+    **Example:**
+
+    >>> from arboris.core import World, SubFrame
+    >>> w = World()
+    >>> f = SubFrame(w.ground, Hg.transl(0., 1., 0.))
+    >>> shapes = (Sphere(w.ground, .1), Point(f))
+    >>> w.update_dynamic()
+    >>> r0 = collide(shapes, sphere_point_collision)
+    >>> collide(shapes, sphere_point_collision) is r0
+    True
+    >>> w.update_dynamic()
+    >>> collide(shapes, sphere_point_collision) is r0
+    False
+    >>> r0[1].flags.writeable
+    False
 
-def sphere_sphere_collision(shapes):
+    """
+    stamp = (shapes[0].frame.stamp, shapes[1].frame.stamp)
+    key = (shapes[1], collision_solver)
+    cache = shapes[0]._collisions
+    try:
+        (cached_stamp, result) = cache[key]
+        if cached_stamp == stamp:
+            return result
+    except KeyError:
+        pass
+    result = _readonly(collision_solver(shapes))
+    cache[key] = (stamp, result)
+    return result
+
+def _readonly(result):
+    """ Return a collision result whose arrays are replaced by read-only
+    views, the result of a manifold solver being a list of results. """
+    if isinstance(result, list):
+        return [_readonly(r) for r in result]
+    items = []
+    for item in result:
+        if isinstance(item, ndarray):
+            item = item.view()
+            item.flags.writeable = False
+        items.append(item)
+    return tuple(items)
+
+def sphere_sphere_collision(shapes, poses=None):
     """ Return collision information between 2 spheres.
 
     :param shapes: a tuple (:class:`~arboris.shapes.Sphere`, :class:`~arboris.shapes.Sphere`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
     :return: see :meth:`_sphere_sphere_collision` for more information on returned data.
 
     """
     assert isinstance(shapes[0], Sphere)
     assert isinstance(shapes[1], Sphere)
-    return _sphere_sphere_collision(shapes[0].frame.pose[0:3, 3],
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _sphere_sphere_collision(H_g0[0:3, 3],
                                     shapes[0].radius,
-                                    shapes[1].frame.pose[0:3, 3],
+                                    H_g1[0:3, 3],
                                     shapes[1].radius)
 
-def sphere_point_collision(shapes):
+def sphere_point_collision(shapes, poses=None):
     """ Return collision information between a sphere and a point.
 
     :param shapes: a tuple (:class:`~arboris.shapes.Sphere`, :class:`~arboris.shapes.Point`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
     :return: see :meth:`_sphere_sphere_collision` for more information on returned data.
 
     """
     assert isinstance(shapes[0], Sphere)
     assert isinstance(shapes[1], Point)
-    return _sphere_sphere_collision(shapes[0].frame.pose[0:3, 3],
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _sphere_sphere_collision(H_g0[0:3, 3],
                                     shapes[0].radius,
-                                    shapes[1].frame.pose[0:3, 3],
+                                    H_g1[0:3, 3],
                                     0.)
 
-def box_sphere_collision(shapes):
+def box_sphere_collision(shapes, poses=None):
     """ Return collision information between a box and a sphere.
 
     :param shapes: a tuple (:class:`~arboris.shapes.Box`, :class:`~arboris.shapes.Sphere`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
     :return: see :meth:`_box_sphere_collision` for more information on returned data.
 
     """
     assert isinstance(shapes[0], Box)
     assert isinstance(shapes[1], Sphere)
-    return _box_sphere_collision(shapes[0].frame.pose,
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _box_sphere_collision(H_g0,
                                  shapes[0].half_extents,
-                                 shapes[1].frame.pose[0:3, 3],
+                                 H_g1[0:3, 3],
                                  shapes[1].radius)
 
-def box_point_collision(shapes):
+def box_point_collision(shapes, poses=None):
     """ Return collision information between a box and a point.
 
     :param shapes: a tuple (:class:`~arboris.shapes.Box`, :class:`~arboris.shapes.Point`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
     :return: see :meth:`_box_sphere_collision` for more information on returned data.
     
     .. warning:: This method may raise error while looking for normal vectors,
@@ -136,44 +317,141 @@ def box_point_collision(shapes):
     """
     assert isinstance(shapes[0], Box)
     assert isinstance(shapes[1], Point)
+    (H_g0, H_g1) = _poses(shapes, poses)
     warnings.warn("""
     The Box/Point collision is implemented, but it may raise error while
     looking for normal vectors, especially when point is close to box edges.
     You should use Box/Sphere collision instead.
     """)
-    return _box_sphere_collision(shapes[0].frame.pose,
+    return _box_sphere_collision(H_g0,
                                  shapes[0].half_extents,
-                                 shapes[1].frame.pose[0:3, 3],
+                                 H_g1[0:3, 3],
                                  0.0)
 
-def plane_sphere_collision(shapes):
+def plane_sphere_collision(shapes, poses=None):
     """ Return collision information between a plane and a sphere.
 
     :param shapes: a tuple (:class:`~arboris.shapes.Plane`, :class:`~arboris.shapes.Sphere`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
     :return: see :meth:`_plane_sphere_collision` for more information on returned data.
 
     """
     assert isinstance(shapes[0], Plane)
     assert isinstance(shapes[1], Sphere)
-    return _plane_sphere_collision(shapes[0].frame.pose,
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _plane_sphere_collision(H_g0,
                                    shapes[0].coeffs,
-                                   shapes[1].frame.pose[0:3, 3],
+                                   H_g1[0:3, 3],
                                    shapes[1].radius)
 
-def plane_point_collision(shapes):
+def plane_point_collision(shapes, poses=None):
     """ Return collision information between a plane and a point.
 
     :param shapes: a tuple (:class:`~arboris.shapes.Plane`, :class:`~arboris.shapes.Point`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
     :return: see :meth:`_plane_sphere_collision` for more information on returned data.
 
     """
     assert isinstance(shapes[0], Plane)
     assert isinstance(shapes[1], Point)
-    return _plane_sphere_collision(shapes[0].frame.pose,
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _plane_sphere_collision(H_g0,
                                    shapes[0].coeffs,
-                                   shapes[1].frame.pose[0:3, 3],
+                                   H_g1[0:3, 3],
                                    0.)
 
+def plane_box_collision(shapes, poses=None):
+    """ Return collision information between a plane and a box.
+
+    :param shapes: a tuple (:class:`~arboris.shapes.Plane`, :class:`~arboris.shapes.Box`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
+    :return: the deepest point returned by :func:`plane_box_manifold`.
+
+    """
+    return plane_box_manifold(shapes, poses)[0]
+
+def plane_box_manifold(shapes, poses=None):
+    """ Return the contact manifold between a plane and a box.
+
+    :param shapes: a tuple (:class:`~arboris.shapes.Plane`, :class:`~arboris.shapes.Box`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
+    :return: see :meth:`_plane_box_manifold` for more information on returned data.
+
+    """
+    assert isinstance(shapes[0], Plane)
+    assert isinstance(shapes[1], Box)
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _plane_box_manifold(H_g0,
+                               shapes[0].coeffs,
+                               H_g1,
+                               shapes[1].half_extents)
+
+def mesh_sphere_collision(shapes, poses=None):
+    """ Return collision information between a triangle mesh and a sphere.
+
+    :param shapes: a tuple (:class:`~arboris.shapes.TriangleMesh`, :class:`~arboris.shapes.Sphere`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
+    :return: see :meth:`_mesh_sphere_collision` for more information on returned data.
+
+    """
+    assert isinstance(shapes[0], TriangleMesh)
+    assert isinstance(shapes[1], Sphere)
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _mesh_sphere_collision(H_g0,
+                                  shapes[0],
+                                  H_g1[0:3, 3],
+                                  shapes[1].radius)
+
+def mesh_point_collision(shapes, poses=None):
+    """ Return collision information between a triangle mesh and a point.
+
+    :param shapes: a tuple (:class:`~arboris.shapes.TriangleMesh`, :class:`~arboris.shapes.Point`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
+    :return: see :meth:`_mesh_sphere_collision` for more information on returned data.
+
+    """
+    assert isinstance(shapes[0], TriangleMesh)
+    assert isinstance(shapes[1], Point)
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _mesh_sphere_collision(H_g0,
+                                  shapes[0],
+                                  H_g1[0:3, 3],
+                                  0.)
+
+def heightfield_sphere_collision(shapes, poses=None):
+    """ Return collision information between a height field and a sphere.
+
+    :param shapes: a tuple (:class:`~arboris.shapes.HeightField`, :class:`~arboris.shapes.Sphere`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
+    :return: see :meth:`_heightfield_sphere_collision` for more information on returned data.
+
+    """
+    assert isinstance(shapes[0], HeightField)
+    assert isinstance(shapes[1], Sphere)
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _heightfield_sphere_collision(H_g0,
+                                         shapes[0].heights,
+                                         shapes[0].spacing,
+                                         H_g1[0:3, 3],
+                                         shapes[1].radius)
+
+def heightfield_point_collision(shapes, poses=None):
+    """ Return collision information between a height field and a point.
+
+    :param shapes: a tuple (:class:`~arboris.shapes.HeightField`, :class:`~arboris.shapes.Point`)
+    :param poses: the poses of the shapes frames, see :func:`_poses`
+    :return: see :meth:`_heightfield_sphere_collision` for more information on returned data.
+
+    """
+    assert isinstance(shapes[0], HeightField)
+    assert isinstance(shapes[1], Point)
+    (H_g0, H_g1) = _poses(shapes, poses)
+    return _heightfield_sphere_collision(H_g0,
+                                         shapes[0].heights,
+                                         shapes[0].spacing,
+                                         H_g1[0:3, 3],
+                                         0.)
+
 def _sphere_sphere_collision(p_g0, radius0, p_g1, radius1):
     """ Get information on sphere/sphere collision.
     
@@ -286,9 +564,441 @@ def _plane_sphere_collision(H_g0, coeffs0, p_g1, radius1):
     H_gc0 = Hg.zaligned(normal)
     H_gc0[0:3, 3] = p_01 - csdist * normal
     H_gc1 = H_gc0.copy()
-    H_gc1[0:3, 3] = p_01 - sign(sdist) * radius1 * normal
+    H_gc1[0:3, 3] = p_01 - radius1 * normal
     return (sdist, H_gc0, H_gc1)
 
+def _triangle_closest_point(p, a, b, c):
+    """ Return the point of the triangle (a, b, c) closest to p.
+
+    See Ericson, C.: "Real-Time Collision Detection", Morgan Kaufmann,
+    2005, section 5.1.5.
+
+    **Tests:**
+
+    >>> (a, b, c) = (array([0., 0., 0.]), array([1., 0., 0.]),
+    ...              array([0., 1., 0.]))
+    >>> q = _triangle_closest_point(array([0.2, 0.3, 1.]), a, b, c)
+    >>> q.round(6).tolist()
+    [0.2, 0.3, 0.0]
+    >>> q = _triangle_closest_point(array([2., 2., 0.]), a, b, c)
+    >>> q.round(6).tolist()
+    [0.5, 0.5, 0.0]
+    >>> q = _triangle_closest_point(array([-1., -1., 0.]), a, b, c)
+    >>> q.round(6).tolist()
+    [0.0, 0.0, 0.0]
+
+    """
+    ab = b - a
+    ac = c - a
+    ap = p - a
+    d1 = dot(ab, ap)
+    d2 = dot(ac, ap)
+    if d1 <= 0. and d2 <= 0.:
+        return a
+    bp = p - b
+    d3 = dot(ab, bp)
+    d4 = dot(ac, bp)
+    if d3 >= 0. and d4 <= d3:
+        return b
+    vc = d1*d4 - d3*d2
+    if vc <= 0. and d1 >= 0. and d3 <= 0.:
+        return a + d1/(d1 - d3)*ab
+    cp = p - c
+    d5 = dot(ab, cp)
+    d6 = dot(ac, cp)
+    if d6 >= 0. and d5 <= d6:
+        return c
+    vb = d5*d2 - d1*d6
+    if vb <= 0. and d2 >= 0. and d6 <= 0.:
+        return a + d2/(d2 - d6)*ac
+    va = d3*d6 - d5*d4
+    if va <= 0. and d4 - d3 >= 0. and d5 - d6 >= 0.:
+        return b + (d4 - d3)/((d4 - d3) + (d5 - d6))*(c - b)
+    denom = 1./(va + vb + vc)
+    return a + ab*vb*denom + ac*vc*denom
+
+def _mesh_closest_point(mesh, p):
+    """ Return the point of a triangle mesh closest to p.
+
+    :param mesh: the triangle mesh
+    :type  mesh: :class:`~arboris.shapes.TriangleMesh`
+    :param p: the point, in the mesh frame coordinates
+    :type  p: (3,)-array
+    :return: a tuple (*dist*, *q*, *triangle*) where *q* is the closest
+             point, at distance *dist*, which lies on the triangle whose
+             index is *triangle*.
+
+    The BVH is traversed depth-first, the closest child first, and the
+    nodes farther than the current closest point are pruned.
+    """
+    bvh = mesh.bvh
+    (lower, upper, children) = (bvh['lower'], bvh['upper'], bvh['children'])
+    def box_dist2(node):
+        d = (lower[node] - p).clip(0.) + (p - upper[node]).clip(0.)
+        return dot(d, d)
+    best = (float('inf'), None, None)
+    stack = [(box_dist2(0), 0)]
+    while stack:
+        (d2, node) = stack.pop()
+        if d2 >= best[0]:
+            continue
+        if children[node, 0] < 0:
+            start = bvh['start'][node]
+            for t in bvh['order'][start:start + bvh['count'][node]]:
+                (a, b, c) = mesh.vertices[mesh.triangles[t]]
+                q = _triangle_closest_point(p, a, b, c)
+                d2 = dot(p - q, p - q)
+                if d2 < best[0]:
+                    best = (d2, q, t)
+        else:
+            pending = sorted([(box_dist2(child), child)
+                              for child in children[node]], reverse=True)
+            stack.extend(pending)
+    return (sqrt(best[0]), best[1], best[2])
+
+def _mesh_pseudo_normal(mesh, t, q, tol=1e-9):
+    """ Return the pseudo-normal of the feature (the triangle, or one of
+    its edges or vertices) of the triangle ``t`` of a mesh on which the
+    point ``q`` lies. See :class:`~arboris.shapes.TriangleMesh`.
+
+    **Tests:**
+
+    >>> from arboris.core import World
+    >>> from arboris.shapes import TriangleMesh
+    >>> w = World()
+    >>> vertices = [(0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.)]
+    >>> triangles = [(0, 2, 1), (0, 1, 3), (0, 3, 2), (1, 2, 3)]
+    >>> mesh = TriangleMesh(w.ground, vertices, triangles)
+    >>> _mesh_pseudo_normal(mesh, 0, array([0.2, 0.2, 0.])).tolist()
+    [0.0, 0.0, -1.0]
+    >>> _mesh_pseudo_normal(mesh, 0, array([0.5, 0.5, 0.])).round(6).tolist()
+    [0.57735, 0.57735, -0.42265]
+
+    """
+    triangle = mesh.triangles[t]
+    (a, b, c) = mesh.vertices[triangle]
+    # the barycentric coordinates of q
+    (v0, v1, v2) = (b - a, c - a, q - a)
+    (d00, d01, d11) = (dot(v0, v0), dot(v0, v1), dot(v1, v1))
+    (d20, d21) = (dot(v2, v0), dot(v2, v1))
+    denom = d00*d11 - d01*d01
+    if denom <= 0.:
+        return mesh.face_normals[t]
+    v = (d11*d20 - d01*d21)/denom
+    w = (d00*d21 - d01*d20)/denom
+    on_feature = array([1. - v - w, v, w]) > tol
+    if on_feature.all():
+        return mesh.face_normals[t]
+    vertices = triangle[on_feature]
+    if len(vertices) == 1:
+        return mesh.vertex_normals[vertices[0]]
+    return mesh.edge_normals[(min(vertices), max(vertices))]
+
+def _mesh_sphere_collision(H_g0, mesh0, p_g1, radius1):
+    """ Get information on triangle mesh/sphere collision.
+
+    :param H_g0: pose of the mesh frame relative to the ground
+    :type  H_g0: (4,4)-array
+    :param mesh0: the triangle mesh
+    :type  mesh0: :class:`~arboris.shapes.TriangleMesh`
+    :param p_g1: position of the center of the sphere relative to the ground
+    :type  p_g1: (3,)-array
+    :param float radius1: radius of the sphere
+    :return: a tuple (*sdist*, *H_gc0*, *H_gc1*), as for :func:`_sphere_sphere_collision`.
+
+    The center of the sphere is inside the mesh if it lies behind the
+    closest feature (triangle, edge or vertex) of the mesh, as told by
+    its pseudo-normal, see :func:`_mesh_pseudo_normal`. The distance is
+    then negative.
+
+    **Tests:**
+
+    >>> from arboris.core import World
+    >>> from arboris.shapes import TriangleMesh
+    >>> w = World()
+    >>> vertices = [(0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.)]
+    >>> triangles = [(0, 2, 1), (0, 1, 3), (0, 3, 2), (1, 2, 3)]
+    >>> mesh = TriangleMesh(w.ground, vertices, triangles)
+    >>> (sdist, H_gc0, H_gc1) = _mesh_sphere_collision(eye(4), mesh,
+    ...                                 array([0.2, 0.3, -0.5]), 0.1)
+    >>> print(round(sdist, 6))
+    0.4
+    >>> (H_gc0[0:3, 2].round(6) + 0.).tolist()
+    [0.0, 0.0, -1.0]
+    >>> H_gc0[0:3, 3].round(6).tolist()
+    [0.2, 0.3, 0.0]
+    >>> (sdist, H_gc0, H_gc1) = _mesh_sphere_collision(eye(4), mesh,
+    ...                                 array([0.2, 0.3, 0.1]), 0.1)
+    >>> print(round(sdist, 6))
+    -0.2
+    >>> (H_gc0[0:3, 2].round(6) + 0.).tolist()
+    [0.0, 0.0, -1.0]
+
+    """
+    p_01 = Hg.pdot(Hg.inv(H_g0), p_g1)
+    (dist, q, t) = _mesh_closest_point(mesh0, p_01)
+    if dist > 0.:
+        normal = (p_01 - q)/dist
+        if dot(normal, _mesh_pseudo_normal(mesh0, t, q)) < 0.:
+            # the center is inside the mesh
+            normal = -normal
+            dist = -dist
+    else:
+        normal = mesh0.face_normals[t]
+    sdist = dist - radius1
+    normal = dot(H_g0[0:3, 0:3], normal)
+    H_gc0 = Hg.zaligned(normal)
+    H_gc0[0:3, 3] = Hg.pdot(H_g0, q)
+    H_gc1 = H_gc0.copy()
+    H_gc1[0:3, 3] += sdist*normal
+    return (sdist, H_gc0, H_gc1)
+
+def _heightfield_sphere_collision(H_g0, heights0, spacing0, p_g1, radius1):
+    r""" Get information on height field/sphere collision.
+
+    :param H_g0: pose of the height field frame relative to the ground
+    :type  H_g0: (4,4)-array
+    :param heights0: the heights grid, see :class:`~arboris.shapes.HeightField`
+    :type  heights0: (n_x, n_z)-array
+    :param spacing0: the grid spacing
+    :type  spacing0: (2,)-array
+    :param p_g1: position of the center of the sphere relative to the ground
+    :type  p_g1: (3,)-array
+    :param float radius1: radius of the sphere
+    :return: a tuple (*sdist*, *H_gc0*, *H_gc1*), as for :func:`_plane_sphere_collision`.
+
+    The grid cell below the center of the sphere, and the triangle of this
+    cell, are found in constant time. The sphere is then considered
+    against the plane of this triangle. Beyond the borders of the grid,
+    the planes of the border triangles are extended.
+
+    **Tests:**
+
+    >>> from numpy import array, eye
+    >>> heights = array([[0., 0., 0.],
+    ...                  [0., 1., 1.],
+    ...                  [0., 1., 2.]])
+    >>> p_g1 = array([0.75, 3., 0.25])
+    >>> (sdist, H_gc0, H_gc1) = _heightfield_sphere_collision(eye(4),
+    ...     heights, array([1., 1.]), p_g1, 0.1)
+    >>> print(round(sdist, 6))
+    1.844544
+    >>> (H_gc0[0:3, 2].round(6) + 0.).tolist()
+    [0.0, 0.707107, -0.707107]
+    >>> H_gc0[0:3, 3].round(6).tolist()
+    [0.75, 1.625, 1.625]
+    >>> p_g1 = array([0.75, 0.5, 1.5])
+    >>> (sdist, H_gc0, H_gc1) = _heightfield_sphere_collision(eye(4),
+    ...     heights, array([1., 1.]), p_g1, 0.1)
+    >>> print(round(sdist, 6))
+    -0.276777
+    >>> (H_gc0[0:3, 2].round(6) + 0.).tolist()
+    [-0.707107, 0.707107, 0.0]
+
+    """
+    p_01 = Hg.pdot(Hg.inv(H_g0), p_g1)
+    # the cell, and the coordinates within it
+    (n_x, n_z) = heights0.shape
+    x = p_01[0]/spacing0[0]
+    z = p_01[2]/spacing0[1]
+    i = min(max(int(floor(x)), 0), n_x - 2)
+    j = min(max(int(floor(z)), 0), n_z - 2)
+    (u, v) = (x - i, z - j)
+    h00 = heights0[i, j]
+    h11 = heights0[i+1, j+1]
+    # the slopes of the triangle plane
+    if u >= v:
+        h10 = heights0[i+1, j]
+        (slope_x, slope_z) = (h10 - h00, h11 - h10)
+    else:
+        h01 = heights0[i, j+1]
+        (slope_x, slope_z) = (h11 - h01, h01 - h00)
+    height = h00 + slope_x*u + slope_z*v
+    normal = array([-slope_x/spacing0[0], 1., -slope_z/spacing0[1]])
+    normal /= norm(normal)
+    csdist = (p_01[1] - height)*normal[1] # signed distance from the center
+    sdist = csdist - radius1
+    normal_g = dot(H_g0[0:3, 0:3], normal)
+    H_gc0 = Hg.zaligned(normal_g)
+    H_gc0[0:3, 3] = Hg.pdot(H_g0, p_01 - csdist*normal)
+    H_gc1 = H_gc0.copy()
+    H_gc1[0:3, 3] += sdist*normal_g
+    return (sdist, H_gc0, H_gc1)
+
+def _box_vertices(H_g, half_extents):
+    """ Return the 8 vertices of a box, as rows of a (8,3)-array, in ground
+    coordinates.
+    """
+    signs = array([(x, y, z) for x in (-1., 1.)
+                             for y in (-1., 1.)
+                             for z in (-1., 1.)])
+    return H_g[0:3, 3] + dot(signs*half_extents, H_g[0:3, 0:3].T)
+
+def _plane_box_manifold(H_g0, coeffs0, H_g1, half_extents1):
+    """ Get the contact manifold between a plane and a box.
+
+    :param H_g0: pose of the plane frame relative to the ground
+    :type  H_g0: (4,4)-array
+    :param coeffs0: coefficients from the plane equation
+    :type  coeffs0: (4,)-array
+    :param H_g1: pose of the center of the box relative to the ground
+    :type  H_g1: (4,4)-array
+    :param half_extents1: half lengths of the box
+    :type  half_extents1: (3,)-array
+    :return: a list of the 4 vertices of the box which are the closest to
+             the plane, as (*sdist*, *H_gc0*, *H_gc1*) tuples sorted by
+             increasing *sdist*, with:
+
+            * *sdist*: the signed distance from the plane to the vertex
+            * *H_gc0*: the pose from the ground to the projection of the vertex on the plane (normal along z)
+            * *H_gc1*: the pose from the ground to the vertex (normal along z)
+
+    **Tests:**
+
+    >>> from numpy import array, eye
+    >>> coeffs0 = array([0., 1., 0., 0.])
+    >>> H_g1 = Hg.transl(0., 0.5, 0.)
+    >>> points = _plane_box_manifold(eye(4), coeffs0, H_g1, (1., 0.4, 1.))
+    >>> for (sdist, H_gc0, H_gc1) in points:
+    ...     print("{0:.1f} ({1:.1f}, {2:.1f}, {3:.1f})".format(sdist,
+    ...                                                   *H_gc1[0:3, 3]))
+    0.1 (-1.0, 0.1, -1.0)
+    0.1 (-1.0, 0.1, 1.0)
+    0.1 (1.0, 0.1, -1.0)
+    0.1 (1.0, 0.1, 1.0)
+    >>> coeffs0 = array([0., 1., 0., 1.])
+    >>> H_g1 = Hg.transl(0., 2., 0.)
+    >>> points = _plane_box_manifold(eye(4), coeffs0, H_g1, (1., 0.4, 1.))
+    >>> print("{0:.1f} {1:.1f}".format(points[0][0], points[0][1][1, 3]))
+    0.6 1.0
+
+    """
+    R_g0 = H_g0[0:3, 0:3]
+    normal = dot(R_g0, coeffs0[0:3])
+    vertices = _box_vertices(H_g1, half_extents1)
+    # signed distances `n \cdot p_0 - d`, the plane equation being
+    # expressed in frame 0, as in _plane_sphere_collision
+    sdists = dot(vertices - H_g0[0:3, 3], normal) - coeffs0[3]
+    H_gc0 = Hg.zaligned(normal)
+    points = []
+    for i in argsort(sdists, kind='mergesort')[0:4]:
+        H_gc1 = H_gc0.copy()
+        H_gc1[0:3, 3] = vertices[i]
+        H_gc = H_gc0.copy()
+        H_gc[0:3, 3] = vertices[i] - sdists[i]*normal
+        points.append((sdists[i], H_gc, H_gc1))
+    return points
+
+def _box_box_manifold(H_g0, half_extents0, H_g1, half_extents1, normal,
+                      min_alignment=0.9):
+    """ Get the contact manifold between two boxes, given their contact
+    normal.
+
+    :param H_g0: pose of the center of box 0 relative to the ground
+    :type  H_g0: (4,4)-array
+    :param half_extents0: half lengths of box 0
+    :type  half_extents0: (3,)-array
+    :param H_g1: pose of the center of box 1 relative to the ground
+    :type  H_g1: (4,4)-array
+    :param half_extents1: half lengths of box 1
+    :type  half_extents1: (3,)-array
+    :param normal: the contact normal, from box 0 to box 1
+    :type  normal: (3,)-array
+    :param float min_alignment: the minimal cosine of the angle between
+                                the normal and a face of the boxes
+    :return: a list of up to 4 (*sdist*, *H_gc0*, *H_gc1*) tuples,
+             or an empty list if no face of the boxes is aligned with
+             the normal.
+
+    The *reference face* is the face of the boxes which is the best aligned
+    with the normal. The face of the other box which faces it, the
+    *incident face*, is clipped by the sides of the reference face. Each
+    remaining vertex gives a contact point, with the reference face normal
+    as contact normal. If there are more than 4 of them, the ones which
+    are the farthest along each side of the reference face are kept.
+
+    **Tests:**
+
+    >>> from numpy import array, eye
+    >>> H_g1 = dot(Hg.transl(0., 0.15, 0.), Hg.roty(pi/4))
+    >>> points = _box_box_manifold(eye(4), (1., 0.1, 1.),
+    ...                            H_g1, (0.1, 0.1, 0.1), array([0., 1., 0.]))
+    >>> for (sdist, H_gc0, H_gc1) in points:
+    ...     print("{0:.2f} ({1:.3f}, {2:.3f}, {3:.3f})".format(sdist,
+    ...                                       *(H_gc1[0:3, 3].round(3) + 0.)))
+    -0.05 (0.141, 0.050, 0.000)
+    -0.05 (0.000, 0.050, 0.141)
+    -0.05 (-0.141, 0.050, 0.000)
+    -0.05 (0.000, 0.050, -0.141)
+
+    """
+    boxes = ((H_g0, array(half_extents0), normal),
+             (H_g1, array(half_extents1), -normal))
+    alignments = [dot(n, H[0:3, 0:3]) for (H, he, n) in boxes]
+    axes = [argmax(abs(a)) for a in alignments]
+    if max(abs(alignments[0][axes[0]]),
+           abs(alignments[1][axes[1]])) < min_alignment:
+        return []
+    # r is the box with the reference face, i the one with the incident face
+    if abs(alignments[0][axes[0]]) >= abs(alignments[1][axes[1]]):
+        (r, i) = (0, 1)
+    else:
+        (r, i) = (1, 0)
+    (H_r, he_r, n_r) = boxes[r]
+    (H_i, he_i, n_i) = boxes[i]
+    (a_r, a_i) = (axes[r], axes[i])
+    s_r = 1. if alignments[r][a_r] > 0. else -1.
+    # the incident face has its outward normal along -n_r
+    s_i = -1. if dot(n_r, H_i[0:3, a_i]) > 0. else 1.
+    # incident face vertices, in the reference box frame
+    (j, k) = [a for a in range(3) if a != a_i]
+    polygon = []
+    for (u, v) in ((1., 1.), (-1., 1.), (-1., -1.), (1., -1.)):
+        p = zeros(3)
+        p[a_i] = s_i*he_i[a_i]
+        p[j] = u*he_i[j]
+        p[k] = v*he_i[k]
+        polygon.append(Hg.pdot(dot(Hg.inv(H_r), H_i), p))
+    # clip by the sides of the reference face
+    for a in [a for a in range(3) if a != a_r]:
+        for side in (1., -1.):
+            clipped = []
+            for (m, p) in enumerate(polygon):
+                q = polygon[m-1]
+                dp = side*p[a] - he_r[a]
+                dq = side*q[a] - he_r[a]
+                if (dp <= 0.) != (dq <= 0.):
+                    clipped.append(q + (p - q)*dq/(dq - dp))
+                if dp <= 0.:
+                    clipped.append(p)
+            polygon = clipped
+    if len(polygon) > 4:
+        sides = [a for a in range(3) if a != a_r]
+        kept = set()
+        for a in sides:
+            coords = [p[a] for p in polygon]
+            kept.add(argmax(coords))
+            kept.add(argmin(coords))
+        for m in argsort([s_r*p[a_r] for p in polygon]):
+            if len(kept) >= 4:
+                break
+            kept.add(m)
+        polygon = [polygon[m] for m in sorted(kept)[0:4]]
+    # contact frames, the normal being oriented from box 0 to box 1
+    z = s_r*H_r[0:3, a_r]
+    if r == 1:
+        z = -z
+    points = []
+    for p in polygon:
+        sdist = s_r*p[a_r] - he_r[a_r]
+        p_r = p.copy()
+        p_r[a_r] = s_r*he_r[a_r]
+        H_gc = [Hg.zaligned(z), Hg.zaligned(z)]
+        H_gc[r][0:3, 3] = Hg.pdot(H_r, p_r)
+        H_gc[i][0:3, 3] = Hg.pdot(H_r, p)
+        points.append((sdist, H_gc[0], H_gc[1]))
+    return points
+
 def _box_sphere_collision(H_g0, half_extents0, p_g1, radius1):
     """ Get information on box/sphere collision.
 
@@ -392,3 +1102,535 @@ def _box_sphere_collision(H_g0, half_extents0, p_g1, radius1):
     H_gc1[0:3, 3] = p_g1 - radius1*normal
     return (sdist, H_gc0, H_gc1)
 
+def _margin(shape):
+    """ Return the radius of the sphere swept around the core of a shape.
+
+    The :class:`ConvexCollision` solver works on the shapes cores, a sphere
+    is a point with a margin.
+    """
+    if isinstance(shape, Sphere):
+        return shape.radius
+    else:
+        return 0.
+
+def _support(shape, H_g, direction):
+    """ Return the point of the shape core, in ground coordinates, which is
+    the farthest along ``direction``.
+
+    :param shape: a :class:`~arboris.shapes.Box`,
+                  :class:`~arboris.shapes.Cylinder`,
+                  :class:`~arboris.shapes.ConvexHull`,
+                  :class:`~arboris.shapes.Sphere` or
+                  :class:`~arboris.shapes.Point`
+    :param H_g: the pose of the shape frame
+    :type  H_g: (4,4)-array
+    :param direction: the direction, in ground coordinates
+    :type  direction: (3,)-array
+
+    **Tests:**
+
+    >>> from arboris.core import World
+    >>> w = World()
+    >>> box = Box(w.ground, (1., 2., 3.))
+    >>> print(_support(box, Hg.transl(1., 0., 0.), array([1., -1., 1.])))
+    [ 2. -2.  3.]
+    >>> cylinder = Cylinder(w.ground, 2., 0.5)
+    >>> print(_support(cylinder, Hg.rotx(pi/2), array([3., -1., 4.])))
+    [ 0.3 -1.   0.4]
+
+    """
+    R = H_g[0:3, 0:3]
+    d = dot(direction, R)
+    if isinstance(shape, Box):
+        p = where(d >= 0., 1., -1.)*shape.half_extents
+    elif isinstance(shape, Cylinder):
+        p = zeros(3)
+        n = norm(d[0:2])
+        if n > 0.:
+            p[0:2] = shape.radius*d[0:2]/n
+        p[2] = shape.length/2. if d[2] >= 0. else -shape.length/2.
+    elif isinstance(shape, ConvexHull):
+        p = shape.vertices[argmax(dot(shape.vertices, d))]
+    elif isinstance(shape, (Sphere, Point)):
+        p = zeros(3)
+    else:
+        raise NotImplementedError()
+    return H_g[0:3, 3] + dot(R, p)
+
+def _affine_weights(points):
+    """ Return the barycentric coordinates of the point of the affine hull
+    of ``points`` closest to the origin, or None if they are degenerate.
+    """
+    if len(points) == 1:
+        return array([1.])
+    edges = points[1:] - points[0]
+    gram = dot(edges, edges.T)
+    if abs(det(gram)) <= 1e-12*max(gram.trace(), 1e-300)**len(gram):
+        return None
+    mu = solve(gram, -dot(edges, points[0]))
+    return concatenate(([1. - mu.sum()], mu))
+
+def _simplex_closest(points):
+    """ Return the point of the simplex closest to the origin.
+
+    :param points: the simplex vertices
+    :type  points: (n,3)-array, with n <= 4
+    :return: a tuple (*v*, *indices*, *weights*) where *v* is the closest
+             point, *indices* the vertices of the smallest face containing
+             it and *weights* its barycentric coordinates on this face.
+
+    **Tests:**
+
+    >>> (v, indices, weights) = _simplex_closest(array([[1., 1., 0.],
+    ...                                                 [1., -1., 0.],
+    ...                                                 [2., 0., 1.]]))
+    >>> v.tolist()
+    [1.0, 0.0, 0.0]
+    >>> print(indices)
+    (0, 1)
+
+    """
+    best = None
+    for k in range(1, len(points) + 1):
+        for indices in combinations(range(len(points)), k):
+            face = points[list(indices)]
+            weights = _affine_weights(face)
+            if weights is None or (weights < 0.).any():
+                continue
+            v = dot(weights, face)
+            if best is None or dot(v, v) < dot(best[0], best[0]):
+                best = (v, indices, weights)
+    return best
+
+
+class ConvexCollision(object):
+    """ A collision solver for any two convex shapes among
+    :class:`~arboris.shapes.Box`, :class:`~arboris.shapes.Cylinder`,
+    :class:`~arboris.shapes.ConvexHull`, :class:`~arboris.shapes.Sphere`
+    and :class:`~arboris.shapes.Point`.
+
+    The shapes are only known through their support mapping (see
+    :func:`_support`). When they are apart, their distance is computed
+    by the Gilbert-Johnson-Keerthi (GJK) algorithm: it iteratively builds
+    a simplex within their Minkowski difference, converging to its point
+    which is the closest to the origin. When they overlap, the simplex
+    ends up enclosing the origin and is expanded into a polytope whose
+    closest face to the origin gives the penetration depth and normal,
+    which is the expanding polytope algorithm (EPA).
+
+    Each instance should be used for a single pair of shapes: it keeps
+    the support directions of the last simplex and starts the next query
+    from them. For coherent motion, the previous simplex is nearly
+    optimal, and the query needs very few iterations.
+
+    The returned data is the same as for the other solvers, see
+    :func:`_sphere_sphere_collision`.
+
+    **Tests:**
+
+    >>> from arboris.core import World
+    >>> w = World()
+    >>> box0 = Box(w.ground, (1., 1., 1.))
+    >>> box1 = Box(w.ground, (1., 1., 1.))
+    >>> solver = ConvexCollision()
+    >>> H_g1 = Hg.transl(0.5, 2.5, 0.)
+    >>> (sdist, H_gc0, H_gc1) = solver((box0, box1), (eye(4), H_g1))
+    >>> print(round(sdist, 6))
+    0.5
+    >>> print(dot(H_gc0[0:3, 2], (0., 1., 0.)))
+    1.0
+    >>> H_g1 = Hg.transl(0.5, 1.8, 0.)
+    >>> (sdist, H_gc0, H_gc1) = solver((box0, box1), (eye(4), H_g1))
+    >>> print(round(sdist, 6))
+    -0.2
+    >>> print(dot(H_gc0[0:3, 2], (0., 1., 0.)))
+    1.0
+
+    """
+
+    def __init__(self, tol=1e-6, maxiters=64):
+        """
+        :param float tol: the absolute tolerance on the distance
+        :param int maxiters: the maximum number of iterations of both
+                             algorithms
+        """
+        self.tol = tol
+        self.maxiters = maxiters
+        self.iterations = 0
+        self._directions = []
+
+    def __call__(self, shapes, poses=None):
+        (H_g0, H_g1) = _poses(shapes, poses)
+        def support(d):
+            a = _support(shapes[0], H_g0, d)
+            b = _support(shapes[1], H_g1, -d)
+            return (a - b, a, b, d)
+
+        vertices = []
+        for d in self._directions:
+            self._add_vertex(vertices, support(d))
+        if not vertices:
+            d = H_g0[0:3, 3] - H_g1[0:3, 3]
+            if not d.any():
+                d = array([1., 0., 0.])
+            vertices.append(support(d))
+        self.iterations = 0
+        while True:
+            (v, indices, weights) = _simplex_closest(
+                array([vertex[0] for vertex in vertices]))
+            vertices = [vertices[i] for i in indices]
+            if norm(v) <= self.tol or len(vertices) == 4 or \
+                    self.iterations == self.maxiters:
+                break
+            self.iterations += 1
+            vertex = support(-v)
+            if dot(v, v) - dot(v, vertex[0]) <= self.tol*norm(v) or \
+                    not self._add_vertex(vertices, vertex):
+                break
+        self._directions = [vertex[3] for vertex in vertices]
+
+        if norm(v) > self.tol and len(vertices) < 4:
+            # the cores are apart
+            normal = -v/norm(v)
+            depth = -norm(v)
+        else:
+            (normal, depth, vertices, weights) = self._expand(vertices,
+                                                              support)
+        p_g0 = dot(weights, [vertex[1] for vertex in vertices])
+        p_g1 = dot(weights, [vertex[2] for vertex in vertices])
+        margin0 = _margin(shapes[0])
+        margin1 = _margin(shapes[1])
+        sdist = -depth - margin0 - margin1
+        H_gc0 = Hg.zaligned(normal)
+        H_gc0[0:3, 3] = p_g0 + margin0*normal
+        H_gc1 = H_gc0.copy()
+        H_gc1[0:3, 3] = p_g1 - margin1*normal
+        return (sdist, H_gc0, H_gc1)
+
+    def _add_vertex(self, vertices, vertex):
+        """ Append the vertex if it is not already in the simplex."""
+        for other in vertices:
+            if norm(other[0] - vertex[0]) <= self.tol:
+                return False
+        vertices.append(vertex)
+        return True
+
+    def _expand(self, vertices, support):
+        """ Return the penetration normal and depth of the shapes cores,
+        given a simplex containing the origin, together with the vertices
+        and weights of the contact points.
+        """
+        # complete the simplex into a tetrahedron
+        while len(vertices) < 4:
+            edges = [w[0] - vertices[0][0] for w in vertices[1:]]
+            if len(edges) == 0:
+                directions = eye(3)
+            elif len(edges) == 1:
+                directions = cross(eye(3), edges[0])
+            else:
+                directions = [cross(edges[0], edges[1])]
+            for d in concatenate((directions, -array(directions))):
+                if norm(d) <= self.tol:
+                    continue
+                vertex = support(d)
+                points = array([w[0] for w in vertices] + [vertex[0]])
+                if _affine_weights(points) is not None:
+                    vertices.append(vertex)
+                    break
+            else:
+                # flat shapes, we consider they touch
+                return (array([0., 0., 1.]), 0., vertices[0:1], array([1.]))
+        self._directions = [vertex[3] for vertex in vertices]
+        points = [vertex[0] for vertex in vertices]
+        center = sum(points)/4.
+        faces = []
+        def add_face(i, j, k):
+            n = cross(points[j] - points[i], points[k] - points[i])
+            if norm(n) <= self.tol:
+                # degenerate face, it has no normal
+                return
+            if dot(n, points[i] - center) < 0.:
+                (j, k) = (k, j)
+                n = -n
+            n /= norm(n)
+            faces.append((dot(n, points[i]), n, (i, j, k)))
+        for (i, j, k) in ((0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3)):
+            add_face(i, j, k)
+        if not faces:
+            # flat shapes, we consider they touch
+            return (array([0., 0., 1.]), 0., vertices[0:1], array([1.]))
+        for k in range(self.maxiters):
+            (depth, normal, face) = min(faces, key=lambda f: f[0])
+            vertex = support(normal)
+            if dot(normal, vertex[0]) - depth <= self.tol:
+                break
+            vertices.append(vertex)
+            points.append(vertex[0])
+            new = len(points) - 1
+            edges = set()
+            remaining = []
+            for f in faces:
+                if dot(f[1], points[new] - points[f[2][0]]) > self.tol:
+                    (a, b, c) = f[2]
+                    for edge in ((a, b), (b, c), (c, a)):
+                        if (edge[1], edge[0]) in edges:
+                            edges.remove((edge[1], edge[0]))
+                        else:
+                            edges.add(edge)
+                else:
+                    remaining.append(f)
+            faces = remaining
+            for (a, b) in edges:
+                n = cross(points[b] - points[a], points[new] - points[a])
+                if norm(n) <= self.tol:
+                    continue
+                n /= norm(n)
+                faces.append((dot(n, points[a]), n, (a, b, new)))
+            if not faces:
+                break
+        self.iterations += k + 1
+        face = [vertices[i] for i in face]
+        weights = _affine_weights(array([vertex[0] for vertex in face]))
+        if weights is None:
+            weights = array([1., 0., 0.])
+        return (normal, depth, face, weights)
+
+class BoxBoxManifold(object):
+    """ A manifold solver for two boxes.
+
+    The contact normal is computed by a :class:`ConvexCollision` instance,
+    then :func:`_box_box_manifold` gives the contact points. If no face is
+    aligned with the normal, as in an edge to edge contact, the single
+    point from the convex solver is returned.
+
+    As for :class:`ConvexCollision`, each instance should be used for a
+    single pair of boxes.
+
+    """
+
+    def __init__(self):
+        self._convex = ConvexCollision()
+
+    def __call__(self, shapes, poses=None):
+        assert isinstance(shapes[0], Box)
+        assert isinstance(shapes[1], Box)
+        (H_g0, H_g1) = _poses(shapes, poses)
+        point = self._convex(shapes, (H_g0, H_g1))
+        points = _box_box_manifold(H_g0, shapes[0].half_extents,
+                                   H_g1, shapes[1].half_extents,
+                                   point[1][0:3, 2])
+        return points or [point]
+
+def _bounding_radius(shape):
+    """ Return the radius of a ball centered on the shape frame origin and
+    containing the shape, or None if the shape is unbounded.
+    """
+    if isinstance(shape, Sphere):
+        return shape.radius
+    elif isinstance(shape, Point):
+        return 0.
+    elif isinstance(shape, Box):
+        return norm(shape.half_extents)
+    elif isinstance(shape, Cylinder):
+        return sqrt(shape.radius**2 + shape.length**2/4.)
+    elif isinstance(shape, (ConvexHull, TriangleMesh)):
+        return sqrt((shape.vertices**2).sum(axis=1).max())
+    else:
+        return None
+
+def _pair_solver(shape0, shape1):
+    """Return the (shapes, solver) tuple of :func:`choose_solver` for a
+    pair of shapes, computed once per pair.
+
+    Only the solver, and whether the shapes are swapped, are cached, in
+    weak dicts, so that the cache does not keep the shapes alive.
+    """
+    solvers = _pair_solvers.get(shape0)
+    if solvers is None:
+        solvers = _pair_solvers[shape0] = WeakKeyDictionary()
+    try:
+        (swap, solver) = solvers[shape1]
+    except KeyError:
+        (shapes, solver) = choose_solver(shape0, shape1, convex=True)
+        swap = shapes[0] is not shape0
+        solvers[shape1] = (swap, solver)
+    if swap:
+        return ((shape1, shape0), solver)
+    else:
+        return ((shape0, shape1), solver)
+
+_pair_solvers = WeakKeyDictionary() # shape0 -> {shape1: (swap, solver)}
+
+def distance_matrix(shapes_a, shapes_b, max_distance=None, sparse=False):
+    """ Compute the distances between two sets of shapes.
+
+    :param shapes_a: a sequence of `n` shapes
+    :param shapes_b: a sequence of `m` shapes
+    :param max_distance: if not None, the distances above it are not
+                         computed, and given as infinite
+    :param bool sparse: if True, return a dict whose keys are the `(i, j)`
+                        indices of the pairs closer than ``max_distance``
+    :return: a (n, m)-array whose `(i, j)` element is the signed distance
+             between ``shapes_a[i]`` and ``shapes_b[j]``, or the
+             equivalent dict if ``sparse`` is True
+
+    Only the distances between spheres and points are computed at once,
+    from their centers. The pairs whose bounding balls (see
+    :func:`_bounding_radius`) are further apart than ``max_distance`` are
+    culled. Each of the other pairs is then solved in turn by the solver
+    given by :func:`choose_solver` (with ``convex=True``), which is chosen
+    once per pair, through :func:`collide`.
+
+    **Example:**
+
+    >>> from arboris.core import World, SubFrame
+    >>> w = World()
+    >>> frames = [SubFrame(w.ground, Hg.transl(x, 0., 0.)) for x in (0., 1.)]
+    >>> shapes_a = [Sphere(frames[0], .1), Sphere(frames[1], .05)]
+    >>> shapes_b = [Sphere(frames[1], .2), Box(frames[1], (.1, .1, .1)),
+    ...             Plane(w.ground, (0., 1., 0., -1.))]
+    >>> w.update_dynamic()
+    >>> print(distance_matrix(shapes_a, shapes_b).round(6) + 0.)
+    [[ 0.7   0.8   0.9 ]
+     [-0.25 -0.15  0.95]]
+    >>> print(distance_matrix(shapes_a, shapes_b, .75))
+    [[ 0.7    inf   inf]
+     [-0.25 -0.15   inf]]
+    >>> sorted(distance_matrix(shapes_a, shapes_b, 0., True))
+    [(1, 0), (1, 1)]
+
+    """
+    def bounding(shapes):
+        centers = zeros((len(shapes), 3))
+        radii = zeros(len(shapes))
+        for (i, shape) in enumerate(shapes):
+            centers[i] = shape.frame.pose[0:3, 3]
+            radius = _bounding_radius(shape)
+            radii[i] = inf if radius is None else radius
+        return (centers, radii)
+    (centers_a, radii_a) = bounding(shapes_a)
+    (centers_b, radii_b) = bounding(shapes_b)
+    dists = sqrt(((centers_a[:, newaxis] - centers_b[newaxis])**2).sum(
+        axis=2))
+    # lower bound of the distances, exact for spheres and points
+    dists -= radii_a[:, newaxis]
+    dists -= radii_b[newaxis]
+    balls = (Sphere, Point)
+    exact_a = array([isinstance(s, balls) for s in shapes_a], dtype=bool)
+    exact_b = array([isinstance(s, balls) for s in shapes_b], dtype=bool)
+    exact = exact_a[:, newaxis] & exact_b[newaxis]
+    if max_distance is None:
+        todo = ~exact
+    else:
+        todo = ~exact & ~(dists > max_distance)
+    dists[~exact] = inf
+    for (i, j) in zip(*todo.nonzero()):
+        (shapes, solver) = _pair_solver(shapes_a[i], shapes_b[j])
+        dists[i, j] = collide(shapes, solver)[0]
+    if max_distance is not None:
+        dists[dists > max_distance] = inf
+    if sparse:
+        return dict(((i, j), dists[i, j])
+                    for (i, j) in zip(*isfinite(dists).nonzero()))
+    else:
+        return dists
+
+def time_of_impact(shapes, collision_solver, dt, tol=0., sdist=None,
+                   maxiters=20):
+    r""" Compute the earliest time of impact of two shapes during a time step.
+
+    :param shapes: a tuple of two shapes, as returned by
+                   :func:`choose_solver`
+    :param collision_solver: the collision solver of these shapes
+    :param float dt: the time step duration
+    :param float tol: the distance below which the shapes are considered
+                      in contact
+    :param sdist: the current distance between the shapes, if already known
+    :param int maxiters: maximum number of advancement steps
+    :return: the time `t \in [0, dt]` at which the distance between the
+             shapes may fall below ``tol``, or None if it cannot happen
+             during the time step.
+
+    The shapes frames are assumed to move with a constant twist during the
+    time step, so that their poses are `H_{gs}(t) = H_{gs}(0) \; \exp(t \;
+    \twist[s]_{s/g})`. This function uses conservative advancement: the
+    speed at which the shapes can approach each other is bounded by
+
+    .. math::
+        \bar{v} = \sum_{s} \|v_s\| + \|\omega_s\| \; r_s
+
+    where `r_s` is the radius of a ball centered on the shape frame and
+    containing the shape. Then, the time is advanced by `d(t)/\bar{v}`, where
+    `d(t)` is the distance between the shapes at time `t`, which cannot
+    lead past the impact.
+
+    A rotating unbounded shape (such as a plane) may hit anything, the
+    function then returns 0.
+
+    **Example:**
+
+    >>> from arboris.core import World
+    >>> from arboris.robots.simpleshapes import add_sphere, add_groundplane
+    >>> w = World()
+    >>> add_sphere(w, radius=0.1)
+    >>> add_groundplane(w)
+    >>> joint = w.getjoints()[0]
+    >>> joint.gpos[1, 3] = 1.
+    >>> joint.gvel[4] = -100.
+    >>> w.update_dynamic()
+    >>> (shapes, solver) = choose_solver(*w.getshapes())
+    >>> print(round(time_of_impact(shapes, solver, 0.01), 6))
+    0.009
+    >>> print(time_of_impact(shapes, solver, 0.005))
+    None
+
+    """
+    speed = 0.
+    for shape in shapes:
+        twist = shape.frame.twist
+        radius = _bounding_radius(shape)
+        if norm(twist[0:3]) > 0.:
+            if radius is None:
+                return 0.
+            speed += norm(twist[0:3])*radius
+        speed += norm(twist[3:6])
+    if sdist is None:
+        sdist = collision_solver(shapes)[0]
+    t = 0.
+    for k in range(maxiters):
+        if sdist <= tol:
+            return t
+        if speed == 0.:
+            return None
+        t += (sdist - tol)/speed
+        if t > dt:
+            return None
+        poses = tuple(dot(shape.frame.pose, Tw.exp(t*shape.frame.twist))
+                      for shape in shapes)
+        sdist = collision_solver(shapes, poses)[0]
+    return t
+
+
+for (_type0, _type1, _solver) in (
+        (Sphere, Sphere, sphere_sphere_collision),
+        (Sphere, Point, sphere_point_collision),
+        (Plane, Sphere, plane_sphere_collision),
+        (Box, Sphere, box_sphere_collision),
+        (Box, Point, box_point_collision),
+        (Plane, Point, plane_point_collision),
+        (Plane, Box, plane_box_collision),
+        (TriangleMesh, Sphere, mesh_sphere_collision),
+        (TriangleMesh, Point, mesh_point_collision),
+        (HeightField, Sphere, heightfield_sphere_collision),
+        (HeightField, Point, heightfield_point_collision)):
+    register_solver(_type0, _type1, _solver)
+for _type0 in (Box, Cylinder, ConvexHull, Sphere, Point):
+    for _type1 in (Box, Cylinder, ConvexHull, Sphere, Point):
+        if (_type0, _type1) == (Point, Point):
+            # points have no volume and never collide with each other
+            continue
+        if (_type1, _type0) not in _convex_solvers:
+            _convex_solvers[_type0, _type1] = ConvexCollision
+register_solver(Plane, Box, plane_box_manifold, manifold=True)
+register_solver(Box, Box, BoxBoxManifold, manifold=True)
+del _type0, _type1, _solver
@@ -6,12 +6,15 @@
 
 __author__ = ("Sébastien BARTHÉLEMY <barthelemy@crans.org>")
 
-from numpy        import array, zeros, eye, dot, diag, logical_and, arange
-from numpy.linalg import solve, eigvals, pinv
+from numpy        import array, zeros, eye, dot, diag, logical_and, arange, \
+                         outer, isreal, sqrt, flatnonzero, array_equal
+from numpy.linalg import solve, eigvals, pinv, eig, inv
 import arboris.homogeneousmatrix as Hg
+import arboris.twistvector as Tw
 from   arboris.core       import MovingSubFrame, Constraint, Shape, World
 from   arboris.joints     import LinearConfigurationSpaceJoint
-from   arboris.collisions import choose_solver
+from   arboris.collisions import choose_solver, choose_manifold_solver, \
+                                 time_of_impact, collide
 
 point_contact_proximity = 0.02
 joint_limits_proximity  = 0.01
@@ -55,6 +58,10 @@ class JointLimits(Constraint):
         self._jacobian = zeros((self._joint.ndof, world.ndof))
         self._jacobian[arange(self._joint.ndof), arange(world.ndof)[self._joint.dof]] = 1
 
+    @property
+    def bodies(self):
+        return (self._joint.frame0.body, self._joint.frame1.body)
+
     @property
     def jacobian(self):
         return self._jacobian
@@ -92,6 +99,169 @@ class JointLimits(Constraint):
             self._force[:] = 0.
         return dforce
 
+class WorldJointLimits(Constraint):
+    r"""This class describes and solves the limits of several joints at once.
+
+    It enforces the same constraints as :class:`JointLimits`, for a whole
+    set of joints (typically all the joints of a robot), but all the
+    limits are stored in flat arrays, so that:
+
+    - the active limits are detected by a single vectorized comparison,
+
+    - the jacobian is a selection matrix, whose rows are the active
+      limits (see :attr:`active_dofs`),
+
+    - each active limit is 1-dof and is solved in closed form (the
+      admittance is assumed to be diagonal dominant), instead of using a
+      pseudo-inverse.
+
+    **Example:**
+
+    >>> from arboris.core import simplearm
+    >>> w = simplearm()
+    >>> joints = w.getjoints()
+    >>> c = WorldJointLimits(joints, [-1., -2., -2.], [1., 2., 2.])
+    >>> w.register(c)
+    >>> w.init()
+    >>> joints[1].gpos[0] = 1.999
+    >>> c.update(0.001)
+    >>> c.is_active()
+    True
+    >>> c.active_dofs
+    array([1])
+
+    """
+
+    def __init__(self, joints, min_limits, max_limits, proximity=None,
+                 name=None):
+        """
+        :param joints: the joints whose limits are enforced
+        :type  joints: list of :class:`~arboris.joints.LinearConfigurationSpaceJoint`
+        :param min_limits: the lower limits of all the joints dofs
+        :type  min_limits: (x,)-array
+        :param max_limits: the upper limits of all the joints dofs
+        :type  max_limits: (x,)-array
+        :param proximity: the distance to the limits where they become
+                          active, defaults to ``joint_limits_proximity``
+        :type  proximity: (x,)-array or None
+        :param string name: the constraint name
+
+        """
+        for j in joints:
+            if not isinstance(j, LinearConfigurationSpaceJoint):
+                raise ValueError()
+        Constraint.__init__(self, name)
+        self._joints = list(joints)
+        ndof = sum([j.ndof for j in self._joints])
+        self._min = array(min_limits, dtype=float).reshape((ndof,))
+        self._max = array(max_limits, dtype=float).reshape((ndof,))
+        self._proximity = zeros((ndof,))
+        if proximity is None:
+            self._proximity[:] = joint_limits_proximity
+        else:
+            self._proximity[:] = array(proximity).reshape((ndof,))
+        self._gpos = zeros((ndof,))
+        self._dof = None # world dof of each limit, set by self.init()
+        self._wndof = None
+        self._active = zeros((0,), dtype=int)
+        self._force = zeros((0,))
+        self._jacobian = None
+
+    def init(self, world):
+        self._wndof = world.ndof
+        dof = []
+        for j in self._joints:
+            dof.extend(range(j.dof.start, j.dof.stop))
+        self._dof = array(dof, dtype=int)
+        self._jacobian = None
+
+    @property
+    def active_dofs(self):
+        """ World dofs of the active limits.
+
+        The jacobian is the selection matrix of these dofs.
+        """
+        return self._dof[self._active]
+
+    @property
+    def bodies(self):
+        bodies = []
+        for j in self._joints:
+            for b in (j.frame0.body, j.frame1.body):
+                if b not in bodies:
+                    bodies.append(b)
+        return tuple(bodies)
+
+    @property
+    def jacobian(self):
+        return self._jacobian
+
+    @property
+    def gforce(self):
+        gforce = zeros((self._wndof,))
+        gforce[self._dof[self._active]] = self._force
+        return gforce
+
+    @property
+    def ndol(self):
+        return len(self._active)
+
+    def update(self, dt):
+        i = 0
+        for j in self._joints:
+            self._gpos[i:i+j.ndof] = j.gpos
+            i += j.ndof
+        active = flatnonzero(
+            (self._gpos - self._min < self._proximity) |
+            (self._max - self._gpos < self._proximity))
+        ndol = len(active)
+        self._force = zeros((ndol,))
+        if self._jacobian is None or not array_equal(active, self._active):
+            # the selection jacobian only changes with the active set
+            self._jacobian = zeros((ndol, self._wndof))
+            self._jacobian[arange(ndol), self._dof[active]] = 1.
+        self._active = active
+
+    def is_active(self):
+        return len(self._active) > 0
+
+    def solve(self, vel, admittance, dt):
+        r"""
+
+        Each active limit `i` is solved in turn, as a 1-dof
+        :class:`JointLimits` constraint, using the diagonal term
+        `Y_{i,i}` of the admittance. The predicted position without the
+        limit force is
+
+        .. math::
+            p_i = q_i + dt \; (v_i - Y_{i,i} f_i)
+
+        if `p_i \leq m_i`, then `f_i = \max(\frac{m_i - p_i}{dt \;
+        Y_{i,i}}, 0)`, else if `p_i \geq M_i`, then `f_i = \min(\frac{M_i
+        - p_i}{dt \; Y_{i,i}}, 0)`, otherwise `f_i = 0`. The constraint
+        velocity is then updated before solving the next limit.
+
+        """
+        vel = vel.copy()
+        prev_force = self._force.copy()
+        pos0 = self._gpos[self._active]
+        mins = self._min[self._active]
+        maxs = self._max[self._active]
+        for i in range(len(self._active)):
+            y = admittance[i, i]
+            pred = pos0[i] + dt*(vel[i] - y*self._force[i])
+            if pred <= mins[i] and y > 0.:
+                force = max((mins[i] - pred)/(dt*y), 0.)
+            elif maxs[i] <= pred and y > 0.:
+                force = min((maxs[i] - pred)/(dt*y), 0.)
+            else:
+                force = 0.
+            dforce = force - self._force[i]
+            if dforce != 0.:
+                vel += admittance[:, i]*dforce
+                self._force[i] = force
+        return self._force - prev_force
+
 class BallAndSocketConstraint(Constraint):
     r""" Create a ball and socket joint constraint between two frames.
 
@@ -157,9 +327,10 @@ class BallAndSocketConstraint(Constraint):
         self._force = zeros(3)
         self._pos0 = None
         self._frames = frames
+        self._jacobian = None # computed by self.update()
 
     def init(self, world):
-        pass
+        self._jacobian = zeros((3, world.ndof))
 
     @property
     def ndol(self):
@@ -168,7 +339,9 @@ class BallAndSocketConstraint(Constraint):
     def update(self, dt):
         r"""
         Compute the predicted relative position error between the socket and
-        ball centers, `p_{01}(t)` and save it in ``self._pos0``.
+        ball centers, `p_{01}(t)` and save it in ``self._pos0``. The
+        constraint jacobian is computed at the same time and stored for the
+        remainder of the time step.
 
         .. math::
 
@@ -184,15 +357,20 @@ class BallAndSocketConstraint(Constraint):
         """
         H_01 = dot(Hg.inv(self._frames[0].pose), self._frames[1].pose)
         self._pos0 = H_01[0:3, 3]
+        dot(Hg.adjoint(H_01)[3:6, :], self._frames[1].jacobian,
+            out=self._jacobian)
+        self._jacobian -= self._frames[0].jacobian[3:6, :]
 
     def is_active(self):
         return True
 
+    @property
+    def bodies(self):
+        return (self._frames[0].body, self._frames[1].body)
+
     @property
     def jacobian(self):
-        H_01 = dot(Hg.inv(self._frames[0].pose), self._frames[1].pose)
-        return (dot(Hg.adjoint(H_01)[3:6, :], self._frames[1].jacobian)
-                -self._frames[0].jacobian[3:6, :])
+        return self._jacobian
 
     def solve(self, vel, admittance, dt):
         r"""
@@ -257,9 +435,22 @@ class PointContact(Constraint):
     ``collision_solver`` function. Implementing the second one is the
     responsability of a daughter class.
 
+    Resting contacts barely move from one time step to the next. If the
+    ``persistence`` argument is not None, the contact frames of an active
+    contact are kept as long as they stay close to each other, as
+    described in :meth:`update`. The collision solver is then skipped, and
+    the previous contact force is used as a warm start.
+
+    Fast moving shapes may go through each other during a single time step
+    while being too far apart at its beginning for the contact to be
+    active. If the ``continuous`` argument is True, such contacts are
+    detected by :func:`~arboris.collisions.time_of_impact` and activated
+    ahead of the impact, as described in :meth:`update`.
+
     """
 
-    def __init__(self, shapes, collision_solver, proximity, name):
+    def __init__(self, shapes, collision_solver, proximity, name,
+                 persistence=None, continuous=False):
         assert isinstance(shapes[0], Shape)
         assert isinstance(shapes[1], Shape)
         Constraint.__init__(self, name)
@@ -271,32 +462,129 @@ class PointContact(Constraint):
         self._sdist = None
         self._collision_solver = collision_solver
         self._proximity = proximity
+        self._persistence = persistence
+        self._continuous = continuous
+        self._time_of_impact = None
+        # relative pose and twist of the contact frames, and jacobian, which
+        # are computed by self.update()
+        self._pose = None
+        self._twist = zeros(6)
+        self._jacobian = None
         
         self._frames = (MovingSubFrame(shapes[0].frame.body),
                         MovingSubFrame(shapes[1].frame.body))
         self._child_obj_to_reg.extend(self._frames)
 
     def init(self, world):
-        pass
+        self._jacobian = zeros((self.ndol, world.ndof))
+
+    @property
+    def bodies(self):
+        return (self._frames[0].body, self._frames[1].body)
+
+    @property
+    def jacobian(self):
+        return self._jacobian
+
+    @property
+    def time_of_impact(self):
+        """The time of impact found by the last update of a speculative
+        contact, or None."""
+        return self._time_of_impact
 
     def update(self, dt):
         r"""
         This method calls the collision solver and updates the constraint
         status and the contact frames poses accordingly.
         The two frames have the same orientation, with the contact normal along
-        the `z`-axis
+        the `z`-axis.
+
+        The relative pose and twist of the frames are computed once and, if
+        the contact is active, so is its jacobian: the last ``ndol`` rows of
+        the relative twist jacobian.
+
+        If the contact was active and ``persistence`` is not None, the
+        frames, which are rigidly fixed to the bodies, are first tried
+        again. Let `H_{c_0 c_1}` be their new relative pose, with
+        translation `p` and rotation `R`. The frames are kept if
+
+        .. math::
+            \sqrt{p_x^2 + p_y^2} \le \text{persistence} \quad
+            \text{and} \quad
+            \sqrt{R_{x,z}^2 + R_{y,z}^2} \le \text{persistence}
+
+        that is if the contact points did not slide too far away from each
+        other, and if the normals are still nearly aligned. The signed
+        distance is then `p_z` and the contact force is kept as a warm
+        start. Otherwise, the collision solver is called.
+
+        If the contact is not active and ``continuous`` is True, the time
+        `t` at which the shapes may come closer than ``proximity`` during
+        the time step is computed assuming constant twists. If there is
+        such a time, the contact frames are set where the collision solver
+        finds them at time `t` and the contact is made active with the
+        signed distance `p_z` of the current contact frames. This
+        *speculative* contact lets the shapes approach each other up to
+        the impact, but not go through each other.
         """
-        (sdist, H_gc0, H_gc1) = self._collision_solver(self._shapes)
-        H_b0g = Hg.inv(self._shapes[0].frame.body.pose)
-        H_b1g = Hg.inv(self._shapes[1].frame.body.pose)
-        self._frames[0].bpose = dot(H_b0g, H_gc0)
-        self._frames[1].bpose = dot(H_b1g, H_gc1)
-        H_c0c1 = dot(Hg.inv(H_gc0), H_gc1)
-        dsdist = (dot(Hg.adjoint(H_c0c1)[5, :], self._frames[1].twist)
-                  -self._frames[0].twist[5])
-        self._is_active = (sdist + dsdist*dt < self._proximity)
+        if self._persistence is not None and self._is_active:
+            H_c0c1 = dot(Hg.inv(self._frames[0].pose), self._frames[1].pose)
+            if (H_c0c1[0, 3]**2 + H_c0c1[1, 3]**2 > self._persistence**2 or
+                H_c0c1[0, 2]**2 + H_c0c1[1, 2]**2 > self._persistence**2):
+                H_c0c1 = None
+        else:
+            H_c0c1 = None
+        if H_c0c1 is None:
+            (sdist, H_gc0, H_gc1) = collide(self._shapes,
+                                            self._collision_solver)
+            H_b0g = self._shapes[0].frame.body.ipose
+            H_b1g = self._shapes[1].frame.body.ipose
+            self._frames[0].bpose = dot(H_b0g, H_gc0)
+            self._frames[1].bpose = dot(H_b1g, H_gc1)
+            self._pose = dot(Hg.inv(H_gc0), H_gc1)
+            self._force[:] = 0.
+        else:
+            sdist = H_c0c1[2, 3]
+            self._pose = H_c0c1
+        Ad = Hg.adjoint(self._pose)
+        dot(Ad, self._frames[1].twist, out=self._twist)
+        self._twist -= self._frames[0].twist
+        self._is_active = (sdist + self._twist[5]*dt < self._proximity)
+        self._time_of_impact = None
+        if self._continuous and not self._is_active:
+            t = time_of_impact(self._shapes, self._collision_solver, dt,
+                               self._proximity, sdist)
+            if t is not None:
+                (sdist, H_c0c1) = self._speculate(t)
+                self._pose = H_c0c1
+                Ad = Hg.adjoint(self._pose)
+                dot(Ad, self._frames[1].twist, out=self._twist)
+                self._twist -= self._frames[0].twist
+                self._time_of_impact = t
+                self._is_active = True
         self._sdist = sdist
-        self._force[:] = 0.
+        if not self._is_active:
+            self._force[:] = 0.
+        if self._is_active:
+            rows = slice(6 - self.ndol, 6)
+            dot(Ad[rows, :], self._frames[1].jacobian, out=self._jacobian)
+            self._jacobian -= self._frames[0].jacobian[rows, :]
+
+    def _speculate(self, t):
+        """Set the contact frames where the collision solver finds them at
+        time ``t`` and return their current signed distance and relative
+        pose."""
+        poses = []
+        for shape in self._shapes:
+            poses.append(dot(shape.frame.pose, Tw.exp(t*shape.frame.twist)))
+        (sdist, H_gc0, H_gc1) = self._collision_solver(self._shapes, poses)
+        for (frame, shape, H_gs, H_gc) in zip(self._frames, self._shapes,
+                                              poses, (H_gc0, H_gc1)):
+            H_bs = shape.frame.bpose
+            frame.bpose = dot(H_bs, dot(Hg.inv(H_gs), H_gc))
+        H_c0c1 = dot(Hg.inv(self._frames[0].pose), self._frames[1].pose)
+        # the shapes are currently apart, rotations may make p_z negative
+        return (max(H_c0c1[2, 3], 0.), H_c0c1)
 
     def is_active(self):
         return self._is_active
@@ -422,21 +710,31 @@ class SoftFingerContact(PointContact):
 
     """
     def __init__(self, shapes, friction_coeff, collision_solver=None,
-                 proximity=0.02, name=None):
+                 proximity=0.02, name=None, persistence=None,
+                 continuous=False):
         self._mu = friction_coeff
-        PointContact.__init__(self, shapes, collision_solver, proximity, name)
+        PointContact.__init__(self, shapes, collision_solver, proximity, name,
+                              persistence, continuous)
         self._force = zeros(4)
         self._eps = array((1., 1., 1.))
+        self._s = None # last sliding parameter, used as a warm start
+        # per-step data, computed from the admittance, which does not change
+        # during the Gauss-Seidel iterations
+        self._pinv_admittance = None
+        self._sliding = None # see self._solve_sliding()
 
     @property
     def ndol(self):
         return 4
 
-    @property
-    def jacobian(self):
-        H_01 = dot(Hg.inv(self._frames[0].pose), self._frames[1].pose)
-        return (dot(Hg.adjoint(H_01)[2:6, :], self._frames[1].jacobian)
-                -self._frames[0].jacobian[2:6, :])
+    def update(self, dt):
+        """
+        Call :meth:`PointContact.update` and discard the data cached by
+        :meth:`solve` during the previous time step.
+        """
+        PointContact.update(self, dt)
+        self._pinv_admittance = None
+        self._sliding = None
 
     def solve(self, vel, admittance, dt):
         r"""
@@ -782,6 +1080,11 @@ class SoftFingerContact(PointContact):
             the full math is available as a pdf, within that document, `\beta`
             is denoted `\hat{\alpha}`.
 
+        Computing the eigen values of `B` at each Gauss-Seidel iteration is
+        expensive, `s` is therefore first searched as the root of a scalar
+        equation by :meth:`_solve_sliding`, the eigen value approach
+        (:meth:`_solve_sliding_eig`) being only used as a fallback.
+
         """
         vel_no_force = vel - dot(admittance, self._force)
         if self._sdist + dt*vel_no_force[3] > 0:
@@ -800,7 +1103,9 @@ class SoftFingerContact(PointContact):
             # First, try with static friction: zero tangent velocity
             zero_tan_vel     = vel.copy()
             zero_tan_vel[3] += self._sdist/dt
-            dforce = dot(-pinv(admittance), zero_tan_vel)
+            if self._pinv_admittance is None:
+                self._pinv_admittance = pinv(admittance)
+            dforce = dot(-self._pinv_admittance, zero_tan_vel)
             force = self._force + dforce
 
             if sum((force[0:3]/self._eps)**2) <= (force[3]*self._mu)**2:
@@ -813,49 +1118,441 @@ class SoftFingerContact(PointContact):
                 #
                 alpha = vel - dot(admittance, self._force)
                 alpha[3] += self._sdist/dt
-                Y_c = admittance[0:3, 3]
-                y_n = admittance[3, 3]
-                Y_t = admittance[0:3, 0:3]
-                beta = alpha[0:3] - alpha[3]/y_n*Y_c
-                a = self._mu/y_n * alpha[3]
-                b = self._mu/y_n * Y_c
-                B = zeros((6, 6))
-                E = diag(self._eps**2)
-                Y_that = Y_t - dot(Y_c, Y_c.T)/y_n
-                B[3:6, 3:6] = dot(E, Y_that)
-                B[0:3, 0:3] = dot(E, Y_that + 2/a*dot(beta, b.T))
-                B[0:3, 3:6] = -dot(E, dot(beta, beta.T)/(a**2))
-                B[3:6, 0:3] = dot(E, dot(b, b.T)) - eye(3)
-
-                # s is the real part of the eigenvalue with the smallest
-                # imaginary par within those with a positive real part
-                S = eigvals(B)
-                S = S[logical_and(S.imag == 0, S.real <= 0)]
-                if len(S)==0:
-                    s = -1e10 #TODO: log when len(S)==0
-                else:
-                    s = max(min(S), -1e10) #TODO: log when |s|>=1e10
-                prev_force = self._force.copy()
-                A = admittance.copy()
-                A[0:3, 0:3] -= s*diag(self._eps**-2)
-                self._force = solve(A, -alpha)
-                dforce = self._force - prev_force
+                force = self._solve_sliding(alpha, admittance)
+                if force is None:
+                    force = self._solve_sliding_eig(alpha, admittance)
+                dforce = force - self._force
+                self._force = force
                 return dforce
 
+    def _solve_sliding(self, alpha, admittance, maxiters=50, tol=1e-8):
+        r""" Solve the sliding friction case for a scalar `s`.
+
+        :param alpha: `\alpha`, as defined in :meth:`solve`
+        :type  alpha: (4,)-array
+        :param admittance: the constraint admittance `Y`
+        :type  admittance: (4,4)-array
+        :return: the new contact force, or None if the method failed
+
+        Using the notations from :meth:`solve`, the tangent part of the
+        force is `f_t = -(\hat{Y} - s E^{-1})^{-1} \beta`, with
+        `\hat{Y} = Y_t - Y_c\;Y_{r}\tp/y_n` (where `Y_r\tp` is `Y_{3,0:3}`,
+        which equals `Y_c\tp` when `Y` is symmetric) and `E` the diagonal
+        matrix of the `e^2` coefficients. Since the admittance does not
+        change within a time step, the eigen decomposition
+
+        .. math::
+            E^{\frac{1}{2}} \; \hat{Y} \; E^{\frac{1}{2}}
+            = V \; \Lambda \; V^{-1}
+
+        is computed only once per time step. Denoting
+        `x = (\Lambda - s I)^{-1} V^{-1} E^{\frac{1}{2}} \beta`,
+        the friction ellipse condition becomes a scalar equation
+
+        .. math::
+            g(s) = x\tp V\tp V x - \mu^2 f_z^2 = 0
+            \text{ with }
+            f_z = \frac{Y_r\tp E^{\frac{1}{2}} V x - \alpha_3}{y_n}
+
+        whose negative root is found by a Newton method, warm-started with
+        the value of `s` from the previous call. `g(0)` is positive since
+        the static friction attempt failed, while `g` tends to
+        `-\mu^2 (\alpha_3/y_n)^2` when `s` goes to `-\infty`, so that a
+        bracketing interval is always available, and used to safeguard the
+        Newton steps with a bisection. Iterations stop when
+        `|g(s)| \leq tol \cdot \mu^2 f_z^2`.
+
+        The method fails (and returns None) when `E^{\frac{1}{2}} \hat{Y}
+        E^{\frac{1}{2}}` has complex or non-positive eigen values, or when
+        no root with a positive normal force is found.
+
+        """
+        if self._sliding is None:
+            self._sliding = False
+            y_n = admittance[3, 3]
+            Y_c = admittance[0:3, 3]
+            Y_r = admittance[3, 0:3]
+            Y_that = admittance[0:3, 0:3] - outer(Y_c, Y_r)/y_n
+            (lambdas, V) = eig(Y_that*outer(self._eps, self._eps))
+            if y_n > 0 and isreal(lambdas).all() and (lambdas.real > 0).all():
+                V = V.real
+                # the scalar data is stored as python floats, which are
+                # faster than numpy arrays for such small computations.
+                self._sliding = (lambdas.real.tolist(), V, inv(V),
+                                 dot(V.T, V).tolist(),
+                                 dot(Y_r*self._eps, V).tolist(), Y_c, y_n)
+        if self._sliding is False:
+            return None
+        (lambdas, V, V_inv, G, r, Y_c, y_n) = self._sliding
+        alpha_n = alpha[3]
+        if alpha_n >= 0.:
+            return None
+        gamma = dot(V_inv, self._eps*(alpha[0:3] - alpha_n/y_n*Y_c)).tolist()
+        mu2 = self._mu**2
+        indices = range(3)
+
+        def evaluate(s):
+            x = [gamma[i]/(lambdas[i] - s) for i in indices]
+            dx = [x[i]/(lambdas[i] - s) for i in indices]
+            Gx = [G[i][0]*x[0] + G[i][1]*x[1] + G[i][2]*x[2] for i in indices]
+            f_n = (r[0]*x[0] + r[1]*x[1] + r[2]*x[2] - alpha_n)/y_n
+            g = x[0]*Gx[0] + x[1]*Gx[1] + x[2]*Gx[2] - mu2*f_n**2
+            dg = 2*(dx[0]*Gx[0] + dx[1]*Gx[1] + dx[2]*Gx[2]) - \
+                 2*mu2*f_n*(r[0]*dx[0] + r[1]*dx[1] + r[2]*dx[2])/y_n
+            return (g, dg, x, f_n)
+
+        # Newton iterations, safeguarded by a bisection on [lo, hi], where
+        # g(lo) <= 0 < g(hi). lo is only searched for when required.
+        if self._s is not None and self._s < 0.:
+            s = self._s
+        else:
+            s = -1.
+        (g, dg, x, f_n) = evaluate(s)
+        if g > 0.:
+            (lo, hi) = (None, s)
+        else:
+            (lo, hi) = (s, 0.)
+        for k in range(maxiters):
+            if abs(g) <= tol*mu2*f_n**2:
+                break
+            if dg != 0.:
+                s_new = s - g/dg
+            if dg == 0. or not (s_new < hi and
+                                (lo is None and s_new > -1e10 or
+                                 lo is not None and lo < s_new)):
+                if lo is None:
+                    lo = s
+                    while evaluate(lo)[0] > 0.:
+                        lo *= 10.
+                        if lo < -1e10:
+                            return None
+                s_new = (lo + hi)/2.
+            (g, dg, x, f_n) = evaluate(s_new)
+            if g > 0.:
+                hi = s_new
+            else:
+                lo = s_new
+            converged = abs(s_new - s) <= 1e-3*tol*abs(s_new)
+            s = s_new
+            if converged:
+                break
+        else:
+            return None
+        if f_n < 0.:
+            return None
+        self._s = s
+        force = zeros(4)
+        force[0:3] = -self._eps*dot(V, x)
+        force[3] = f_n
+        return force
+
+    def _solve_sliding_eig(self, alpha, admittance):
+        r""" Solve the sliding friction case using the eigen values of `B`.
+
+        :param alpha: `\alpha`, as defined in :meth:`solve`
+        :type  alpha: (4,)-array
+        :param admittance: the constraint admittance `Y`
+        :type  admittance: (4,4)-array
+        :return: the new contact force
+
+        See :meth:`solve` for the details.
+
+        """
+        Y_c = admittance[0:3, 3]
+        y_n = admittance[3, 3]
+        Y_t = admittance[0:3, 0:3]
+        beta = alpha[0:3] - alpha[3]/y_n*Y_c
+        a = self._mu/y_n * alpha[3]
+        b = self._mu/y_n * Y_c
+        B = zeros((6, 6))
+        E = diag(self._eps**2)
+        Y_that = Y_t - dot(Y_c, Y_c.T)/y_n
+        B[3:6, 3:6] = dot(E, Y_that)
+        B[0:3, 0:3] = dot(E, Y_that + 2/a*dot(beta, b.T))
+        B[0:3, 3:6] = -dot(E, dot(beta, beta.T)/(a**2))
+        B[3:6, 0:3] = dot(E, dot(b, b.T)) - eye(3)
+
+        # s is the real part of the eigenvalue with the smallest
+        # imaginary par within those with a positive real part
+        S = eigvals(B)
+        S = S.real[logical_and(S.imag == 0, S.real <= 0)]
+        if len(S)==0:
+            s = -1e10 #TODO: log when len(S)==0
+        else:
+            s = max(min(S), -1e10) #TODO: log when |s|>=1e10
+        A = admittance.copy()
+        A[0:3, 0:3] -= s*diag(self._eps**-2)
+        return solve(A, -alpha)
+
+
+class HardFingerContact(PointContact):
+    r"""This class implements a *hard-finger* point contact constraint.
+
+    It is a cheaper alternative to :class:`SoftFingerContact`, using the
+    same contact frames, but where no torque resists torsion: it is
+    well suited to small contact shapes, such as the spheres at the
+    corners of a foot sole. The contact wrench can be decomposed as:
+
+    .. math::
+        \wrench[0]_{0/1} &=
+        \begin{bmatrix}
+        0 \\ 0 \\ 0 \\ f_x \\ f_y \\ f_z
+        \end{bmatrix}
+
+    The Signorini law is the same as for :class:`SoftFingerContact`, while
+    the Coulomb law of friction uses the (circular) friction cone:
+    the contact is in static friction mode if `d = 0` and
+
+    .. math::
+        \sqrt{f_x^2 + f_y^2} \le \mu \cdot f_z
+
+    Otherwise, the friction force lies on the boundary of the cone.
+
+    """
+    def __init__(self, shapes, friction_coeff, collision_solver=None,
+                 proximity=0.02, name=None, persistence=None,
+                 continuous=False):
+        self._mu = friction_coeff
+        PointContact.__init__(self, shapes, collision_solver, proximity, name,
+                              persistence, continuous)
+        self._force = zeros(3)
+        self._pinv_admittance = None # computed once per time step
+
+    @property
+    def ndol(self):
+        return 3
+
+    def update(self, dt):
+        """
+        Call :meth:`PointContact.update` and discard the data cached by
+        :meth:`solve` during the previous time step.
+        """
+        PointContact.update(self, dt)
+        self._pinv_admittance = None
+
+    def solve(self, vel, admittance, dt):
+        r"""
+
+        We map:
+        - ``vel``: `v^*`
+        - ``admittance``: `Y`
+        - ``dt``: `dt`
+        - ``dforce`` : `\Delta f`
+
+        where the constraint velocity and force are
+
+        .. math::
+            v =
+            \begin{bmatrix}
+                v_x \\ v_y \\ v_z
+            \end{bmatrix}
+            \text{ and }
+            f =
+            \begin{bmatrix}
+                f_x \\ f_y \\ f_z
+            \end{bmatrix}
+
+        As for :class:`SoftFingerContact`, the static friction force is
+        first computed:
+
+        .. math::
+            f^k &= f^{k-1} - Y^{-1}
+            \left(
+            v^*(t+dt) +
+            \begin{bmatrix}
+                0 \\ 0 \\ \frac{d(t)}{dt}
+            \end{bmatrix}
+            \right)
+
+        If it lies outside of the friction cone, it is projected (in closed
+        form) onto the boundary of the cone: the tangent force keeps the
+        direction `u` of the static solution, and the normal force is
+        chosen so that the normal velocity condition still holds
+
+        .. math::
+            f_z &= - \frac{v_{0,z} + \frac{d(t)}{dt}}
+                          {Y_{z,z} + \mu \; Y_{z,xy} \; u}
+            \\
+            \begin{bmatrix}
+                f_x \\ f_y
+            \end{bmatrix}
+            &= \mu \; f_z \; u
+
+        where `v_0 = v^* - Y f^{k-1}` is the velocity without contact force.
+        The contact force is set to zero if this leads to `f_z < 0`.
+
+        """
+        if self._pinv_admittance is None:
+            self._pinv_admittance = pinv(admittance)
+        force = _hard_finger_force(self._force, vel, admittance,
+                                   self._pinv_admittance, self._sdist,
+                                   self._mu, dt)
+        dforce = force - self._force
+        self._force = force
+        return dforce
+
+
+def _hard_finger_force(force, vel, admittance, pinv_admittance, sdist, mu,
+                       dt):
+    """ Return the new force of a hard-finger contact, see
+    :meth:`HardFingerContact.solve`.
+    """
+    vel_no_force = vel - dot(admittance, force)
+    if sdist + dt*vel_no_force[2] > 0:
+        # if there is no contact, the contact force should be 0
+        return zeros(3)
+
+    # First, try with static friction: zero tangent velocity
+    zero_tan_vel     = vel.copy()
+    zero_tan_vel[2] += sdist/dt
+    force = force - dot(pinv_admittance, zero_tan_vel)
+    f_t = sqrt(force[0]**2 + force[1]**2)
+    if f_t > mu*force[2]:
+        # the dry friction law is not respected, project the force on
+        # the friction cone
+        f_n = 0.
+        u = zeros(2)
+        if f_t > 0.:
+            u = force[0:2]/f_t
+            den = admittance[2, 2] + mu*dot(admittance[2, 0:2], u)
+            if den > 0.:
+                f_n = max(-(vel_no_force[2] + sdist/dt)/den, 0.)
+        force[0:2] = mu*f_n*u
+        force[2] = f_n
+    return force
+
+
+class ManifoldContact(Constraint):
+    r"""This class implements a contact between two shapes which may touch
+    each other on a surface, such as a box lying on the ground.
+
+    A manifold solver (see
+    :func:`~arboris.collisions.choose_manifold_solver`) returns up to 4
+    contact points from a single query. Each point is then modeled as a
+    :class:`HardFingerContact`, with its own proximity test and friction
+    cone, but they all act on the same two bodies and are gathered in a
+    single constraint with 12 degrees of linkage. The rows of the
+    inactive points are zero.
+
+    A foot sole can thus be modeled by a single box instead of four
+    spheres at its corners, with one contact and one collision query
+    instead of four.
+
+    """
+    def __init__(self, shapes, friction_coeff, collision_solver=None,
+                 proximity=0.02, name=None):
+        assert isinstance(shapes[0], Shape)
+        assert isinstance(shapes[1], Shape)
+        Constraint.__init__(self, name)
+        if collision_solver is None:
+            (shapes, collision_solver) = choose_manifold_solver(shapes[0],
+                                                                shapes[1])
+        self._shapes = shapes
+        self._collision_solver = collision_solver
+        self._proximity = proximity
+        self._mu = friction_coeff
+        self._force = zeros(12)
+        self._sdist = zeros(4)
+        self._active = zeros(4, dtype=bool)
+        self._is_active = False
+        self._jacobian = None
+        self._pinv_admittance = [None]*4 # computed once per time step
+
+    def init(self, world):
+        self._jacobian = zeros((self.ndol, world.ndof))
+
+    @property
+    def ndol(self):
+        return 12
+
+    @property
+    def bodies(self):
+        return (self._shapes[0].frame.body, self._shapes[1].frame.body)
+
+    @property
+    def jacobian(self):
+        return self._jacobian
+
+    def update(self, dt):
+        r"""
+        This method calls the manifold solver, then updates the status and
+        the jacobian rows of each contact point, as in
+        :meth:`PointContact.update`.
+
+        The contact frames are not registered in the world: the twist and
+        jacobian of a frame `c` rigidly fixed to a body `b` are
+        `\Ad[c]_b \twist[b]_{b/g}` and `\Ad[c]_b \J[b]_b`.
+        """
+        (b0, b1) = self.bodies
+        H_b0g = b0.ipose
+        H_b1g = b1.ipose
+        self._force[:] = 0.
+        self._sdist[:] = 0.
+        self._active[:] = False
+        self._jacobian[:] = 0.
+        self._pinv_admittance = [None]*4
+        points = collide(self._shapes, self._collision_solver)
+        for (i, (sdist, H_gc0, H_gc1)) in enumerate(points):
+            Ad_c0b0 = Hg.iadjoint(dot(H_b0g, H_gc0))
+            Ad_c0c1b1 = dot(Hg.adjoint(dot(Hg.inv(H_gc0), H_gc1)),
+                            Hg.iadjoint(dot(H_b1g, H_gc1)))
+            twist = dot(Ad_c0c1b1, b1.twist) - dot(Ad_c0b0, b0.twist)
+            if sdist + twist[5]*dt < self._proximity:
+                rows = slice(3*i, 3*i + 3)
+                self._active[i] = True
+                self._sdist[i] = sdist
+                self._jacobian[rows] = dot(Ad_c0c1b1[3:6], b1.jacobian) - \
+                                       dot(Ad_c0b0[3:6], b0.jacobian)
+        self._is_active = self._active.any()
+
+    def is_active(self):
+        return self._is_active
+
+    def solve(self, vel, admittance, dt):
+        """
+        Solve each active contact point in turn, as in
+        :meth:`HardFingerContact.solve`, using the diagonal blocks of the
+        admittance and updating the velocity of the next points.
+        """
+        vel = vel.copy()
+        dforce = zeros(12)
+        for i in flatnonzero(self._active):
+            rows = slice(3*i, 3*i + 3)
+            if self._pinv_admittance[i] is None:
+                self._pinv_admittance[i] = pinv(admittance[rows, rows])
+            force = _hard_finger_force(self._force[rows], vel[rows],
+                                       admittance[rows, rows],
+                                       self._pinv_admittance[i],
+                                       self._sdist[i], self._mu, dt)
+            dforce[rows] = force - self._force[rows]
+            self._force[rows] = force
+            vel += dot(admittance[:, rows], dforce[rows])
+        return dforce
+
 
-def get_all_contacts(world, contact_class=None, **args):
+def get_all_contacts(world, contact_class=None, manifolds=False,
+                     convex=False, **args):
     """ Init all the possible collisions in world.
 
     :param world: the world where the contacts will be looked for.
     :type  world: arboris.core.World
     :param contact_class: a class describing the contacts that will be
-         created. Defaults to arboris.constraints.SoftFingerContact
+         created. Defaults to arboris.constraints.SoftFingerContact,
+         arboris.constraints.HardFingerContact is a cheaper alternative
+         when torsional friction is irrelevant.
     :type  contact_class: a subclass of arboris.constraints.PointContact
+    :param bool manifolds: if True, the pairs of shapes with a manifold
+         solver (such as Plane/Box and Box/Box) get a
+         :class:`ManifoldContact` instead.
+    :param bool convex: if True, the pairs of convex shapes without a
+         dedicated solver get a contact using a
+         :class:`~arboris.collisions.ConvexCollision` solver, see
+         :func:`~arboris.collisions.choose_solver`.
     :rparam: a list of the new contacts.
     :rtype: list
 
     All additionnal input arguments are passed to the ``contact_class``
-    constructor.
+    constructor, or to the :class:`ManifoldContact` one.
 
     Note: it is your responsability to register these new contact to the
     world.
@@ -878,7 +1575,18 @@ def get_all_contacts(world, contact_class=None, **args):
                 pass
             else:
                 try:
-                    contacts.append(contact_class((s0, s1), **args))
+                    if manifolds:
+                        try:
+                            contacts.append(ManifoldContact((s0, s1), **args))
+                            continue
+                        except NotImplementedError:
+                            pass
+                    if convex:
+                        (pair, solver) = choose_solver(s0, s1, convex=True)
+                        contacts.append(contact_class(
+                            pair, collision_solver=solver, **args))
+                    else:
+                        contacts.append(contact_class((s0, s1), **args))
                 except NotImplementedError:
                     #The collison detection is impossible.
                     pass
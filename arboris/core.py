@@ -32,6 +32,7 @@ from arboris.rigidmotion import RigidMotion
 from arboris.massmatrix import ismassmatrix
 
 import warnings
+import timeit
 
 def simplearm():
     from arboris.robots.simplearm import add_simplearm
@@ -357,6 +358,17 @@ class Constraint(NamedObject):
     def jacobian(self):
         pass
 
+    @property
+    def bodies(self):
+        """ The bodies upon which the constraint acts.
+
+        They are used by the world to order the constraints before solving
+        them (see :meth:`World.update_constraints`). Defaults to an empty
+        tuple.
+
+        """
+        return ()
+
     @abstractproperty
     def ndol(self):
         """ Number of degrees of linkage.
@@ -385,6 +397,7 @@ class Shape(NamedObject):
     def __init__(self, frame, name=None):
         assert isinstance(frame, Frame)
         self.frame = frame
+        self._collisions = {} # see arboris.collisions.collide
         NamedObject.__init__(self, name)
 
 
@@ -403,6 +416,45 @@ class Controller(NamedObject):
         pass
 
 
+class ConstraintSolver(NamedObject):
+    """ A generic class for the iterative solvers computing the constraint
+    forces, see :meth:`World.update_constraints`.
+
+    Concrete implementations are in the :mod:`arboris.solvers` module.
+
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, name=None):
+        NamedObject.__init__(self, name)
+
+    @abstractmethod
+    def solve(self, constraints, sweep, shift, vel, maxiters, tol, deadline):
+        """ Compute the forces of a group of constraints.
+
+        :param constraints: the constraints, whose current forces are given
+                            by their ``_force`` attribute
+        :param sweep: a function which calls the ``solve`` method of each
+                      constraint once, in order, and returns the updated
+                      constraints velocity
+        :param shift: a function ``shift(dforces)`` which adds each array
+                      of the ``dforces`` list to the force of the
+                      corresponding constraint and returns the updated
+                      constraints velocity
+        :param vel: the initial constraints velocity
+        :param int maxiters: maximum number of sweeps
+        :param float tol: convergence tolerance on the norm of the
+                          constraints velocity change during a sweep
+        :param deadline: if not None, the time (as given by
+                         :func:`timeit.default_timer`) at which to stop
+                         iterating
+        :return: a tuple (iterations, residual), where residual is the
+                 norm of the velocity change during the last sweep
+
+        """
+        pass
+
+
 class World(NamedObject):
     """
 
@@ -425,6 +477,32 @@ class World(NamedObject):
         self._impedance    = array([]) # updated by self.update_controller()
         self._admittance   = array([]) # updated by self.update_controller()
         self._gforce       = array([])
+        self._dof_subtree  = array([], dtype=int) # updated by self.init()
+        self._body_depth   = {} # updated by self.init()
+        # sleeping state of the ground child subtrees, see self.integrate()
+        self._body_subtree = {}    # updated by self.init()
+        self._subtree_dofs = []    # updated by self.init()
+        self._can_sleep    = array([], dtype=bool) # updated by self.init()
+        self._sleeping     = array([], dtype=bool)
+        self._sleep_time   = array([])
+        self._sleep_gforce = []
+        self._constraint_iterations = 0 # updated by self.update_constraints()
+        self._constraint_residual = 0.  # updated by self.update_constraints()
+        self._constraint_time = 0.      # updated by self.update_constraints()
+        # running estimates used by the time-budgeted constraint solver
+        self._constraint_iteration_cost = None
+        self._constraint_tol = None
+        self.constraint_islands = False # see self.update_constraints()
+        self.constraint_pool    = None  # see self.update_constraints()
+        self.constraint_matrix_free = False # see self.update_constraints()
+        self.constraint_ordering = None # see self.update_constraints()
+        self.constraint_budget = None # see self.update_constraints()
+        self.constraint_max_tol = 1e-2 # see self.update_constraints()
+        self.sleep_velocity = None # see self.integrate()
+        self.profiler = None # an arboris.profiling.Profiler, see simulate()
+        self.sleep_delay = 0.5     # see self.integrate()
+        from arboris.solvers import GaussSeidel
+        self.constraint_solver = GaussSeidel() # see self.update_constraints()
 
     def iterbodies(self):
         """ Iterate over all bodies, with a depth-first strategy. """
@@ -702,6 +780,38 @@ class World(NamedObject):
             self._gvel[j.dof] = j.gvel[:]
             j.gvel = self._gvel[j.dof]
 
+        # Label each dof with the index of the ground child subtree it
+        # belongs to. Without controller coupling them, the dofs of two
+        # distinct subtrees do not interact through the admittance.
+        self._dof_subtree = zeros(self._ndof, dtype=int)
+        for (i, j) in enumerate(self.ground.childrenjoints):
+            self._dof_subtree[j.dof] = i
+            for jj in j.frame1.body.iter_descendant_joints():
+                self._dof_subtree[jj.dof] = i
+
+        # depth of each body in the kinematic tree, the ground depth is 0
+        self._body_depth = {self.ground: 0}
+        for b in self.ground.iter_descendant_bodies():
+            self._body_depth[b] = self._body_depth[b.parentjoint.frame0.body] + 1
+
+        # only the free-floating subtrees may fall asleep, they all start
+        # awake
+        from arboris.joints import FreeJoint
+        nsubtrees = len(self.ground.childrenjoints)
+        self._body_subtree = {}
+        self._subtree_dofs = []
+        self._can_sleep = zeros(nsubtrees, dtype=bool)
+        for (i, j) in enumerate(self.ground.childrenjoints):
+            root = j.frame1.body
+            self._body_subtree[root] = i
+            for b in root.iter_descendant_bodies():
+                self._body_subtree[b] = i
+            self._subtree_dofs.append(numpy.flatnonzero(self._dof_subtree == i))
+            self._can_sleep[i] = isinstance(j, FreeJoint)
+        self._sleeping = zeros(nsubtrees, dtype=bool)
+        self._sleep_time = zeros(nsubtrees)
+        self._sleep_gforce = [None]*nsubtrees
+
         for c in self._constraints:
             c.init(self)
 
@@ -712,6 +822,52 @@ class World(NamedObject):
     def current_time(self):
         return self._current_time
 
+    @property
+    def sleeping_joints(self):
+        """ The root joints of the sleeping subtrees, see :meth:`integrate`.
+        """
+        return [j for (i, j) in enumerate(self.ground.childrenjoints)
+                if self._sleeping[i]]
+
+    def wake_up(self, joint=None):
+        """ Wake up a sleeping subtree, given its root joint, or all of
+        them if ``joint`` is None.
+        """
+        for (i, j) in enumerate(self.ground.childrenjoints):
+            if joint is None or j is joint:
+                self._sleeping[i] = False
+                self._sleep_time[i] = 0.
+
+    def _iter_awake_joints(self):
+        """ Iterate over the joints of the awake subtrees. """
+        for (i, j) in enumerate(self.ground.childrenjoints):
+            if not self._sleeping[i]:
+                yield j
+                for jj in j.frame1.body.iter_descendant_joints():
+                    yield jj
+
+    @property
+    def constraint_iterations(self):
+        """ Number of Gauss-Seidel iterations done during the last call to
+        :meth:`update_constraints` (the maximum among the islands).
+        """
+        return self._constraint_iterations
+
+    @property
+    def constraint_residual(self):
+        """ Residual of the last call to :meth:`update_constraints`, the
+        norm of the constraints velocity change during the last Gauss-Seidel
+        iteration (the maximum among the islands).
+        """
+        return self._constraint_residual
+
+    @property
+    def constraint_time(self):
+        """ Wall-clock duration of the last call to
+        :meth:`update_constraints`, in seconds.
+        """
+        return self._constraint_time
+
     @property
     def up(self):
         return self._up
@@ -790,17 +946,36 @@ class World(NamedObject):
         .. math::
             M \dGVel + \left( N + B \right) \GVel = 0
 
+        The bodies of the sleeping subtrees (see :meth:`integrate`) do not
+        move, their models and their (diagonal) blocks of the world
+        matrices are kept unchanged.
+
         """
-        self.ground.update_dynamic(
-            eye(4),
-            zeros((6,self._ndof)),
-            zeros((6,self._ndof)),
-            zeros(6))
-
-        self._mass[:] = 0.
-        self._viscosity[:] = 0.
-        self._nleffects[:] = 0.
-        for b in self.ground.iter_descendant_bodies():
+        if not self._sleeping.any():
+            self.ground.update_dynamic(
+                eye(4),
+                zeros((6,self._ndof)),
+                zeros((6,self._ndof)),
+                zeros(6))
+            self._mass[:] = 0.
+            self._viscosity[:] = 0.
+            self._nleffects[:] = 0.
+            bodies = self.ground.iter_descendant_bodies()
+        else:
+            awake_joints = [j for (i, j) in enumerate(self.ground.childrenjoints)
+                            if not self._sleeping[i]]
+            self.ground.update_dynamic(
+                eye(4),
+                zeros((6,self._ndof)),
+                zeros((6,self._ndof)),
+                zeros(6),
+                awake_joints)
+            awake = numpy.logical_not(self._sleeping[self._dof_subtree])
+            for m in (self._mass, self._viscosity, self._nleffects):
+                m[awake, :] = 0.
+                m[:, awake] = 0.
+            bodies = (j.frame1.body for j in self._iter_awake_joints())
+        for b in bodies:
             self._mass += dot(
                 dot(b.jacobian.T, b.mass),
                 b.jacobian)
@@ -886,11 +1061,24 @@ class World(NamedObject):
         assert dt > 0
         self._gforce[:] = 0.
         self._impedance = self._mass/dt + self._viscosity + self._nleffects
+        profiler = self.profiler
         for a in self._controllers:
+            if profiler is not None:
+                profiler.start_item()
             (gforce, impedance) = a.update(dt)
+            if profiler is not None:
+                profiler.controller_done(a)
             self._gforce += gforce
             self._impedance -= impedance
         self._admittance = numpy.linalg.inv(self._impedance)
+        # wake the sleeping subtrees whose controllers force changed
+        for i in numpy.flatnonzero(self._sleeping):
+            gforce = self._gforce[self._subtree_dofs[i]]
+            if self._sleep_gforce[i] is None:
+                self._sleep_gforce[i] = gforce
+            elif numpy.linalg.norm(gforce - self._sleep_gforce[i]) > \
+                    1e-6*max(numpy.linalg.norm(self._sleep_gforce[i]), 1.):
+                self.wake_up(self.ground.childrenjoints[i])
 
     def update_constraints(self, dt, maxiters=1000, tol=1e-4):
         r"""
@@ -982,44 +1170,399 @@ class World(NamedObject):
 
         - iterate over each constraint object in order to compute
           `\force[c]`. At each iteration the force is
-          updated by `\Delta\force[c]`
+          updated by `\Delta\force[c]`. The iterations are driven by the
+          ``constraint_solver`` attribute, an instance of
+          :class:`ConstraintSolver`, which defaults to a
+          :class:`~arboris.solvers.GaussSeidel` solver.
 
         - eventually add each active constraint generalized force to
           world :attr:`~arboris.core.World._gforce` property.
 
+        When the world holds several robots or objects, many constraints do
+        not interact. If the ``constraint_islands`` attribute is True, the
+        active constraints are first partitioned into islands, the connected
+        components of the graph linking each constraint to the dofs it acts
+        upon (see :meth:`_split_islands`). Each island then gets its own
+        (smaller) `J'`, `v'` and `Y'` and its own convergence test. The
+        islands may be solved concurrently by setting the
+        ``constraint_pool`` attribute to an object providing a ``map``
+        method, such as a :class:`multiprocessing.pool.ThreadPool`.
+
+        With many constraints, forming `Y'` may be expensive, in time and
+        memory. If the ``constraint_matrix_free`` attribute is True, `Y'`
+        is never formed: the Gauss-Seidel iterations only apply it to
+        forces, with the per-constraint products `Y \J[c]_c\tp` (see
+        :meth:`_solve_island_matrix_free`).
+
+        The Gauss-Seidel convergence speed depends on the order in which
+        the constraints are solved. By default, it is the registration
+        order. The ``constraint_ordering`` attribute selects another one,
+        computed at each time step among the active constraints:
+
+        - ``'ground'``: the constraints acting on the ground come first,
+
+        - ``'depth'``: the constraints are sorted by the kinematic tree
+          depth of their shallowest body, hence from the ground upward,
+
+        - ``'coloring'``: the constraints sharing a (non-ground) body get
+          distinct colors, by a greedy coloring, and the constraints are
+          solved color after color,
+
+        - a function, called as ``ordering(world, constraints)``, which
+          returns the reordered list of constraints.
+
+        The number of iterations, the residual and the duration of the last
+        call are given by :attr:`constraint_iterations`,
+        :attr:`constraint_residual` and :attr:`constraint_time`, so that
+        orderings and solvers can be compared.
+
+        For real-time use, the ``constraint_budget`` attribute may be set to
+        the maximum (wall-clock) duration of this method, in seconds. The
+        iterations then stop as soon as the budget is exhausted, and the
+        forces of the iteration with the lowest residual are kept. From one
+        call to the next, ``maxiters`` is reduced to the number of
+        iterations which fits in the budget, according to a running estimate
+        of their cost, and ``tol`` is relaxed while the budget is exceeded
+        (then tightened again, down to its given value). The relaxed
+        tolerance never exceeds the ``constraint_max_tol`` attribute (or
+        ``tol`` itself, if it is larger).
+
         TODO: add an example.
 
         """
         assert dt > 0
+        start = timeit.default_timer()
+        deadline = None
+        if self.constraint_budget is not None:
+            deadline = start + self.constraint_budget
+            min_tol = tol
+            if self._constraint_tol is not None:
+                tol = max(tol, self._constraint_tol)
+        profiler = self.profiler
         constraints = []
-        ndol = 0
-        for c in self._constraints:
-            if c.is_enabled():
+        pending = [c for c in self._constraints if c.is_enabled()]
+        while pending:
+            sleeping = set(b for (b, i) in self._body_subtree.items()
+                           if self._sleeping[i])
+            asleep = []
+            woken = False
+            for c in pending:
+                bodies = c.bodies
+                if sleeping and bodies and all(
+                        b is self.ground or b in sleeping for b in bodies):
+                    # only the ground and sleeping bodies, nothing to do
+                    asleep.append(c)
+                    continue
+                if profiler is not None:
+                    profiler.start_item()
                 c.update(dt)
+                if profiler is not None:
+                    profiler.constraint_done(c)
                 if c.is_active():
-                    c._dol = slice(ndol, ndol+c.ndol)
-                    ndol = ndol + c.ndol
                     constraints.append(c)
-        jac = zeros((ndol, self._ndof))
-        gforce = self._gforce.copy()
+                    for b in bodies:
+                        if b in sleeping:
+                            self.wake_up(self.ground.childrenjoints[
+                                self._body_subtree[b]])
+                            woken = True
+            # the constraints between woken up and sleeping bodies still
+            # have to be checked
+            pending = asleep if woken else []
+        constraints = self._order_constraints(constraints)
+        jacobians = dict((c, c.jacobian) for c in constraints)
+        free_vel = dot(self._admittance,
+                       dot(self._mass, self._gvel/dt) + self._gforce)
+        if self.constraint_islands:
+            islands = self._split_islands(constraints, jacobians)
+        else:
+            islands = [(constraints, None)]
+
+        if self.constraint_matrix_free:
+            solve = self._solve_island_matrix_free
+        else:
+            solve = self._solve_island
+
+        if deadline is not None:
+            solve_start = timeit.default_timer()
+            cost = self._constraint_iteration_cost
+            if cost is not None:
+                maxiters = min(maxiters,
+                               max(int((deadline - solve_start)/cost), 2))
+
+        def solve_island(island):
+            return solve(island[0], island[1], jacobians, free_vel, dt,
+                         maxiters, tol, deadline)
+
+        if self.constraint_pool is None:
+            gforces = [solve_island(island) for island in islands]
+        else:
+            gforces = self.constraint_pool.map(solve_island, islands)
+        self._constraint_iterations = 0
+        self._constraint_residual = 0.
+        for (dofs, gforce, iterations, residual) in gforces:
+            self._gforce[dofs] += gforce
+            self._constraint_iterations = max(self._constraint_iterations,
+                                              iterations)
+            self._constraint_residual = max(self._constraint_residual,
+                                            residual)
+
+        end = timeit.default_timer()
+        self._constraint_time = end - start
+        if deadline is not None and self._constraint_iterations > 0:
+            cost = (end - solve_start)/self._constraint_iterations
+            if self._constraint_iteration_cost is None:
+                self._constraint_iteration_cost = cost
+            else:
+                self._constraint_iteration_cost = \
+                    0.8*self._constraint_iteration_cost + 0.2*cost
+            if self._constraint_residual >= tol and end >= deadline:
+                self._constraint_tol = max(min(2.*tol,
+                                               self.constraint_max_tol),
+                                           min_tol)
+            elif end - start < 0.5*self.constraint_budget:
+                self._constraint_tol = max(0.5*tol, min_tol)
+
+    def _order_constraints(self, constraints):
+        """ Sort the active constraints before solving them.
+
+        See :meth:`update_constraints` for the available orderings.
+
+        **Example:**
+
+        >>> from arboris.robots.simpleshapes import add_sphere
+        >>> from arboris.constraints import BallAndSocketConstraint
+        >>> w = World()
+        >>> add_sphere(w, name='ball0')
+        >>> add_sphere(w, name='ball1')
+        >>> (b0, b1) = w.getbodies()[1:]
+        >>> c0 = BallAndSocketConstraint(frames=(b0, b1), name='c0')
+        >>> c1 = BallAndSocketConstraint(frames=(w.ground, b1), name='c1')
+        >>> c2 = BallAndSocketConstraint(frames=(w.ground, b0), name='c2')
+        >>> w.init()
+        >>> w.constraint_ordering = 'ground'
+        >>> [c.name for c in w._order_constraints([c0, c1, c2])]
+        ['c1', 'c2', 'c0']
+        >>> w.constraint_ordering = 'coloring'
+        >>> [c.name for c in w._order_constraints([c0, c1, c2])]
+        ['c0', 'c1', 'c2']
+        >>> w.constraint_ordering = lambda world, cs: cs[::-1]
+        >>> [c.name for c in w._order_constraints([c0, c1, c2])]
+        ['c2', 'c1', 'c0']
+
+        """
+        ordering = self.constraint_ordering
+        if ordering is None:
+            return constraints
+        elif callable(ordering):
+            return list(ordering(self, constraints))
+        elif ordering == 'ground':
+            return sorted(constraints,
+                          key=lambda c: self.ground not in c.bodies)
+        elif ordering == 'depth':
+            depth = self._body_depth
+            return sorted(constraints,
+                key=lambda c: min([depth[b] for b in c.bodies] or [len(depth)]))
+        elif ordering == 'coloring':
+            # constraints sharing a body are neighbours, except for the
+            # ground which does not move
+            n = len(constraints)
+            neighbours = [set() for c in constraints]
+            sharing = {}
+            for (i, c) in enumerate(constraints):
+                for b in c.bodies:
+                    if b is not self.ground:
+                        sharing.setdefault(b, []).append(i)
+            for indices in sharing.values():
+                for i in indices:
+                    neighbours[i].update(indices)
+            # greedy coloring, the most connected constraints first
+            colors = {}
+            for i in sorted(range(n), key=lambda i: -len(neighbours[i])):
+                used = set(colors.get(j) for j in neighbours[i] if j != i)
+                color = 0
+                while color in used:
+                    color += 1
+                colors[i] = color
+            return [constraints[i] for i in
+                    sorted(range(n), key=lambda i: colors[i])]
+        else:
+            raise ValueError(
+                "Unknown constraint ordering: {0!r}".format(ordering))
+
+    def _split_islands(self, constraints, jacobians):
+        """ Partition the constraints into independent islands.
+
+        :param constraints: the active constraints
+        :param jacobians: a dict mapping each constraint to its jacobian
+        :return: a list of (constraints, dofs) tuples, where dofs is the
+                 array of the dofs coupled to the island's constraints.
+
+        Dofs are first grouped by ground child subtree (because the mass
+        matrix is block diagonal among them), subtrees coupled through the
+        admittance (for instance by a controller) are merged, then
+        constraints acting on the same group of dofs are gathered.
+
+        **Example:**
+
+        >>> from arboris.robots.simpleshapes import add_sphere
+        >>> from arboris.constraints import BallAndSocketConstraint
+        >>> w = World()
+        >>> add_sphere(w)
+        >>> add_sphere(w)
+        >>> bodies = w.getbodies()
+        >>> for b in bodies[1:]:
+        ...     w.register(BallAndSocketConstraint(frames=(w.ground, b)))
+        >>> w.init()
+        >>> w.update_dynamic()
+        >>> w.update_controllers(0.001)
+        >>> for c in w.iterconstraints():
+        ...     c.update(0.001)
+        >>> jacobians = dict((c, c.jacobian) for c in w.iterconstraints())
+        >>> islands = w._split_islands(w._constraints, jacobians)
+        >>> [island[1] for island in islands]
+        [array([0, 1, 2, 3, 4, 5]), array([ 6,  7,  8,  9, 10, 11])]
+
+        """
+        nsubtrees = len(self.ground.childrenjoints)
+        parents = list(range(nsubtrees + len(constraints)))
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+        def union(i, j):
+            parents[find(i)] = find(j)
+
+        # merge the subtrees coupled through the admittance
+        incidence = zeros((nsubtrees, self._ndof))
+        incidence[self._dof_subtree, arange(self._ndof)] = 1.
+        coupling = dot(incidence, dot(self._admittance != 0., incidence.T))
+        for (i, j) in zip(*coupling.nonzero()):
+            if i < j:
+                union(i, j)
+        # link each constraint to the subtrees it acts upon
+        for (k, c) in enumerate(constraints):
+            acting = jacobians[c].any(axis=0)
+            for i in numpy.unique(self._dof_subtree[acting]):
+                union(nsubtrees + k, i)
+
+        islands = {}
+        for (k, c) in enumerate(constraints):
+            islands.setdefault(find(nsubtrees + k), []).append(c)
+        roots = [find(i) for i in range(nsubtrees)]
+        result = []
+        for root in sorted(islands.keys()):
+            subtrees = [i for i in range(nsubtrees) if roots[i] == root]
+            dofs = numpy.flatnonzero(numpy.in1d(self._dof_subtree, subtrees))
+            result.append((islands[root], dofs))
+        return result
+
+    def _solve_island(self, constraints, dofs, jacobians, free_vel, dt,
+                      maxiters, tol, deadline=None):
+        """ Run the Gauss-Seidel algorithm on a group of constraints.
+
+        :param constraints: the active constraints of the island
+        :param dofs: the dofs coupled to the constraints, or None for all
+                     the world dofs
+        :param jacobians: a dict mapping each constraint to its jacobian
+        :param free_vel: the generalized velocity without constraint forces
+        :param deadline: see :meth:`ConstraintSolver.solve`
+        :return: a tuple (dofs, gforce, iterations, residual) where gforce
+                 is the generalized force due to the island constraints,
+                 restricted to dofs, and iterations and residual are given
+                 by the constraint solver.
+
+        """
+        if dofs is None:
+            dofs = slice(0, self._ndof)
+            Y = self._admittance
+        else:
+            Y = self._admittance[numpy.ix_(dofs, dofs)]
+        ndol = 0
+        for c in constraints:
+            c._dol = slice(ndol, ndol+c.ndol)
+            ndol = ndol + c.ndol
+        jac = zeros((ndol, len(free_vel[dofs])))
+        force = zeros(ndol)
         for c in constraints:
-            jac[c._dol, :] = c.jacobian
-            gforce += c.gforce
-        vel = dot(jac, dot(self._admittance,
-                           dot(self._mass, self._gvel/dt) + gforce))
-        admittance = dot(jac, dot(self._admittance, jac.T))
-
-        previous_vel = vel.copy()
-        for k in arange(maxiters):
+            jac[c._dol, :] = jacobians[c][:, dofs]
+            force[c._dol] = c._force
+        vel = dot(jac, free_vel[dofs] + dot(Y, dot(jac.T, force)))
+        admittance = dot(jac, dot(Y, jac.T))
+
+        def sweep():
             for c in constraints:
                 dforce = c.solve(vel[c._dol], admittance[c._dol, c._dol], dt)
-                vel += dot(admittance[:, c._dol], dforce)
-            error = numpy.linalg.norm(vel - previous_vel)
-            if k > 0 and error < tol:
-                break
-            previous_vel = vel.copy()
+                vel[:] += dot(admittance[:, c._dol], dforce)
+            return vel.copy()
+
+        def shift(dforces):
+            for (c, dforce) in zip(constraints, dforces):
+                c._force += dforce
+                vel[:] += dot(admittance[:, c._dol], dforce)
+            return vel.copy()
+
+        (iterations, residual) = self.constraint_solver.solve(
+            constraints, sweep, shift, vel.copy(), maxiters, tol, deadline)
+        for c in constraints:
+            force[c._dol] = c._force
+        return (dofs, dot(jac.T, force), iterations, residual)
+
+    def _solve_island_matrix_free(self, constraints, dofs, jacobians,
+                                  free_vel, dt, maxiters, tol, deadline=None):
+        r""" Run the Gauss-Seidel algorithm without forming `Y'`.
+
+        The parameters and return value are the same as for
+        :meth:`_solve_island`.
+
+        Instead of the constraints velocity `v'`, the generalized velocity
+        `\GVel = v + Y J'\tp f'` is maintained. For each constraint, the
+        null columns of `\J[c]_c` are dropped, and
+        `W_c = Y \J[c]_c\tp` and the diagonal block
+        `\J[c]_c W_c` of `Y'` are computed once. At each iteration,
+        the constraint velocity is `\J[c]_c \GVel` and its force
+        adjustment updates `\GVel` by `W_c \Delta\force[c]`. The time
+        and memory costs thus grow linearly with the number of constraints.
+
+        """
+        if dofs is None:
+            dofs = slice(0, self._ndof)
+            Y = self._admittance
+        else:
+            Y = self._admittance[numpy.ix_(dofs, dofs)]
+        gvel = free_vel[dofs].copy()
+        blocks = []
         for c in constraints:
-            self._gforce += c.gforce
+            jac = jacobians[c][:, dofs]
+            cols = numpy.flatnonzero(jac.any(axis=0))
+            jac = jac[:, cols]
+            W = dot(Y[:, cols], jac.T)
+            blocks.append((c, cols, jac, W, dot(jac, W[cols, :])))
+            gvel += dot(W, c._force)
+
+        def constraints_vel():
+            return numpy.concatenate([zeros(0)] +
+                [dot(jac, gvel[cols]) for (c, cols, jac, W, D) in blocks])
+
+        def sweep():
+            for (c, cols, jac, W, D) in blocks:
+                dforce = c.solve(dot(jac, gvel[cols]), D, dt)
+                gvel[:] += dot(W, dforce)
+            return constraints_vel()
+
+        def shift(dforces):
+            for ((c, cols, jac, W, D), dforce) in zip(blocks, dforces):
+                c._force += dforce
+                gvel[:] += dot(W, dforce)
+            return constraints_vel()
+
+        (iterations, residual) = self.constraint_solver.solve(
+            constraints, sweep, shift, constraints_vel(), maxiters, tol,
+            deadline)
+        gforce = zeros(len(gvel))
+        for (c, cols, jac, W, D) in blocks:
+            gforce[cols] += dot(jac.T, c._force)
+        return (dofs, gforce, iterations, residual)
 
     def integrate(self, dt):
         r"""
@@ -1040,6 +1583,17 @@ class World(NamedObject):
         In order to get the new generalized position, each joint is integrated
         separately.
 
+        If the ``sleep_velocity`` attribute is not None, the free-floating
+        subtrees (whose root joint is a :class:`~arboris.joints.FreeJoint`)
+        whose generalized velocity norm stays below it for
+        ``sleep_delay`` seconds fall asleep: their velocity is set to zero
+        and they are neither integrated nor updated by
+        :meth:`update_dynamic`, and their constraints with the ground or
+        other sleeping bodies are skipped by :meth:`update_constraints`.
+        They wake up when a constraint with an awake body becomes active,
+        when the force applied by the controllers changes, or when
+        :meth:`wake_up` is called.
+
         TODO: add support for kinematic controllers
         TODO: repair this doctest
         TODO: check the last test result!
@@ -1062,7 +1616,23 @@ class World(NamedObject):
         self._gvel[:] = dot(self._admittance,
                             dot(self._mass, self._gvel/dt) + self._gforce)
 
-        for j in self.iterjoints():
+        if self.sleep_velocity is not None:
+            for i in numpy.flatnonzero(self._can_sleep):
+                dofs = self._subtree_dofs[i]
+                if self._sleeping[i]:
+                    self._gvel[dofs] = 0.
+                elif numpy.linalg.norm(self._gvel[dofs]) < self.sleep_velocity:
+                    self._sleep_time[i] += dt
+                    if self._sleep_time[i] >= self.sleep_delay:
+                        self._sleeping[i] = True
+                        self._sleep_gforce[i] = None
+                        self._gvel[dofs] = 0.
+                else:
+                    self._sleep_time[i] = 0.
+        elif self._sleeping.any():
+            self.wake_up()
+
+        for j in self._iter_awake_joints():
             j.integrate(self._gvel[j.dof], dt)
         self._current_time += dt
 
@@ -1114,38 +1684,84 @@ class _SubFrame(NamedObject, Frame):
 
         assert Hg.ishomogeneousmatrix(bpose)
         self._bpose = bpose
+        self._iadjoint = Hg.iadjoint(bpose)
+        self._moves = 0
+        self._cache = {}
+        self._cache_stamp = None
         if not(isinstance(body, Body)):
             raise ValueError(
             "The ``body`` argument must be an instance of the ``Boby`` class")
         else:
             self._body = body
 
+    @property
+    def stamp(self):
+        """ A value which changes whenever the frame pose, twist or
+        jacobians may have changed, see :attr:`Body.stamp`."""
+        return (self._body._generation, self._moves)
+
+    def _valid_cache(self):
+        """ Return the dict of the models computed at the current
+        :attr:`stamp`.
+
+        The cached arrays are read-only, since they are shared by all the
+        readers of the same stamp: they must be copied to be modified.
+        """
+        stamp = (self._body._generation, self._moves)
+        if stamp != self._cache_stamp:
+            self._cache.clear()
+            self._cache_stamp = stamp
+        return self._cache
+
+    def _store(self, key, value):
+        value.flags.writeable = False
+        self._cache[key] = value
+        return value
+
     @property
     def pose(self):
         try:
-            return dot(self._body.pose, self._bpose)
+            return self._valid_cache()['pose']
+        except KeyError:
+            pass
+        try:
+            return self._store('pose', dot(self._body.pose, self._bpose))
         except TypeError:
             raise TypeError("pose is not up to date, run world.update_geometric() first.")
 
     @property
     def twist(self):
         try:
-            return dot(Hg.iadjoint(self._bpose), self._body.twist)
+            return self._valid_cache()['twist']
+        except KeyError:
+            pass
+        try:
+            return self._store('twist', dot(self._iadjoint, self._body.twist))
         except TypeError:
             raise TypeError("twist is not up to date, run world.update_dynamic() first.")
 
     @property
     def jacobian(self):
         try:
-            return dot(Hg.iadjoint(self._bpose), self._body.jacobian)
+            return self._valid_cache()['jacobian']
+        except KeyError:
+            pass
+        try:
+            return self._store('jacobian',
+                               dot(self._iadjoint, self._body.jacobian))
         except TypeError:
             raise TypeError("jacobian is not up to date, run world.update_dynamic() first.")
 
     @property
     def djacobian(self):
+        try:
+            return self._valid_cache()['djacobian']
+        except KeyError:
+            pass
         try:
             # we assume self._bpose is constant
-            return dot(Hg.iadjoint(self._bpose), self._body.djacobian)
+            return self._store('djacobian',
+                               dot(self._iadjoint, self._body.djacobian))
         except TypeError:
             raise TypeError("djacobian is not up to date, run world.update_dynamic() first.")
 
@@ -1169,6 +1785,8 @@ class MovingSubFrame(_SubFrame):
     def bpose(self, bpose):
         assert Hg.ishomogeneousmatrix(bpose)
         self._bpose[:] = bpose
+        self._iadjoint = Hg.iadjoint(self._bpose)
+        self._moves += 1
 
 class Body(NamedObject, Frame):
 
@@ -1194,6 +1812,9 @@ class Body(NamedObject, Frame):
         self._djacobian     = None # updated by update_dynamic
         self._twist         = None # updated by update_dynamic
         self._nleffects     = None # updated by update_dynamic
+        self._generation    = 0    # incremented by update_{geometric,dynamic}
+        self._ipose         = None
+        self._ipose_generation = None
 
     def iter_descendant_bodies(self):
         """ Iterate over all descendant bodies, with a depth-first strategy. """
@@ -1226,6 +1847,37 @@ class Body(NamedObject, Frame):
     def pose(self):
         return self._pose
 
+    @property
+    def ipose(self):
+        """ The inverse of the body pose, computed at most once per
+        :attr:`stamp`."""
+        if self._ipose_generation != self._generation:
+            self._ipose = Hg.inv(self._pose)
+            self._ipose_generation = self._generation
+        return self._ipose
+
+    @property
+    def stamp(self):
+        """ A value which changes whenever the body pose, twist or
+        jacobians are updated.
+
+        The models derived from them (such as the :class:`SubFrame` ones,
+        or the results of :func:`arboris.collisions.collide`) are computed
+        at most once per stamp. The bodies of sleeping subtrees are not
+        updated and keep their stamp.
+
+        **Example:**
+
+        >>> w = simplearm()
+        >>> b = w.getbodies()[1]
+        >>> s = b.stamp
+        >>> w.update_dynamic()
+        >>> b.stamp == s
+        False
+
+        """
+        return self._generation
+
     @property
     def jacobian(self):
         return self._jacobian
@@ -1270,6 +1922,7 @@ class Body(NamedObject, Frame):
 
         """
         self._pose = pose
+        self._generation += 1
         H_gp = pose
         for j in self.childrenjoints:
             H_cn = j.frame1.bpose
@@ -1279,7 +1932,7 @@ class Body(NamedObject, Frame):
             child_pose = dot(H_gp, H_pc)
             j.frame1.body.update_geometric(child_pose)
 
-    def update_dynamic(self, pose, jac, djac, twist):
+    def update_dynamic(self, pose, jac, djac, twist, childrenjoints=None):
         r""" Compute the body ``pose, jac, djac, twist`` and its children ones.
 
         This method (1) sets the body dynamical model (pose, jacobian,
@@ -1298,6 +1951,8 @@ class Body(NamedObject, Frame):
         :param djac: the derivative of the body jacobian: `\dJ[b]_{b/g}`
         :param twist: the body twist: `\twist[b]_{b/g}`
         :type twist: 6 ndarray
+        :param childrenjoints: the joints whose child bodies are updated,
+            defaults to all the body children joints
 
         **Algorithm:**
 
@@ -1398,6 +2053,7 @@ class Body(NamedObject, Frame):
         self._jacobian  = jac
         self._djacobian = djac
         self._twist     = twist
+        self._generation += 1
         wx = array(
             [[             0, -self.twist[2],  self.twist[1]],
              [ self.twist[2],              0, -self.twist[0]],
@@ -1416,7 +2072,9 @@ class Body(NamedObject, Frame):
         J_pg  = jac
         dJ_pg = djac
         T_pg  = twist
-        for j in self.childrenjoints:
+        if childrenjoints is None:
+            childrenjoints = self.childrenjoints
+        for j in childrenjoints:
             H_cn = j.frame1.bpose
             H_pr = j.frame0.bpose
             H_rn = j.pose
@@ -1441,8 +2099,29 @@ class Body(NamedObject, Frame):
 
 
 class Observer(NamedObject):
+    """ A generic class for the observers of a simulation, see
+    :func:`simulate`.
+
+    By default, the ``update`` method is called at each time step. An
+    observer which does not need that rate may set its ``decimation``
+    attribute to `n`, it is then updated every `n` steps, starting from
+    the step given by its ``phase`` attribute (`0 \leq phase < n`), so
+    that several decimated observers may be spread over the steps. The
+    decimation may also be given as a ``period`` (in seconds), which is
+    then rounded to a multiple of the first time step.
+
+    The ``dt`` argument of ``update`` is the duration until the next time
+    of the observer timeline (see :func:`simulate`), that is the physics
+    time step, or `n` times that step for a decimated observer (but
+    for its last update, which may be shorter).
+
+    """
     __metaclass__ = ABCMeta
 
+    decimation = 1
+    phase = 0
+    period = None
+
     def __init__(self, name=None):
         NamedObject.__init__(self, name)
 
@@ -1460,13 +2139,16 @@ class Observer(NamedObject):
 
 
 
-def simulate(world, timeline, observers=()):
+def simulate(world, timeline, observers=(), profiler=None):
     """ Run a full simulation.
 
     :param world: the world to be simulated
     :type  world: :class:`~arboris.core.World`
     :param time: a list of distinct times
     :type  time: iterable
+    :param profiler: if not None, the
+                     :class:`~arboris.profiling.Profiler` recording the
+                     durations of the simulation phases
 
     Example:
 
@@ -1475,6 +2157,19 @@ def simulate(world, timeline, observers=()):
     >>> time = numpy.arange(0,0.01,0.001)
     >>> simulate(w, time)
 
+    Each observer is initialized with the part of the timeline it will
+    observe, which depends on its decimation (see :class:`Observer`):
+    its ``update`` method is called at each of these times, but the last
+    one.
+
+    >>> from arboris.observers import RecordJointGpos
+    >>> obs = RecordJointGpos(w.getjoints()[0])
+    >>> obs.decimation = 4
+    >>> obs.phase = 1
+    >>> simulate(w, numpy.arange(0., 0.011, 0.001), [obs])
+    >>> len(obs.get_record())
+    3
+
     """
     if isinstance(observers, dict):
         observers_list = observers.values()
@@ -1487,18 +2182,51 @@ may become a problem if any conditions depend on world.current_time')
     world._current_time = timeline[0]
     world.init()
 
+    schedule = []
     for obs in observers_list:
-        obs.init(world, timeline)
-
-    for next_time in timeline[1:]:
-        dt = next_time - world.current_time
-        world.update_dynamic()
-        world.update_controllers(dt)
-        world.update_constraints(dt)
-        for obs in observers_list:
-            obs.update(dt)
-        world.integrate(dt)
-
+        decimation = obs.decimation
+        if obs.period is not None and len(timeline) > 1:
+            decimation = max(1, int(round(
+                obs.period/(timeline[1] - timeline[0]))))
+        assert 0 <= obs.phase < decimation
+        if decimation == 1:
+            obs.init(world, timeline)
+        else:
+            obs.init(world, array(
+                list(timeline[obs.phase:-1:decimation]) + [timeline[-1]]))
+        schedule.append((obs, decimation, obs.phase))
+    if profiler is not None:
+        profiler.init(world, timeline)
+    world.profiler = profiler
+    last = len(timeline) - 1
+    try:
+        for (step, next_time) in enumerate(timeline[1:]):
+            dt = next_time - world.current_time
+            if profiler is not None:
+                profiler.start_step(step)
+            world.update_dynamic()
+            if profiler is not None:
+                profiler.lap(0)
+            world.update_controllers(dt)
+            if profiler is not None:
+                profiler.lap(1)
+            world.update_constraints(dt)
+            if profiler is not None:
+                profiler.lap(2)
+            for (obs, decimation, phase) in schedule:
+                if decimation == 1:
+                    obs.update(dt)
+                elif step % decimation == phase:
+                    obs.update(timeline[min(step + decimation, last)] -
+                               timeline[step])
+            if profiler is not None:
+                profiler.lap(3)
+            world.integrate(dt)
+            if profiler is not None:
+                profiler.lap(4)
+                profiler.end_step(world)
+    finally:
+        world.profiler = None
     for obs in observers_list:
         obs.finish()
 
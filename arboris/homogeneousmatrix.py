@@ -453,3 +453,119 @@ def rotzyx_angles(H):
     return (az, ay, ax)
 
 
+
+
+def encode(H, encoding="4x4"):
+    r""" Encode homogeneous matrices in a more compact form.
+
+    :param H: homogeneous matrix, or an array of them
+    :type  H: (...,4,4)-array
+    :param string encoding: ``"4x4"`` (the matrices are unchanged),
+                            ``"3x4"`` (the last, constant, row is dropped)
+                            or ``"quaternion"`` (the unit quaternion
+                            `(w, x, y, z)` of the rotation, with `w \geq
+                            0`, followed by the translation)
+    :return: the encoded matrices
+    :rtype: (...,4,4), (...,3,4) or (...,7)-array
+
+    The matrices are restored by :func:`decode`.
+
+    **Example:**
+
+    >>> H = rotzyx(3.14/6, 3.14/4, 3.14/3)
+    >>> H[0:3, 3] = (1., 2., 3.)
+    >>> encode(H, "3x4").shape
+    (3, 4)
+    >>> q = encode(H, "quaternion")
+    >>> print(q[4:7].tolist())
+    [1.0, 2.0, 3.0]
+    >>> numpy.allclose(decode(q), H)
+    True
+    >>> numpy.allclose(decode(encode([H, rotx(3.14)], "quaternion")),
+    ...                [H, rotx(3.14)])
+    True
+
+    """
+    H = numpy.asarray(H)
+    if encoding == "4x4":
+        return H
+    elif encoding == "3x4":
+        return H[..., 0:3, :]
+    elif encoding == "quaternion" and H.ndim == 2:
+        # faster than the general case below, for a single matrix
+        ((r00, r01, r02), (r10, r11, r12), (r20, r21, r22)) = \
+            H[0:3, 0:3].tolist()
+        squares = (1. + r00 + r11 + r22, 1. + r00 - r11 - r22,
+                   1. - r00 + r11 - r22, 1. - r00 - r11 + r22)
+        largest = squares.index(max(squares))
+        s = 2.*numpy.sqrt(max(squares[largest], tol))
+        (wx, wy, wz) = (r21 - r12, r02 - r20, r10 - r01)
+        (xy, xz, yz) = (r01 + r10, r02 + r20, r12 + r21)
+        quat = ((s*s/4., wx, wy, wz), (wx, s*s/4., xy, xz),
+                (wy, xy, s*s/4., yz), (wz, xz, yz, s*s/4.))[largest]
+        sign = -1. if quat[0] < 0. else 1.
+        return array([sign*quat[0]/s, sign*quat[1]/s, sign*quat[2]/s,
+                      sign*quat[3]/s, H[0, 3], H[1, 3], H[2, 3]])
+    elif encoding == "quaternion":
+        R = H[..., 0:3, 0:3]
+        (r00, r11, r22) = (R[..., 0, 0], R[..., 1, 1], R[..., 2, 2])
+        # 4 q_i^2, the largest one is used to compute the others
+        squares = numpy.stack((1. + r00 + r11 + r22, 1. + r00 - r11 - r22,
+                               1. - r00 + r11 - r22, 1. - r00 - r11 + r22),
+                              axis=-1)
+        largest = squares.argmax(axis=-1)
+        s = 2.*numpy.sqrt(numpy.maximum(squares.max(axis=-1), tol))
+        # 4 q_w q_i and 4 q_i q_j products, from the off-diagonal terms
+        wx = R[..., 2, 1] - R[..., 1, 2]
+        wy = R[..., 0, 2] - R[..., 2, 0]
+        wz = R[..., 1, 0] - R[..., 0, 1]
+        xy = R[..., 0, 1] + R[..., 1, 0]
+        xz = R[..., 0, 2] + R[..., 2, 0]
+        yz = R[..., 1, 2] + R[..., 2, 1]
+        rows = numpy.stack((
+            numpy.stack((s**2/4., wx, wy, wz), axis=-1),
+            numpy.stack((wx, s**2/4., xy, xz), axis=-1),
+            numpy.stack((wy, xy, s**2/4., yz), axis=-1),
+            numpy.stack((wz, xz, yz, s**2/4.), axis=-1)), axis=-2)
+        quat = numpy.take_along_axis(
+            rows, largest[..., numpy.newaxis, numpy.newaxis], axis=-2)
+        quat = quat[..., 0, :]/s[..., numpy.newaxis]
+        quat *= numpy.where(quat[..., 0] < 0., -1., 1.)[..., numpy.newaxis]
+        return numpy.concatenate((quat, H[..., 0:3, 3]), axis=-1)
+    else:
+        raise ValueError("Unknown encoding: " + str(encoding))
+
+
+def decode(T):
+    """ Decode homogeneous matrices encoded by :func:`encode`.
+
+    :param T: encoded matrices, whose encoding is given by their shape
+    :type  T: (...,4,4), (...,3,4) or (...,7)-array
+    :return: the homogeneous matrices, as float64
+    :rtype: (...,4,4)-array
+
+    """
+    T = numpy.asarray(T, dtype=float)
+    if T.shape[-2:] == (4, 4):
+        return T
+    H = zeros(T.shape[:-2 if T.shape[-2:] == (3, 4) else -1] + (4, 4))
+    H[..., 3, 3] = 1.
+    if T.shape[-2:] == (3, 4):
+        H[..., 0:3, :] = T
+    elif T.shape[-1] == 7:
+        q = T[..., 0:4]/numpy.sqrt((T[..., 0:4]**2).sum(axis=-1))[
+            ..., numpy.newaxis]
+        (w, x, y, z) = (q[..., 0], q[..., 1], q[..., 2], q[..., 3])
+        H[..., 0, 0] = 1. - 2.*(y*y + z*z)
+        H[..., 0, 1] = 2.*(x*y - w*z)
+        H[..., 0, 2] = 2.*(x*z + w*y)
+        H[..., 1, 0] = 2.*(x*y + w*z)
+        H[..., 1, 1] = 1. - 2.*(x*x + z*z)
+        H[..., 1, 2] = 2.*(y*z - w*x)
+        H[..., 2, 0] = 2.*(x*z - w*y)
+        H[..., 2, 1] = 2.*(y*z + w*x)
+        H[..., 2, 2] = 1. - 2.*(x*x + y*y)
+        H[..., 0:3, 3] = T[..., 4:7]
+    else:
+        raise ValueError("Unknown encoding of shape: " + str(T.shape))
+    return H
@@ -4,12 +4,13 @@
 __author__ = ("Sébastien BARTHÉLEMY <barthelemy@crans.org>",
               "Joseph SALINI <joseph.salini@gmail.com>")
 
-from numpy import dot, zeros, arange
+from numpy import dot, zeros, arange, load, eye
+from numpy.lib.format import open_memmap
 
 from arboris.core import Observer, MovingSubFrame, name_all_elements
 from arboris.massmatrix import principalframe
-from arboris.collisions import choose_solver
-from arboris.homogeneousmatrix import iadjoint, dAdjoint
+from arboris.collisions import choose_solver, collide
+from arboris.homogeneousmatrix import iadjoint, dAdjoint, encode
 
 
 from pylab import plot, show, legend, xlabel, ylabel, title
@@ -17,9 +18,14 @@ from pylab import plot, show, legend, xlabel, ylabel, title
 
 import pickle as pkl
 import h5py
+import json
+import os
+import sys
 
 
 from   time import time as _time
+from   threading import Thread
+from   Queue import Queue, Full, Empty
 import socket
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -207,29 +213,53 @@ class SaveLogger(Observer):
     ``Joint.pose`` and whose name is taken from the joint second frame
     (``Joint.frames[1].name``).
 
+    The transforms may be saved in a more compact form, depending on the
+    ``transform_encoding`` parameter, as explained in
+    :func:`~arboris.homogeneousmatrix.encode`: ``"3x4"`` gives
+    ``(nsteps, 3, 4)`` datasets and ``"quaternion"`` gives ``(nsteps,
+    7)`` datasets. They are decoded by
+    :func:`~arboris.homogeneousmatrix.decode`. All the data but the
+    timeline are saved with the ``dtype`` data type, which may be set to
+    ``"f4"`` to halve their size.
+
+    The data are buffered in memory for the whole timeline, unless the
+    ``_block_size`` attribute is set by a subclass: the buffers then hold
+    ``_block_size`` steps, and each time they are full, the block of
+    data is given to the :meth:`write` method, which subclasses should
+    override. The ``finish`` method should do the same for the last,
+    partial, block.
+
     """
 
     def __init__(self, save_transforms=True, save_state=False, save_model=False,
-                       flat=False,  name=None):
+                       flat=False,  name=None, transform_encoding="4x4",
+                       dtype="f8"):
         """
         :param bool save_transforms: toggle the write of the ``transforms`` group
         :param bool save_state: toggle the write of the ``gpos`` and ``gvel`` groups
         :param bool save_model: toggle the write of ``model`` group
         :param bool flat: whether to save body of joint poses in the ``transforms`` group
         :param string name: the instance name of the observer
+        :param string transform_encoding: ``"4x4"``, ``"3x4"`` or ``"quaternion"``
+        :param dtype: the data type of the saved data (but the timeline)
 
         """
         Observer.__init__(self, name)
+        assert transform_encoding in ("4x4", "3x4", "quaternion")
         # what to save
         self._save_transforms = save_transforms
         self._save_state      = save_state
         self._save_model      = save_model
         self._flat            = flat
+        self._transform_encoding = transform_encoding
+        self._dtype           = dtype
         
         # recorded values
         self._world          = None
         self._nb_steps       = 0
         self._current_step   = 0
+        self._block_size     = None
+        self._block_start    = 0
         self._root           = {}
         self._timeline       = []
         self._arb_transforms = {}
@@ -242,8 +272,13 @@ class SaveLogger(Observer):
         self._world        = world
         self._nb_steps     = len(timeline)-1
         self._current_step = 0
+        self._block_start  = 0
         self._root         = {}
-        self._timeline     = zeros(self._nb_steps)
+        if self._block_size is None:
+            rows = self._nb_steps
+        else:
+            rows = min(self._block_size, self._nb_steps)
+        self._timeline     = self._new_buffer(None, "timeline", (rows,))
         self._root["timeline"] = self._timeline
 
         if self._save_state:
@@ -253,8 +288,10 @@ class SaveLogger(Observer):
             self._root['gvelocities'] = self._gvelocities
             name_all_elements(self._world.getjoints(), check_unicity=True)
             for j in self._world.getjoints():
-                self._gpositions[j.name]  = zeros((self._nb_steps,)+j.gpos.shape[:])
-                self._gvelocities[j.name] = zeros((self._nb_steps, j.ndof))
+                self._gpositions[j.name]  = self._new_buffer(
+                    'gpositions', j.name, (rows,)+j.gpos.shape[:])
+                self._gvelocities[j.name] = self._new_buffer(
+                    'gvelocities', j.name, (rows, j.ndof))
 
         if self._save_transforms:
             self._arb_transforms     = {}
@@ -274,28 +311,57 @@ class SaveLogger(Observer):
             for f in self._world.itermovingsubframes():
                 self._arb_transforms[f.name] = f
 
+            shape = encode(eye(4), self._transform_encoding).shape
             for k in self._arb_transforms.keys():
-                self._transforms[k] = zeros((self._nb_steps, 4,4))
+                self._transforms[k] = self._new_buffer(
+                    'transforms', k, (rows,)+shape)
 
         if self._save_model:
             ndof = self._world.ndof
             self._model               = {}
             self._root['model']       = self._model
-            self._model["gvel"]       = zeros((self._nb_steps, ndof))
-            self._model["mass"]       = zeros((self._nb_steps, ndof, ndof))
-            self._model["admittance"] = zeros((self._nb_steps, ndof, ndof))
-            self._model["nleffects"]  = zeros((self._nb_steps, ndof, ndof))
-            self._model["gforce"]     = zeros((self._nb_steps, ndof))
+            for (k, shape) in (("gvel", (rows, ndof)),
+                               ("mass", (rows, ndof, ndof)),
+                               ("admittance", (rows, ndof, ndof)),
+                               ("nleffects", (rows, ndof, ndof)),
+                               ("gforce", (rows, ndof))):
+                self._model[k] = self._new_buffer('model', k, shape)
+
+    def _new_buffer(self, group, name, shape):
+        """ Return a new buffer for the ``name`` data of the ``group``
+        (which is None for the timeline)."""
+        return zeros(shape, self._buffer_dtype(group))
+
+    def _buffer_dtype(self, group):
+        return "f8" if group is None else self._dtype
 
     def update(self, dt):
         """ Save the current data (state...). """
+        if self._record():
+            self.write(self._take_block(copy=False))
+
+    def snapshot(self, dt):
+        """ Save the current data and return a copy of the block of data
+        if it is full, or None. See :class:`ThreadedObserver`."""
+        if self._record():
+            return self._take_block(copy=True)
+
+    def write(self, block):
+        """ Write a block of data, as returned by :meth:`snapshot`: a tuple
+        ``(start, stop, root)`` where ``root`` holds the data of the steps
+        from ``start`` to ``stop``, with the same layout as ``_root``. """
+        pass
 
+    def _record(self):
+        """ Save the current data in the buffers and return whether the
+        current block is full. """
         assert self._current_step <= self._nb_steps
-        self._root["timeline"][self._current_step] = self._world.current_time
+        step = self._current_step - self._block_start
+        self._root["timeline"][step] = self._world.current_time
         if self._save_state:
             for j in self._world.getjoints():
-                self._gpositions[j.name][self._current_step] = j.gpos
-                self._gvelocities[j.name][self._current_step] = j.gvel
+                self._gpositions[j.name][step] = j.gpos
+                self._gvelocities[j.name][step] = j.gvel
         if self._save_transforms:
             for k, v in self._arb_transforms.items():
                 if isinstance(v, MovingSubFrame):
@@ -305,14 +371,32 @@ class SaveLogger(Observer):
                         pose = v.bpose
                 else:
                     pose = v.pose
-                self._transforms[k][self._current_step, :, :] = pose
+                self._transforms[k][step] = encode(pose,
+                                                   self._transform_encoding)
         if self._save_model:
-            self._model["gvel"][self._current_step, :]          = self._world.gvel
-            self._model["mass"][self._current_step, :, :]       = self._world.mass
-            self._model["admittance"][self._current_step, :, :] = self._world.admittance
-            self._model["nleffects"][self._current_step, :, :]  = self._world.nleffects
-            self._model["gforce"][self._current_step, :]        = self._world.gforce
+            self._model["gvel"][step, :]          = self._world.gvel
+            self._model["mass"][step, :, :]       = self._world.mass
+            self._model["admittance"][step, :, :] = self._world.admittance
+            self._model["nleffects"][step, :, :]  = self._world.nleffects
+            self._model["gforce"][step, :]        = self._world.gforce
         self._current_step += 1
+        return step + 1 == self._block_size
+
+    def _take_block(self, copy):
+        """ Return the current block of data, and start a new one."""
+        (start, stop) = (self._block_start, self._current_step)
+        if copy:
+            root = {}
+            for (k, v) in self._root.items():
+                if k == "timeline":
+                    root[k] = v[0:stop-start].copy()
+                else:
+                    root[k] = dict((kk, vv[0:stop-start].copy())
+                                   for (kk, vv) in v.items())
+        else:
+            root = self._root
+        self._block_start = stop
+        return (start, stop, root)
 
 
 class PickleLogger(SaveLogger):
@@ -325,7 +409,8 @@ class PickleLogger(SaveLogger):
 
     """
     def __init__(self, filename, mode='wb', save_transforms=True, save_state=False,
-                  save_model=False, flat=False, protocol=0, name=None):
+                  save_model=False, flat=False, protocol=0, name=None,
+                  transform_encoding="4x4", dtype="f8"):
         """
         :param string filename: the name of the pickle file where to write the data
         :param string mode: mode to open the pickle file
@@ -334,9 +419,12 @@ class PickleLogger(SaveLogger):
         :param bool save_model: toggle the write of ``model`` group
         :param bool flat: whether to save body of joint poses in the ``transforms`` group
         :param string name: the instance name of the observer
+        :param string transform_encoding: see :class:`SaveLogger`
+        :param dtype: see :class:`SaveLogger`
 
         """
-        SaveLogger.__init__(self, save_transforms, save_state, save_model, flat, name)
+        SaveLogger.__init__(self, save_transforms, save_state, save_model,
+                            flat, name, transform_encoding, dtype)
         self._filename = filename
         self._mode = mode
         self._protocol = protocol
@@ -364,9 +452,38 @@ class Hdf5Logger(SaveLogger):
 
     Here, ``gpositions, gvelocities, model, transforms`` represent hdf5 groups.
 
+    By default, the data are kept in memory and written when the simulation
+    finishes. If ``chunk_size`` is given, the datasets are created
+    resizable and chunked when the simulation starts, and the data are
+    written every ``chunk_size`` steps. The memory use is then bounded
+    (which matters when saving the model of a large world over a long
+    timeline) and, if the simulation crashes, the file holds the steps
+    written so far.
+
+    **Example:**
+
+    >>> import os, tempfile
+    >>> from arboris.core import simulate, simplearm
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'log.h5')
+    >>> w = simplearm()
+    >>> obs = Hdf5Logger(filename, save_model=True, chunk_size=4,
+    ...                  transform_encoding="quaternion", dtype="f4")
+    >>> simulate(w, arange(0., 0.01, 1e-3), [obs])
+    >>> f = h5py.File(filename, 'r')
+    >>> f['model/mass'].shape
+    (9, 3, 3)
+    >>> f['model/mass'].chunks
+    (4, 3, 3)
+    >>> (f['transforms/Hand'].shape, f['transforms/Hand'].dtype.name)
+    ((9, 7), 'float32')
+    >>> f.close()
+    >>> os.remove(filename)
+
     """
     def __init__(self, filename, group="/", mode='a', save_transforms=True,
-                   save_state=False, save_model=False, flat=False, name=None):
+                   save_state=False, save_model=False, flat=False, name=None,
+                   chunk_size=None, compression=None,
+                   transform_encoding="4x4", dtype="f8"):
         """
         :param string filename: the name of the hdf5 file where to write the data
         :param string group: the group name inside the hdf5 file where to write data
@@ -376,29 +493,328 @@ class Hdf5Logger(SaveLogger):
         :param bool save_model: toggle the write of ``model`` group
         :param bool flat: whether to save body of joint poses in the ``transforms`` group
         :param string name: the instance name of the observer
+        :param int chunk_size: if not None, the number of steps kept in
+                               memory, and of each dataset chunk
+        :param compression: the compression filter of the chunked
+                            datasets (such as ``"gzip"``), or None
+        :param string transform_encoding: see :class:`SaveLogger`
+        :param dtype: see :class:`SaveLogger`
 
         """
-        SaveLogger.__init__(self, save_transforms, save_state, save_model, flat, name)
+        SaveLogger.__init__(self, save_transforms, save_state, save_model,
+                            flat, name, transform_encoding, dtype)
         self._file = h5py.File(filename, mode)  # hdf5 file handlers
         self._h5_root = self._file
         for g in group.split('/'):
             if g:
                 self._h5_root = self._h5_root.require_group(g)
+        self._block_size = chunk_size
+        self._compression = compression
+
+    def _iter_datasets(self, root):
+        """ Iterate over the (hdf5 group, name, buffer) of the data. """
+        yield (self._h5_root, "timeline", root["timeline"])
+        for elem in root.keys():
+            if elem != "timeline":
+                g = self._h5_root.require_group(elem)
+                for k, v in root[elem].items():
+                    yield (g, k, v)
+
+    def init(self, world, timeline):
+        SaveLogger.init(self, world, timeline)
+        if self._block_size is not None:
+            for (g, k, v) in self._iter_datasets(self._root):
+                if k in g:
+                    del g[k]
+                g.create_dataset(k, (0,)+v.shape[1:], v.dtype,
+                                 maxshape=(None,)+v.shape[1:],
+                                 chunks=(self._block_size,)+v.shape[1:],
+                                 compression=self._compression)
+
+    def write(self, block):
+        (start, stop, root) = block
+        for (g, k, v) in self._iter_datasets(root):
+            dset = g[k]
+            if dset.shape[0] < stop:
+                dset.resize(stop, axis=0)
+            dset[start:stop] = v[0:stop-start]
+        self._file.flush()
 
     def finish(self):
-        dset = self._h5_root.require_dataset("timeline", (self._nb_steps,), "f8")
-        dset[:] = self._root["timeline"]
-        group_elements = list(self._root.keys())
-        group_elements.remove("timeline")
-        for elem in group_elements:
-            g = self._h5_root.require_group(elem)
-            for k, v in self._root[elem].items():
-                dset = g.require_dataset(k, (self._nb_steps, 4,4), "f8")
+        if self._block_size is None:
+            for (g, k, v) in self._iter_datasets(self._root):
+                dset = g.require_dataset(k, v.shape, v.dtype)
                 dset[:] = v
-
+        elif self._current_step > self._block_start:
+            self.write(self._take_block(copy=False))
         self._file.close()
 
 
+class MemmapLogger(SaveLogger):
+    """ A concrete class to save simulation data in memory-mapped files.
+
+    See :class:`~arboris.observers.SaveLogger` to have more info on saved data.
+
+    The data are written directly in ``.npy`` files, mapped in memory, so
+    that they can be read without loading them, using
+    ``numpy.load(filename, mmap_mode='r')``. The directory has the
+    following layout::
+
+      dirname/manifest.json
+      dirname/timeline.npy
+      dirname/gpositions/NameOfJoint0.npy
+      ...
+      dirname/model/mass.npy
+      ...
+
+    The ``manifest.json`` file gives the path of each data file, relative to
+    ``dirname``, and the number of steps which were recorded. It is written
+    when the simulation starts, with a null number of steps, and updated
+    when it finishes. :func:`load_memmap_log` reads the whole log.
+
+    **Example:**
+
+    >>> import tempfile, shutil
+    >>> from arboris.core import simulate, simplearm
+    >>> dirname = tempfile.mkdtemp()
+    >>> w = simplearm()
+    >>> simulate(w, arange(0., 0.01, 1e-3), [MemmapLogger(dirname, True,
+    ...                                                   True, True)])
+    >>> log = load_memmap_log(dirname)
+    >>> log['model']['mass'].shape
+    (9, 3, 3)
+    >>> sorted(log['gpositions'].keys())
+    [u'Elbow', u'Shoulder', u'Wrist']
+    >>> del log
+    >>> shutil.rmtree(dirname)
+
+    """
+    def __init__(self, dirname, save_transforms=True, save_state=False,
+                 save_model=False, flat=False, name=None,
+                 transform_encoding="4x4", dtype="f8"):
+        """
+        :param string dirname: the name of the directory where to write
+                               the data, which is created if needed
+        :param bool save_transforms: toggle the write of the ``transforms`` group
+        :param bool save_state: toggle the write of the ``gpos`` and ``gvel`` groups
+        :param bool save_model: toggle the write of ``model`` group
+        :param bool flat: whether to save body of joint poses in the ``transforms`` group
+        :param string name: the instance name of the observer
+        :param string transform_encoding: see :class:`SaveLogger`
+        :param dtype: see :class:`SaveLogger`
+
+        """
+        SaveLogger.__init__(self, save_transforms, save_state, save_model,
+                            flat, name, transform_encoding, dtype)
+        self._dirname = dirname
+        self._files = {}
+
+    def init(self, world, timeline):
+        self._files = {}
+        SaveLogger.init(self, world, timeline)
+        self._write_manifest(None)
+
+    def _new_buffer(self, group, name, shape):
+        if group is None:
+            path = name + '.npy'
+            self._files[name] = path
+        else:
+            path = os.path.join(group, name + '.npy')
+            self._files.setdefault(group, {})[name] = path
+        if not os.path.isdir(os.path.dirname(
+                os.path.join(self._dirname, path))):
+            os.makedirs(os.path.dirname(os.path.join(self._dirname, path)))
+        return open_memmap(os.path.join(self._dirname, path), 'w+',
+                           self._buffer_dtype(group), shape)
+
+    def _write_manifest(self, nsteps):
+        manifest = {"nsteps": nsteps, "files": self._files}
+        filename = os.path.join(self._dirname, 'manifest.json')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.rename(filename + '.tmp', filename)
+
+    def finish(self):
+        for v in self._root.values():
+            for buf in (v.values() if isinstance(v, dict) else (v,)):
+                buf.flush()
+        self._write_manifest(self._current_step)
+        self._root = {}
+        self._timeline = None
+        self._gpositions = {}
+        self._gvelocities = {}
+        self._transforms = {}
+        self._model = {}
+
+
+def load_memmap_log(dirname, mmap_mode='r'):
+    """ Load the data saved by a :class:`MemmapLogger`.
+
+    :param string dirname: the directory of the log
+    :param mmap_mode: the memory-map mode given to :func:`numpy.load`
+    :return: a dict with the same layout as the data of the
+             :class:`SaveLogger`, whose arrays are truncated to the number
+             of recorded steps. If the simulation did not finish, the
+             arrays are whole, and the steps which were not recorded are
+             zeros.
+
+    """
+    with open(os.path.join(dirname, 'manifest.json')) as f:
+        manifest = json.load(f)
+    nsteps = manifest["nsteps"]
+    def load_file(path):
+        return load(os.path.join(dirname, path), mmap_mode)[0:nsteps]
+    root = {}
+    for (k, v) in manifest["files"].items():
+        if isinstance(v, dict):
+            root[k] = dict((kk, load_file(vv)) for (kk, vv) in v.items())
+        else:
+            root[k] = load_file(v)
+    return root
+
+
+class ThreadedObserver(Observer):
+    """ Run the I/O of an observer in a background thread.
+
+    The wrapped observer must split its ``update`` method in two:
+
+    - ``snapshot(dt)``, called by :meth:`update` in the simulation
+      thread, which copies the data it needs from the world and returns
+      them, or None if there is nothing to write,
+    - ``write(data)``, called in a worker thread with the data returned by
+      ``snapshot``, which serializes them and does the I/O.
+
+    This is the case of :class:`SaveLogger` (which then writes its blocks
+    of data, see :class:`Hdf5Logger`) and of the visualization observers.
+
+    The snapshots are queued for the worker. When the queue is full, the
+    ``backpressure`` parameter tells what to do:
+
+    - ``"block"``: wait for the worker, no data are lost,
+    - ``"drop"``: drop the oldest queued snapshot, so that the worker
+      writes the latest data (suited to the visualization),
+    - ``"decimate"``: drop the new snapshot, so that the data are
+      written at the pace of the worker.
+
+    The ``dropped`` attribute counts the dropped snapshots. The
+    ``finish`` method waits for the queued snapshots to be written, then
+    calls the wrapped observer ``finish`` method. An error raised by
+    ``write`` is raised again in the simulation thread, with the
+    traceback of the worker.
+
+    The ``decimation``, ``phase`` and ``period`` attributes are those of
+    the wrapped observer.
+
+    **Example:**
+
+    >>> import os, tempfile
+    >>> from arboris.core import simulate, simplearm
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'log.h5')
+    >>> w = simplearm()
+    >>> obs = ThreadedObserver(Hdf5Logger(filename, chunk_size=4))
+    >>> simulate(w, arange(0., 0.01, 1e-3), [obs])
+    >>> f = h5py.File(filename, 'r')
+    >>> f['timeline'].shape
+    (9,)
+    >>> f.close()
+    >>> os.remove(filename)
+
+    """
+    def __init__(self, observer, maxsize=2, backpressure="block", name=None):
+        """
+        :param observer: the wrapped observer
+        :param int maxsize: the maximum number of queued snapshots
+        :param string backpressure: what to do when the queue is full,
+                                    ``"block"``, ``"drop"`` or
+                                    ``"decimate"``
+        :param string name: the instance name of the observer
+
+        """
+        assert backpressure in ("block", "drop", "decimate")
+        Observer.__init__(self, name)
+        self.observer = observer
+        self._maxsize = maxsize
+        self._backpressure = backpressure
+        self._queue = None
+        self._thread = None
+        self._error = None
+        self.dropped = 0
+
+    @property
+    def decimation(self):
+        return self.observer.decimation
+
+    @decimation.setter
+    def decimation(self, value):
+        self.observer.decimation = value
+
+    @property
+    def phase(self):
+        return self.observer.phase
+
+    @phase.setter
+    def phase(self, value):
+        self.observer.phase = value
+
+    @property
+    def period(self):
+        return self.observer.period
+
+    @period.setter
+    def period(self, value):
+        self.observer.period = value
+
+    def init(self, world, timeline):
+        self.observer.init(world, timeline)
+        self._queue = Queue(self._maxsize)
+        self._error = None
+        self.dropped = 0
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is None:
+                try:
+                    self.observer.write(data)
+                except Exception:
+                    self._error = sys.exc_info()
+
+    def _check_error(self):
+        if self._error is not None:
+            (cls, value, tb) = self._error
+            raise cls, value, tb
+
+    def update(self, dt):
+        self._check_error()
+        data = self.observer.snapshot(dt)
+        if data is None:
+            return
+        if self._backpressure == "block":
+            self._queue.put(data)
+            return
+        try:
+            self._queue.put_nowait(data)
+        except Full:
+            self.dropped += 1
+            if self._backpressure == "drop":
+                try:
+                    self._queue.get_nowait()
+                except Empty:
+                    pass
+                self._queue.put_nowait(data)
+
+    def finish(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._check_error()
+        self.observer.finish()
+
+
 
 class SocketCom(Observer):
     """ An abstract observer that can communicate with another application through sockets.
@@ -665,12 +1081,16 @@ class RecordDistance(_Recorder):
         This recorder works only if a distance solver for these two shapes
         is returned by :meth:`~arboris.collisions.choose_solver`.
 
+        The distance is computed by :func:`~arboris.collisions.collide`,
+        hence the result of a contact between the same shapes, with the
+        same solver, is reused.
+
         """
         _Recorder.__init__(self, name)
         self.shapes, self.solver = choose_solver(sh1, sh2)
 
     def update(self, dt):
-        dist = self.solver(self.shapes)[0]
+        dist = collide(self.shapes, self.solver)[0]
         self.save_data(dist)
 
 
@@ -0,0 +1,201 @@
+# coding=utf-8
+
+""" Profiling of the simulations.
+
+A :class:`Profiler` given to :func:`arboris.core.simulate` records the
+duration of each phase of the time steps, of the update of each
+controller and constraint, and the iterations of the constraint solver.
+
+"""
+
+__author__ = ("Sébastien BARTHÉLEMY <barthelemy@crans.org>")
+
+import timeit
+from numpy import zeros, percentile, arange, hstack
+
+
+class Profiler(object):
+    """ Record where the time of a simulation is spent.
+
+    The durations (in seconds) are stored for each time step in arrays,
+    which are allocated when the simulation starts:
+
+    - ``phase_times`` (nsteps, 5): the duration of each phase of the
+      time step, whose names are given by :attr:`phases`,
+    - ``controller_times`` (nsteps, ncontrollers): the duration of the
+      ``update`` method of each controller,
+    - ``constraint_times`` (nsteps, nconstraints): the duration of the
+      ``update`` method of each constraint (which runs the collision
+      solvers of the contacts), the constraints of sleeping bodies being
+      skipped,
+    - ``iterations`` (nsteps,) and ``residuals`` (nsteps,): the
+      iterations and residual of the constraint solver, see
+      :attr:`arboris.core.World.constraint_iterations`.
+
+    The controllers and constraints are given, in the order of the
+    columns, by the ``controllers`` and ``constraints`` attributes. Those
+    registered after the simulation started get a new column, whose
+    durations are zero for the previous steps.
+
+    When no profiler is given to :func:`arboris.core.simulate`, the cost
+    of these hooks is a test per phase, controller and constraint.
+
+    **Example:**
+
+    >>> from arboris.core import simulate, simplearm
+    >>> from arboris.controllers import WeightController
+    >>> w = simplearm()
+    >>> w.register(WeightController())
+    >>> profiler = Profiler()
+    >>> simulate(w, arange(0., 0.01, 0.001), profiler=profiler)
+    >>> profiler.phase_times.shape
+    (9, 5)
+    >>> profiler.controller_times.shape
+    (9, 1)
+    >>> print(profiler.summary()) #doctest: +ELLIPSIS
+    phase                  total (s)  mean (s)   max (s)
+    update_dynamic         ...
+    update_controllers     ...
+    update_constraints     ...
+    observers              ...
+    integrate              ...
+    WeightController       ...
+    >>> sorted(profiler.percentiles((50, 99)).keys())
+    ['integrate', 'observers', 'update_constraints', 'update_controllers', 'update_dynamic']
+
+    """
+
+    phases = ('update_dynamic', 'update_controllers', 'update_constraints',
+              'observers', 'integrate')
+
+    def __init__(self, timer=timeit.default_timer):
+        """
+        :param timer: the function returning the current time
+
+        """
+        self._timer = timer
+        self.controllers = []
+        self.constraints = []
+        self.phase_times = zeros((0, len(self.phases)))
+        self.controller_times = zeros((0, 0))
+        self.constraint_times = zeros((0, 0))
+        self.iterations = zeros(0, dtype=int)
+        self.residuals = zeros(0)
+        self._index = {}
+        self._step = 0
+        self._lap = None
+        self._start = None
+
+    def init(self, world, timeline):
+        """ Allocate the arrays, this is called by
+        :func:`~arboris.core.simulate`. """
+        nsteps = len(timeline) - 1
+        self.controllers = list(world.getcontrollers())
+        self.constraints = list(world.getconstraints())
+        self._index = {}
+        for items in (self.controllers, self.constraints):
+            for (i, item) in enumerate(items):
+                self._index[item] = i
+        self.phase_times = zeros((nsteps, len(self.phases)))
+        self.controller_times = zeros((nsteps, len(self.controllers)))
+        self.constraint_times = zeros((nsteps, len(self.constraints)))
+        self.iterations = zeros(nsteps, dtype=int)
+        self.residuals = zeros(nsteps)
+        self._step = 0
+
+    def start_step(self, step):
+        """ Start the timing of a time step. """
+        self._step = step
+        self._lap = self._timer()
+
+    def lap(self, phase):
+        """ Record the duration of the ``phase``-th phase, which has just
+        ended. """
+        now = self._timer()
+        self.phase_times[self._step, phase] = now - self._lap
+        self._lap = now
+
+    def start_item(self):
+        """ Start the timing of a controller or constraint update. """
+        self._start = self._timer()
+
+    def controller_done(self, controller):
+        """ Record the duration of a controller update. """
+        duration = self._timer() - self._start
+        if controller not in self._index:
+            self.controller_times = self._add_column(
+                self.controllers, controller, self.controller_times)
+        self.controller_times[self._step, self._index[controller]] = duration
+
+    def constraint_done(self, constraint):
+        """ Record the duration of a constraint update. """
+        duration = self._timer() - self._start
+        if constraint not in self._index:
+            self.constraint_times = self._add_column(
+                self.constraints, constraint, self.constraint_times)
+        self.constraint_times[self._step, self._index[constraint]] = duration
+
+    def _add_column(self, items, item, times):
+        """ Index an item registered after :meth:`init` and return its
+        durations array, with a new column. """
+        self._index[item] = len(items)
+        items.append(item)
+        return hstack((times, zeros((len(times), 1))))
+
+    def end_step(self, world):
+        """ Record the constraint solver iterations of the time step. """
+        self.iterations[self._step] = world.constraint_iterations
+        self.residuals[self._step] = world.constraint_residual
+
+    def _named_times(self):
+        """ Return a list of (name, durations) tuples. """
+        times = [(name, self.phase_times[:, i])
+                 for (i, name) in enumerate(self.phases)]
+        for (items, array) in ((self.controllers, self.controller_times),
+                               (self.constraints, self.constraint_times)):
+            for (i, item) in enumerate(items):
+                name = item.name or item.__class__.__name__
+                times.append((name, array[:, i]))
+        return times
+
+    def summary(self):
+        """ Return a table of the total, mean and max duration of each
+        phase, controller and constraint. """
+        lines = ['{0:<22} {1:<10} {2:<10} {3}'.format(
+            'phase', 'total (s)', 'mean (s)', 'max (s)')]
+        for (name, times) in self._named_times():
+            if len(times):
+                lines.append('{0:<22} {1:<10.3g} {2:<10.3g} {3:.3g}'.format(
+                    name, times.sum(), times.mean(), times.max()))
+        if len(self.iterations):
+            lines.append('solver iterations: mean {0:.3g}, max {1}'.format(
+                self.iterations.mean(), self.iterations.max()))
+        return '\n'.join(lines)
+
+    def percentiles(self, q=(50, 90, 99)):
+        """ Return a dict of the ``q`` percentiles of the durations of
+        each phase. """
+        return dict((name, percentile(self.phase_times[:, i], q))
+                    for (i, name) in enumerate(self.phases))
+
+    def save_hdf5(self, filename, group="/", mode='a'):
+        """ Save the recorded arrays in an hdf5 file.
+
+        The controllers and constraints names are saved as the ``names``
+        attribute of their datasets.
+
+        """
+        import h5py
+        with h5py.File(filename, mode) as f:
+            root = f.require_group(group)
+            for name in ('phase_times', 'controller_times',
+                         'constraint_times', 'iterations', 'residuals'):
+                if name in root:
+                    del root[name]
+                root.create_dataset(name, data=getattr(self, name))
+            root['phase_times'].attrs['names'] = list(self.phases)
+            for (name, items) in (('controller_times', self.controllers),
+                                  ('constraint_times', self.constraints)):
+                root[name].attrs['names'] = [
+                    str(item.name or item.__class__.__name__)
+                    for item in items]
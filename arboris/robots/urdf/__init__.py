@@ -18,6 +18,7 @@ np.set_printoptions(suppress=True)
 #import scipy.linalg
 
 import os
+import tempfile
 
 import arboris.visu
 arboris_simple_shapes_path = os.path.dirname(arboris.visu.__file__) + os.sep + "simple_shapes.dae"
@@ -128,7 +129,12 @@ def to_arboris( obj , default=None):
 
     elif isinstance(obj, urdf_parser.Mesh):
         mesh_path = obj.filename
-        scale = 1 if obj.scale is None else [float(v) for v in obj.scale.split()]
+        if obj.scale is None:
+            scale = 1
+        elif isinstance(obj.scale, basestring):
+            scale = [float(v) for v in obj.scale.split()]
+        else:
+            scale = [float(v) for v in obj.scale]
         return {"shape": "mesh", "mesh_from_urdf": mesh_path,  "scale": scale}
 
     elif isinstance(obj, urdf_parser.Box):
@@ -158,8 +164,11 @@ def to_arboris( obj , default=None):
 class URDFConverter(object):
     """
     """
-    def __init__(self, urdf_file_name=None, world=None, H_init=None, fixed_base=False, prefix="", suffix="", root_joint_name="root_joint", save_joint_limits=True):
+    def __init__(self, urdf_file_name=None, world=None, H_init=None, fixed_base=False, prefix="", suffix="", root_joint_name="root_joint", save_joint_limits=True, mesh_cache_dir=None):
         """
+        The collision meshes are loaded as :class:`arboris.shapes.TriangleMesh`,
+        whose bounding volume hierarchies are cached in ``mesh_cache_dir``
+        (which defaults to a directory in the system temporary directory).
         """
         self.urdf_file_name = urdf_file_name
         self.robot          = None
@@ -171,6 +180,9 @@ class URDFConverter(object):
         self.suffix = suffix
         self.root_joint_name   = root_joint_name
         self.save_joint_limits = save_joint_limits
+        if mesh_cache_dir is None:
+            mesh_cache_dir = os.path.join(tempfile.gettempdir(), "arboris_meshes")
+        self.mesh_cache_dir = mesh_cache_dir
 
         if urdf_file_name is not None:
             self.parseURDF(urdf_file_name)
@@ -204,7 +216,7 @@ class URDFConverter(object):
             # visual shapes can be loaded later with function 'get_visual_shapes'
             collision = to_arboris(urdf_body.collision, None)
             
-            if collision and (collision["shape"] is not "mesh"):
+            if collision:
 
                 H_body_shape = collision["transform"]
                 shape_frame = arboris.core.SubFrame( list_of_bodies[name], H_body_shape )
@@ -219,11 +231,18 @@ class URDFConverter(object):
                     length = collision["scale"][2]
                     radius = collision["scale"][0]
                     shape = arboris.shapes.Cylinder( shape_frame, length, radius )
+                elif collision["shape"] == "mesh":
+                    shape = self.load_mesh(shape_frame, collision["mesh_from_urdf"], collision["scale"])
+                    if shape is None:
+                        continue
 
                 world.register(shape)
 
 
         # save all joints
+        limited_joints = []
+        lower_limits   = []
+        upper_limits   = []
         for joint_name, urdf_joint in self.robot.joints.items():
 
             name = self.prefix + joint_name + self.suffix
@@ -255,13 +274,19 @@ class URDFConverter(object):
                     upper = urdf_joint.limits.upper
                     
                     if (lower is not None) and (upper is not None):
-                        constraint = arboris.constraints.JointLimits(joint_instance, lower, upper)
-                        
-                        world.register(constraint)
+                        limited_joints.append(joint_instance)
+                        lower_limits.append(lower)
+                        upper_limits.append(upper)
 
                 else:
                     print "WARNING: cannot save joint limit constraint for joint "+joint_name+" ("+urdf_joint.joint_type+")"
 
+        # all the joints limits are enforced by a single constraint
+        if len(limited_joints) > 0:
+            name = self.prefix + "joint_limits" + self.suffix
+            constraint = arboris.constraints.WorldJointLimits(limited_joints, lower_limits, upper_limits, name=name)
+            world.register(constraint)
+
 
         # connect the root body of the robot with the ground frame
         root_body = list_of_bodies[self.robot.get_root()]
@@ -279,6 +304,20 @@ class URDFConverter(object):
         world.init()
 
 
+    def load_mesh(self, frame, mesh_file_name, scale=1):
+        """
+        Return a :class:`arboris.shapes.TriangleMesh` from a mesh file, whose
+        name is relative to the URDF file, or None if its format is not
+        supported (only STL files are).
+        """
+        urdf_path = os.path.dirname(self.urdf_file_name) + os.sep
+        if not mesh_file_name.lower().endswith(".stl"):
+            print "WARNING: cannot load collision mesh "+mesh_file_name+", only STL files are supported"
+            return None
+        vertices, triangles = arboris.shapes.read_stl(urdf_path + mesh_file_name)
+        vertices = vertices * np.array(scale)
+        return arboris.shapes.TriangleMesh(frame, vertices, triangles, cache_dir=self.mesh_cache_dir)
+
     def get_visual_shapes(self):
         """
         """
@@ -4,8 +4,12 @@
 __author__ = ("Sébastien BARTHÉLEMY <barthelemy@crans.org>")
 
 from arboris.core import Shape
-from numpy import array
+from numpy import array, arange, argmax, argsort, int64, load, savez, \
+                  fromstring, dtype, unique, cross, zeros, arccos, add, \
+                  newaxis
 from numpy.linalg import norm
+from hashlib import sha1
+import os
 
 class Plane(Shape):
     """ A plane.
@@ -30,6 +34,39 @@ class Plane(Shape):
         n = norm(coeffs[0:3])
         self.coeffs = coeffs/n
 
+class HeightField(Shape):
+    r""" A height field, such as a terrain.
+
+    The heights are sampled on a regular grid in the `xz`-plane of the
+    ``frame``, the `y`-axis being the vertical: ``heights[i, j]`` is the
+    height at `x = i \; s_x` and `z = j \; s_z`, where `(s_x, s_z)` is the
+    ``spacing``. Each grid cell is split in two triangles by its diagonal
+    from `(i, j)` to `(i+1, j+1)`.
+
+    The collision solvers only read the heights of the cell below the
+    other shape, so the heights can be a :class:`numpy.memmap`, such as
+    returned by ``numpy.load(filename, mmap_mode='r')``, for maps which
+    do not fit in memory.
+
+    """
+
+    def __init__(self, frame, heights, spacing=(1., 1.), name=None):
+        r"""
+        :param frame: the frame the shape is attached to
+        :type  frame: :class:`~arboris.core.Frame`
+        :param heights: the heights, which are not copied
+        :type  heights: (n_x, n_z)-array, with `n_x, n_z \geq 2`
+        :param spacing: the grid spacing `(s_x, s_z)`
+        :type  spacing: (2,)-array
+        :param string name: the shape's name
+
+        """
+        assert heights.ndim == 2
+        assert heights.shape[0] >= 2 and heights.shape[1] >= 2
+        Shape.__init__(self, frame, name)
+        self.heights = heights
+        self.spacing = array(spacing, dtype=float)
+
 class Point(Shape):
     """ A point. """
 
@@ -92,3 +129,199 @@ class Sphere(Shape):
         Shape.__init__(self, frame, name)
         self.radius = radius
 
+
+
+class ConvexHull(Shape):
+    """ The convex hull of a set of points.
+
+    It is handled by the :class:`~arboris.collisions.ConvexCollision`
+    solver, as a box or a cylinder.
+
+    """
+
+    def __init__(self, frame, vertices, name=None):
+        """
+        :param frame: the frame the shape is attached to
+        :type  frame: :class:`~arboris.core.Frame`
+        :param vertices: the points, in the ``frame`` coordinates
+        :type  vertices: (n,3)-array
+        :param string name: the shape's name
+
+        """
+        Shape.__init__(self, frame, name)
+        self.vertices = array(vertices, dtype=float)
+
+
+class TriangleMesh(Shape):
+    """ A triangle mesh, which may be non-convex.
+
+    The closed meshes are assumed to have their triangles oriented
+    counter-clockwise when seen from the outside.
+
+    Collision queries rely on a bounding volume hierarchy (BVH) of
+    axis-aligned boxes, whose leaves hold at most ``leaf_size`` triangles,
+    and which is stored in the ``bvh`` dict of arrays:
+
+    - ``lower`` and ``upper``: the (k,3)-arrays of the boxes corners,
+    - ``children``: the (k,2)-array of the children nodes indices, or -1
+      for the leaves,
+    - ``start`` and ``count``: the range of the triangles of each leaf
+      in ``order``,
+    - ``order``: the triangles indices, sorted by leaf.
+
+    The inside of a closed mesh is told by the angle-weighted
+    pseudo-normals of its triangles, edges and vertices (see Bærentzen, J.
+    A. and Aanæs, H.: "Signed distance computation using the angle
+    weighted pseudonormal", IEEE TVCG, 2005), which are stored in the
+    ``face_normals`` and ``vertex_normals`` arrays, and in the
+    ``edge_normals`` dict, whose keys are the sorted vertices indices of
+    the edges.
+
+    Building the BVH may take a while for large meshes. If ``cache_dir``
+    is given, the BVH is saved there as a ``.npz`` file named after a
+    hash of the mesh, and loaded from it the next time the same mesh is
+    used.
+
+    **Example:**
+
+    >>> from arboris.core import World
+    >>> w = World()
+    >>> vertices = [(0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.)]
+    >>> triangles = [(0, 2, 1), (0, 1, 3), (0, 3, 2), (1, 2, 3)]
+    >>> mesh = TriangleMesh(w.ground, vertices, triangles, leaf_size=2)
+    >>> print(mesh.bvh['children'])
+    [[ 1  2]
+     [-1 -1]
+     [-1 -1]]
+
+    """
+
+    def __init__(self, frame, vertices, triangles, name=None, leaf_size=4,
+                 cache_dir=None):
+        """
+        :param frame: the frame the shape is attached to
+        :type  frame: :class:`~arboris.core.Frame`
+        :param vertices: the vertices, in the ``frame`` coordinates
+        :type  vertices: (n,3)-array
+        :param triangles: the vertices indices of each triangle
+        :type  triangles: (m,3)-array
+        :param string name: the shape's name
+        :param int leaf_size: the maximum number of triangles in a BVH leaf
+        :param string cache_dir: the directory of the BVH cache, or None
+
+        """
+        Shape.__init__(self, frame, name)
+        self.vertices = array(vertices, dtype=float)
+        self.triangles = array(triangles, dtype=int64)
+        key = sha1(self.vertices.tostring())
+        key.update(self.triangles.tostring())
+        key.update(str(leaf_size))
+        filename = None
+        if cache_dir is not None:
+            filename = os.path.join(cache_dir, key.hexdigest() + '.npz')
+        if filename is not None and os.path.exists(filename):
+            data = load(filename)
+            self.bvh = dict((k, data[k]) for k in data.files)
+            data.close()
+        else:
+            self.bvh = _build_bvh(self.vertices, self.triangles, leaf_size)
+            if filename is not None:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                # write then rename, so that a partial file is never loaded
+                tmp = filename[:-len('.npz')] + '.tmp.npz'
+                savez(tmp, **self.bvh)
+                os.rename(tmp, filename)
+        (self.face_normals, self.edge_normals, self.vertex_normals) = \
+            _pseudo_normals(self.vertices, self.triangles)
+
+
+def _pseudo_normals(vertices, triangles):
+    """ Return the normals of the triangles, and the angle-weighted
+    pseudo-normals of the edges and vertices of a triangle mesh. See
+    :class:`TriangleMesh` for the returned data.
+    """
+    corners = vertices[triangles]
+    normals = cross(corners[:, 1] - corners[:, 0],
+                    corners[:, 2] - corners[:, 0])
+    lengths = norm(normals, axis=1)
+    lengths[lengths == 0.] = 1. # degenerate triangles have a null normal
+    normals /= lengths[:, newaxis]
+    edge_normals = {}
+    for (t, (a, b, c)) in enumerate(triangles):
+        for edge in ((a, b), (b, c), (c, a)):
+            edge = (min(edge), max(edge))
+            edge_normals[edge] = edge_normals.get(edge, 0.) + normals[t]
+    vertex_normals = zeros(vertices.shape)
+    for i in range(3):
+        u = corners[:, (i+1) % 3] - corners[:, i]
+        v = corners[:, (i+2) % 3] - corners[:, i]
+        lengths = norm(u, axis=1)*norm(v, axis=1)
+        lengths[lengths == 0.] = 1.
+        angles = arccos(((u*v).sum(axis=1)/lengths).clip(-1., 1.))
+        add.at(vertex_normals, triangles[:, i],
+               angles[:, newaxis]*normals)
+    return (normals, edge_normals, vertex_normals)
+
+
+def _build_bvh(vertices, triangles, leaf_size):
+    """ Build the bounding volume hierarchy of a triangle mesh.
+
+    The triangles are split at the median of their centers along the
+    largest dimension of the node. See :class:`TriangleMesh` for the
+    returned data.
+    """
+    corners = vertices[triangles]
+    lows = corners.min(axis=1)
+    highs = corners.max(axis=1)
+    centers = corners.mean(axis=1)
+    order = arange(len(triangles))
+    nodes = []
+    def build(start, stop):
+        idx = order[start:stop]
+        node = len(nodes)
+        nodes.append([lows[idx].min(axis=0), highs[idx].max(axis=0),
+                      (-1, -1), start, stop - start])
+        if stop - start > leaf_size:
+            c = centers[idx]
+            axis = argmax(c.max(axis=0) - c.min(axis=0))
+            order[start:stop] = idx[argsort(c[:, axis], kind='mergesort')]
+            middle = (start + stop)//2
+            nodes[node][2] = (build(start, middle), build(middle, stop))
+        return node
+    build(0, len(triangles))
+    return {'lower': array([n[0] for n in nodes]),
+            'upper': array([n[1] for n in nodes]),
+            'children': array([n[2] for n in nodes], dtype=int64),
+            'start': array([n[3] for n in nodes], dtype=int64),
+            'count': array([n[4] for n in nodes], dtype=int64),
+            'order': order}
+
+
+def read_stl(filename):
+    """ Read a (binary or ascii) STL file.
+
+    :param string filename: the STL file name
+    :return: a tuple (*vertices*, *triangles*) of arrays, suitable for
+             :class:`TriangleMesh`, where the duplicated vertices are
+             merged.
+
+    """
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    binary = False
+    if len(data) >= 84:
+        count = fromstring(data[80:84], dtype='<u4')[0]
+        binary = (len(data) == 84 + 50*count)
+    if binary:
+        record = dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)),
+                        ('attribute', '<u2')])
+        corners = fromstring(data[84:], dtype=record)['corners']
+    else:
+        corners = array([[float(v) for v in line.split()[1:4]]
+                         for line in data.splitlines()
+                         if line.strip().startswith('vertex')])
+    corners = array(corners, dtype=float).reshape(-1, 3)
+    (vertices, indices) = unique(corners, axis=0, return_inverse=True)
+    return (vertices, indices.reshape(-1, 3))
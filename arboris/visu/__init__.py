@@ -42,7 +42,12 @@ class pydaenimCom(Observer):
     def update(self, dt):
         """
         """
-        msg_list = ["update_transforms", self.world.current_time]
+        self.write(self.snapshot(dt))
+
+    def snapshot(self, dt):
+        """ Return the current time and transforms, see
+        :class:`~arboris.observers.ThreadedObserver`.
+        """
         frame_dict = {}
 
         if self.flat:
@@ -56,7 +61,12 @@ class pydaenimCom(Observer):
             H = f.pose if self.flat else f.bpose
             frame_dict[f.name] =  list(H[0:3, :].reshape(12))
 
-        msg_list.append(frame_dict)
+        return (self.world.current_time, frame_dict)
+
+    def write(self, data):
+        """ Send the data returned by :meth:`snapshot` to the viewer.
+        """
+        msg_list = ["update_transforms", data[0], data[1]]
         msg = json.dumps(msg_list, separators=(',',':'))
 
         try:
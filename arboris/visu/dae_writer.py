@@ -10,7 +10,7 @@ import warnings
 from arboris.core import World, name_all_elements
 from arboris.massmatrix import principalframe, transport
 from arboris.visu.world_drawer import Drawer, DrawerDriver, ColorGenerator
-from arboris.homogeneousmatrix import rotzyx_angles, zaligned
+from arboris.homogeneousmatrix import rotzyx_angles, zaligned, decode
 
 import collada
 from   collada.common import E, tag
@@ -87,6 +87,9 @@ def write_collada_animation(collada_animation, collada_scene, sim_file, file_typ
         except IOError:
             raise IOError("Cannot load file '"+sim_file+"'. It may not be a pickle file.")
 
+    for k in transforms:
+        transforms[k] = decode(transforms[k])
+
     write_collada_animation_from_transforms(collada_animation, collada_scene, timeline, transforms, precision)
 
 
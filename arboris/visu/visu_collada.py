@@ -207,20 +207,30 @@ class DaenimCom(SocketCom):
     def update(self, dt):
         """
         """
+        self.write(self.snapshot(dt))
+
+    def snapshot(self, dt):
+        """ Return a list of the current (name, transform) tuples, see
+        :class:`~arboris.observers.ThreadedObserver`.
+        """
+        transforms = []
         if self.flat:
-            msg = b""
             for b in self.world.getbodies():
-                H = b.pose
-                msg += self.packing_transform(b.name, H)
+                transforms.append((b.name, b.pose.copy()))
         else:
-            msg = ""
             for j in self.world.getjoints():
-                H = j.pose
-                msg += self.packing_transform(j.frames[1].name, H)
+                transforms.append((j.frames[1].name, j.pose.copy()))
 
         for f in self.world.itermovingsubframes():
             H = f.pose if self.flat else f.bpose
-            msg += self.packing_transform(f.name, H)
+            transforms.append((f.name, H.copy()))
+        return transforms
+
+    def write(self, transforms):
+        """ Send the transforms returned by :meth:`snapshot` to daenim.
+        """
+        msg = "".join(self.packing_transform(name, H)
+                      for (name, H) in transforms)
 
         try:
             self.conn.send(msg)
@@ -9,6 +9,10 @@ suite.addTest(_loader.loadTestsFromName('test_doctests.suite'))
 suite.addTest(_loader.loadTestsFromName('test_joints'))
 suite.addTest(_loader.loadTestsFromName('test_update_dynamic'))
 suite.addTest(_loader.loadTestsFromName('test_constraints'))
+suite.addTest(_loader.loadTestsFromName('test_observers'))
+suite.addTest(_loader.loadTestsFromName('test_profiling'))
+suite.addTest(_loader.loadTestsFromName('test_shapes'))
+suite.addTest(_loader.loadTestsFromName('test_urdf'))
 suite.addTest(_loader.loadTestsFromName('test_visu_collada'))
 
 if __name__ == "__main__":
@@ -1,12 +1,35 @@
 # coding=utf-8
 
 import unittest
+import os
+import shutil
+import tempfile
+import gc
+import weakref
 from arboristest import TestCase
-from numpy import arange, eye
-from arboris.constraints import JointLimits, BallAndSocketConstraint
+from numpy import arange, eye, array, dot, outer, ones, save, load, sqrt, \
+                  inf, isfinite
+from numpy.linalg import norm
+from arboris.constraints import JointLimits, BallAndSocketConstraint, \
+                                SoftFingerContact, HardFingerContact, \
+                                WorldJointLimits, ManifoldContact, \
+                                get_all_contacts
 from arboris.controllers import WeightController
-from arboris.core import simplearm, simulate, Body, World
+from arboris.core import simplearm, simulate, Body, World, SubFrame
+from arboris.solvers import GaussSeidel, NonlinearConjugateGradient
 from arboris.joints import FreeJoint
+from arboris.robots.simpleshapes import add_sphere, add_box, add_groundplane
+from arboris.shapes import Sphere, Box, TriangleMesh, HeightField, Plane, \
+                           Point, Cylinder
+from arboris.collisions import ConvexCollision, plane_box_manifold, \
+                               plane_box_collision, plane_sphere_collision, \
+                               mesh_point_collision, choose_solver, \
+                               distance_matrix, collide, register_solver, \
+                               sphere_sphere_collision
+import arboris.collisions
+from arboris.observers import RecordDistance
+from arboris.homogeneousmatrix import transl, roty
+from arboris.robots.human36 import add_human36
 
 class JointLimitsTestCase(TestCase):
     """Check if joint limits are enforced on a simplearm under gravity."""
@@ -31,6 +54,45 @@ class JointLimitsTestCase(TestCase):
         simulate(self.world, time)
         self.assertTrue(-3.14/2 <= self.shoulder.gpos[0])
 
+class WorldJointLimitsTestCase(TestCase):
+    """Check if joint limits are enforced on a simplearm under gravity."""
+    def setUp(self):
+        self.world = simplearm()
+        a = WeightController()
+        self.world.register(a)
+        self.joints = self.world.getjoints()
+        c = WorldJointLimits(self.joints, [-3.14/2]*3, [3.14/2]*3)
+        self.world.register(c)
+
+    def test_max_joint_limit(self):
+        for j in self.joints:
+            j.gpos[0] = 3.14/2 - 0.1
+        time = arange(0., 0.1, 1e-3)
+        simulate(self.world, time)
+        for j in self.joints:
+            self.assertTrue(3.14/2 >= j.gpos[0])
+
+    def test_min_joint_limit(self):
+        for j in self.joints:
+            j.gpos[0] = -3.14/2 + 0.1
+        time = arange(0., 0.1, 1e-3)
+        simulate(self.world, time)
+        for j in self.joints:
+            self.assertTrue(-3.14/2 <= j.gpos[0])
+
+    def test_jacobian_cache(self):
+        c = self.world.getconstraints()[0]
+        self.world.init()
+        self.joints[1].gpos[0] = 3.14/2 - 0.001
+        c.update(1e-3)
+        jacobian = c.jacobian
+        self.assertListsAlmostEqual(jacobian, [[0., 1., 0.]])
+        c.update(1e-3)
+        self.assertTrue(c.jacobian is jacobian)
+        self.joints[2].gpos[0] = -3.14/2 + 0.001
+        c.update(1e-3)
+        self.assertListsAlmostEqual(c.jacobian, [[0., 1., 0.], [0., 0., 1.]])
+
 class BallAndSocketTestCase(TestCase):
     """
     A body under gravity, fixed to the ground via a ball and socket constraint.
@@ -59,5 +121,782 @@ class BallAndSocketTestCase(TestCase):
              [0.0, 0.0, 1.0, 0.0],
              [0.0, 0.0, 0.0, 1.0]])
 
+class IslandsTestCase(TestCase):
+    """
+    Two bodies under gravity, each fixed to the ground via a ball and socket
+    constraint, solved as a whole and as two independent islands.
+    """
+
+    def simulate_forces(self, islands):
+        w = World()
+        constraints = []
+        for i in range(2):
+            b = Body(mass=eye(6))
+            w.add_link(w.ground, FreeJoint(), b)
+            constraints.append(BallAndSocketConstraint(frames=(w.ground, b)))
+            w.register(constraints[-1])
+        w.register(WeightController())
+        w.constraint_islands = islands
+        w.init()
+        w.update_dynamic()
+        dt = 0.001
+        w.update_controllers(dt)
+        w.update_constraints(dt)
+        return [c._force for c in constraints]
+
+    def runTest(self):
+        forces = self.simulate_forces(False)
+        island_forces = self.simulate_forces(True)
+        self.assertListsAlmostEqual(forces, island_forces)
+        self.assertListsAlmostEqual(island_forces[1], [ 0.  ,  9.81,  0.  ])
+
+class MatrixFreeTestCase(TestCase):
+    """
+    A sphere thrown on the ground, with contacts solved with and without
+    forming the constraints admittance matrix.
+    """
+
+    def simulate(self, matrix_free):
+        w = World()
+        add_sphere(w, radius=0.1)
+        add_groundplane(w)
+        w.register(WeightController())
+        c = SoftFingerContact(w.getshapes(), 0.5)
+        w.register(c)
+        w.constraint_matrix_free = matrix_free
+        joint = w.getjoints()[0]
+        joint.gpos[1, 3] = 0.1
+        joint.gvel[3] = 1.
+        simulate(w, arange(0., 0.05, 1e-3))
+        return joint.gpos
+
+    def runTest(self):
+        self.assertListsAlmostEqual(self.simulate(False), self.simulate(True))
+
+class OrderingTestCase(TestCase):
+    """
+    Two bodies under gravity, linked together and to the ground via ball
+    and socket constraints, solved with each constraint ordering.
+    """
+
+    def simulate_forces(self, ordering):
+        w = World()
+        (b0, b1) = (Body(mass=eye(6)), Body(mass=eye(6)))
+        w.add_link(w.ground, FreeJoint(), b0)
+        w.add_link(w.ground, FreeJoint(), b1)
+        constraints = [BallAndSocketConstraint(frames=(b0, b1)),
+                       BallAndSocketConstraint(frames=(w.ground, b1)),
+                       BallAndSocketConstraint(frames=(w.ground, b0))]
+        for c in constraints:
+            w.register(c)
+        w.register(WeightController())
+        w.constraint_ordering = ordering
+        w.init()
+        w.update_dynamic()
+        dt = 0.001
+        w.update_controllers(dt)
+        w.update_constraints(dt, maxiters=500, tol=1e-12)
+        self.assertTrue(w.constraint_iterations > 1)
+        return [dot(c.jacobian.T, c._force) for c in constraints]
+
+    def runTest(self):
+        gforce = sum(self.simulate_forces(None))
+        for ordering in ('ground', 'depth', 'coloring'):
+            self.assertListsAlmostEqual(
+                gforce, sum(self.simulate_forces(ordering)))
+        self.assertRaises(ValueError, self.simulate_forces, 'unknown')
+
+class BudgetTestCase(TestCase):
+    """Constraints solved within a wall-clock time budget."""
+
+    def simulate(self, budget):
+        w = World()
+        add_sphere(w, radius=0.1)
+        add_groundplane(w)
+        w.register(WeightController())
+        w.register(SoftFingerContact(w.getshapes(), 0.5))
+        w.constraint_budget = budget
+        joint = w.getjoints()[0]
+        joint.gpos[1, 3] = 0.1
+        joint.gvel[3] = 1.
+        simulate(w, arange(0., 0.02, 1e-3))
+        return w
+
+    def test_budget(self):
+        w = self.simulate(None)
+        self.assertTrue(w.constraint_residual < 1e-4)
+        w_budget = self.simulate(10.)
+        self.assertListsAlmostEqual(w.getjoints()[0].gpos,
+                                    w_budget.getjoints()[0].gpos)
+        # with no time at all, the solver still does two iterations to
+        # estimate the residual
+        w_budget = self.simulate(0.)
+        self.assertEqual(w_budget.constraint_iterations, 2)
+        self.assertTrue(w_budget.constraint_residual < float('inf'))
+
+    def test_max_tol(self):
+        # a hanging chain, whose constraints cannot be solved in two
+        # iterations: the budget is exceeded at each step and the
+        # tolerance is relaxed up to its cap
+        w = World()
+        (b0, b1) = (Body(mass=eye(6)), Body(mass=eye(6)))
+        w.add_link(w.ground, FreeJoint(), b0)
+        j = FreeJoint()
+        w.add_link(w.ground, j, b1)
+        j.gpos[1, 3] = -1.
+        for f in ((SubFrame(w.ground, transl(0., 0.5, 0.)),
+                   SubFrame(b0, transl(0., 0.5, 0.))),
+                  (SubFrame(b0, transl(0., -0.5, 0.)),
+                   SubFrame(b1, transl(0., 0.5, 0.)))):
+            w.register(f[0])
+            w.register(f[1])
+            w.register(BallAndSocketConstraint(frames=f))
+        w.register(WeightController())
+        w.constraint_budget = 0.
+        w.constraint_max_tol = 1e-6
+        w.init()
+        tols = []
+        for i in range(40):
+            w.update_dynamic()
+            w.update_controllers(1e-3)
+            w.update_constraints(1e-3, tol=1e-8)
+            tols.append(w._constraint_tol)
+            w.integrate(1e-3)
+        self.assertEqual(max(tols), 1e-6)
+        self.assertEqual(tols[-1], 1e-6)
+
+class SolversTestCase(TestCase):
+    """
+    A chain of bodies under gravity, hanging from the ground via ball and
+    socket constraints, solved with each constraint solver.
+    """
+
+    def solve(self, solver):
+        w = World()
+        bodies = []
+        for i in range(5):
+            b = Body(mass=eye(6))
+            j = FreeJoint()
+            w.add_link(w.ground, j, b)
+            j.gpos[1, 3] = -float(i)
+            bodies.append(b)
+        frames = [(SubFrame(w.ground, transl(0., 0.5, 0.)),
+                   SubFrame(bodies[0], transl(0., 0.5, 0.)))]
+        for (b0, b1) in zip(bodies[:-1], bodies[1:]):
+            frames.append((SubFrame(b0, transl(0., -0.5, 0.)),
+                           SubFrame(b1, transl(0., 0.5, 0.))))
+        for f in frames:
+            w.register(f[0])
+            w.register(f[1])
+            w.register(BallAndSocketConstraint(frames=f))
+        w.register(WeightController())
+        w.constraint_solver = solver
+        w.init()
+        w.update_dynamic()
+        w.update_controllers(1e-3)
+        w.update_constraints(1e-3, tol=1e-8)
+        self.assertTrue(w.constraint_residual < 1e-8)
+        self.assertTrue(w.constraint_time > 0.)
+        return (w.constraint_iterations, w.getconstraints()[0]._force)
+
+    def runTest(self):
+        (gs_iterations, gs_force) = self.solve(GaussSeidel())
+        (cg_iterations, cg_force) = self.solve(NonlinearConjugateGradient())
+        self.assertListsAlmostEqual(gs_force, cg_force, 3)
+        self.assertListsAlmostEqual(gs_force, [0., 5*9.81, 0.], 2)
+        self.assertTrue(cg_iterations < gs_iterations)
+
+class SoftFingerSlidingTestCase(TestCase):
+    """Check the sliding solution lies on the friction ellipse."""
+
+    def runTest(self):
+        w = World()
+        add_sphere(w)
+        add_groundplane(w)
+        c = SoftFingerContact(w.getshapes(), 0.6)
+        admittance = array([[ 2.1,  0.3, -0.2,  0.4],
+                            [ 0.3,  1.5,  0.1, -0.3],
+                            [-0.2,  0.1,  1.8,  0.2],
+                            [ 0.4, -0.3,  0.2,  1.2]])
+        alpha = array([0.8, -1.1, 0.5, -0.7])
+        for x in (0., 1e-3):
+            # the second call is warm-started by the first one
+            force = c._solve_sliding(alpha + x, admittance)
+            self.assertAlmostEqual(sum(force[0:3]**2), (0.6*force[3])**2)
+            vel = alpha + x + dot(admittance, force)
+            self.assertAlmostEqual(vel[3], 0.)
+            # the sliding velocity opposes the friction force
+            s = vel[0:3]/force[0:3]
+            self.assertListsAlmostEqual(s, [s[0]]*3)
+            self.assertTrue(s[0] < 0.)
+
+class HardFingerContactTestCase(TestCase):
+    """A sphere thrown on the ground, with a hard-finger contact."""
+
+    def runTest(self):
+        w = World()
+        add_sphere(w, radius=0.1)
+        add_groundplane(w)
+        w.register(WeightController())
+        c = HardFingerContact(w.getshapes(), 0.5)
+        w.register(c)
+        joint = w.getjoints()[0]
+        joint.gpos[1, 3] = 0.1
+        joint.gvel[3] = 1.
+        simulate(w, arange(0., 0.1, 1e-3))
+        self.assertTrue((c._force[0]**2 + c._force[1]**2)**.5 <=
+                        0.5*c._force[2] + 1e-10)
+        self.assertTrue(joint.gpos[1, 3] >= 0.1 - 1e-3)
+        self.assertTrue(0. < joint.gvel[3] < 1.)
+
+class ContactPersistenceTestCase(TestCase):
+    """A sphere resting on the ground, with persistent contact frames."""
+
+    def simulate(self, persistence):
+        w = World()
+        add_sphere(w, radius=0.1)
+        add_groundplane(w)
+        w.register(WeightController())
+        c = SoftFingerContact(w.getshapes(), 0.5, persistence=persistence)
+        w.register(c)
+        calls = []
+        solver = c._collision_solver
+        def counting_solver(shapes):
+            calls.append(shapes)
+            return solver(shapes)
+        c._collision_solver = counting_solver
+        joint = w.getjoints()[0]
+        joint.gpos[1, 3] = 0.1
+        simulate(w, arange(0., 0.05, 1e-3))
+        return (joint.gpos, len(calls), c._force)
+
+    def runTest(self):
+        (gpos, ncalls, force) = self.simulate(None)
+        (p_gpos, p_ncalls, p_force) = self.simulate(1e-3)
+        self.assertEqual(ncalls, 49)
+        self.assertTrue(p_ncalls < 5)
+        self.assertListsAlmostEqual(gpos, p_gpos, 5)
+        self.assertListsAlmostEqual(force, p_force, 5)
+
+class StampCacheTestCase(TestCase):
+    """
+    A contact and a distance recorder share the narrow phase results, and
+    the subframes models are computed once per update.
+    """
+
+    def runTest(self):
+        w = World()
+        add_sphere(w, radius=0.1)
+        add_groundplane(w)
+        w.register(WeightController())
+        c = SoftFingerContact(w.getshapes(), 0.5)
+        w.register(c)
+        calls = []
+        solver = c._collision_solver
+        def counting_solver(shapes):
+            calls.append(shapes)
+            return solver(shapes)
+        c._collision_solver = counting_solver
+        obs = RecordDistance(*w.getshapes())
+        obs.shapes = c._shapes
+        obs.solver = counting_solver
+        joint = w.getjoints()[0]
+        joint.gpos[1, 3] = 0.1
+        simulate(w, arange(0., 0.05, 1e-3), [obs])
+        self.assertEqual(len(calls), 49)
+        self.assertAlmostEqual(obs.get_record()[-1], c._sdist)
+        frame = SubFrame(w.getbodies()[1], transl(0.1, 0., 0.))
+        jacobian = frame.jacobian
+        self.assertTrue(frame.jacobian is jacobian)
+        w.update_dynamic()
+        self.assertFalse(frame.jacobian is jacobian)
+        self.assertListsAlmostEqual(frame.jacobian, jacobian)
+        # the shared models are read-only
+        def move(H):
+            H[...] += 1.
+        for H in (frame.pose, frame.twist, frame.jacobian, frame.djacobian,
+                  collide(c._shapes, solver)[1]):
+            self.assertRaises(ValueError, move, H)
+        H = frame.pose.copy()
+        move(H)
+        self.assertListsAlmostEqual(frame.pose + 1., H)
+
+class SleepingTestCase(TestCase):
+    """
+    Spheres resting on the ground fall asleep, until a rolling one hits
+    them.
+    """
+
+    def simulate(self, sleep_velocity):
+        w = World()
+        add_groundplane(w)
+        for i in range(3):
+            add_sphere(w, radius=0.1)
+        w.register(WeightController())
+        for c in get_all_contacts(w, friction_coeff=0.5):
+            w.register(c)
+        w.sleep_velocity = sleep_velocity
+        w.sleep_delay = 0.02
+        joints = w.getjoints()
+        for (i, j) in enumerate(joints):
+            j.gpos[0, 3] = 0.3*i
+            j.gpos[1, 3] = 0.1
+        joints[0].gpos[0, 3] = 0.
+        joints[0].gvel[3] = 0.6
+        simulate(w, arange(0., 0.5, 2e-3))
+        return w
+
+    def runTest(self):
+        w = self.simulate(None)
+        w_sleep = self.simulate(1e-3)
+        self.assertEqual(w.sleeping_joints, [])
+        self.assertEqual(w_sleep.sleeping_joints, w_sleep.getjoints()[2:])
+        for (j, j_sleep) in zip(w.getjoints(), w_sleep.getjoints()):
+            self.assertListsAlmostEqual(j.gpos, j_sleep.gpos, 3)
+        # the sphere which was hit has moved
+        self.assertTrue(w_sleep.getjoints()[1].gpos[0, 3] > 0.31)
+        w_sleep.wake_up()
+        self.assertEqual(w_sleep.sleeping_joints, [])
+
+class ContactJacobianTestCase(TestCase):
+    """The jacobian cached by update() maps gvel to the relative twist."""
+
+    def runTest(self):
+        w = World()
+        add_sphere(w, radius=0.1)
+        add_groundplane(w)
+        c = SoftFingerContact(w.getshapes(), 0.5)
+        w.register(c)
+        joint = w.getjoints()[0]
+        joint.gpos[1, 3] = 0.1
+        joint.gvel[:] = [0.1, 0.2, 0.3, 1., -1., 0.5]
+        w.init()
+        w.update_dynamic()
+        c.update(1e-3)
+        self.assertTrue(c.is_active())
+        self.assertListsAlmostEqual(dot(c.jacobian, w.gvel), c._twist[2:6])
+
+class ContinuousContactTestCase(TestCase):
+    """
+    A fast spinning bar sweeps through a sphere in a single time step, the
+    impact is only found by a continuous contact.
+    """
+
+    def simulate(self, continuous):
+        w = World()
+        add_box(w, half_extents=(0.5, 0.02, 0.02))
+        frame = SubFrame(w.ground, transl(0.3, -0.2, 0.))
+        w.register(Sphere(frame, 0.05))
+        c = SoftFingerContact(w.getshapes(), 0.5, continuous=continuous)
+        w.register(c)
+        joint = w.getjoints()[0]
+        joint.gvel[2] = 300.
+        w.init()
+        w.update_dynamic()
+        w.update_controllers(0.01)
+        w.update_constraints(0.01)
+        w.integrate(0.01)
+        return (c, joint.gvel[2])
+
+    def runTest(self):
+        (c, omega) = self.simulate(False)
+        self.assertFalse(c.is_active())
+        self.assertAlmostEqual(omega, 300.)
+        (c, omega) = self.simulate(True)
+        self.assertTrue(c.is_active())
+        self.assertTrue(0. < c.time_of_impact < 0.01)
+        self.assertTrue(omega < 100.)
+
+class ConvexContactTestCase(TestCase):
+    """A box falls and rests on a box fixed to the ground."""
+
+    def runTest(self):
+        w = World()
+        w.register(Box(w.ground, (1., 0.1, 1.)))
+        add_box(w, half_extents=(0.1, 0.1, 0.1))
+        w.register(WeightController())
+        # the convex solver is opt-in
+        self.assertEqual(get_all_contacts(w, friction_coeff=0.5), [])
+        self.assertRaises(NotImplementedError, choose_solver,
+                          *w.getshapes())
+        contacts = get_all_contacts(w, friction_coeff=0.5, convex=True)
+        for c in contacts:
+            w.register(c)
+        self.assertEqual(len(contacts), 1)
+        self.assertTrue(isinstance(contacts[0]._collision_solver,
+                                   ConvexCollision))
+        joint = w.getjoints()[0]
+        joint.gpos[1, 3] = 0.25
+        simulate(w, arange(0., 0.3, 1e-3))
+        self.assertListsAlmostEqual(joint.gpos[0:3, 3], [0., 0.2, 0.], 4)
+
+class _Ball(Sphere):
+    pass
+
+class _SmallBall(_Ball):
+    pass
+
+def _ball_plane_collision(shapes, poses=None):
+    return plane_sphere_collision((shapes[1], shapes[0]), poses)
+
+class _BallBallCollision(object):
+    """A stateful solver, counting its calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, shapes, poses=None):
+        self.calls += 1
+        return sphere_sphere_collision(shapes, poses)
+
+class SolverDispatchTestCase(TestCase):
+    """The solvers are looked up by the shape types and their bases."""
+
+    def setUp(self):
+        register_solver(_Ball, Plane, _ball_plane_collision)
+        register_solver(_Ball, _Ball, _BallBallCollision)
+        w = World()
+        self.plane = Plane(w.ground)
+        self.balls = [_Ball(w.ground), _SmallBall(w.ground),
+                      _SmallBall(w.ground)]
+        self.sphere = Sphere(w.ground)
+        self.box = Box(w.ground)
+
+    def tearDown(self):
+        del arboris.collisions._solvers[_Ball, Plane]
+        del arboris.collisions._solvers[_Ball, _Ball]
+        arboris.collisions._dispatch.clear()
+
+    def test_register(self):
+        for b in self.balls:
+            self.assertEqual(choose_solver(b, self.plane),
+                             ((b, self.plane), _ball_plane_collision))
+        # the base classes solvers are still used for the other pairs
+        self.assertEqual(choose_solver(self.sphere, self.balls[1]),
+                         ((self.sphere, self.balls[1]),
+                          sphere_sphere_collision))
+        self.assertEqual(choose_solver(self.plane, self.sphere),
+                         ((self.plane, self.sphere), plane_sphere_collision))
+        self.assertRaises(NotImplementedError, choose_solver,
+                          Cylinder(self.plane.frame), self.balls[0])
+
+    def test_swap(self):
+        # the shapes are given in the order of the registered types
+        for b in self.balls:
+            self.assertEqual(choose_solver(self.plane, b),
+                             ((b, self.plane), _ball_plane_collision))
+        self.assertEqual(choose_solver(self.sphere, self.plane),
+                         ((self.plane, self.sphere), plane_sphere_collision))
+        self.assertEqual(choose_solver(self.box, self.plane)[0],
+                         (self.plane, self.box))
+
+    def test_instances(self):
+        (b0, b1, b2) = self.balls
+        (shapes, solver) = choose_solver(b0, b1)
+        self.assertTrue(isinstance(solver, _BallBallCollision))
+        solver(shapes, (eye(4), transl(0., 2., 0.)))
+        # the instance is kept for the ordered pair
+        self.assertTrue(choose_solver(b0, b1)[1] is solver)
+        self.assertEqual(solver.calls, 1)
+        self.assertFalse(choose_solver(b1, b0)[1] is solver)
+        self.assertFalse(choose_solver(b0, b2)[1] is solver)
+        # which does not depend on the arguments order if the shapes are
+        # swapped
+        cylinder = Cylinder(self.plane.frame)
+        solver = choose_solver(self.box, cylinder, convex=True)[1]
+        self.assertTrue(isinstance(solver, ConvexCollision))
+        self.assertTrue(
+            choose_solver(cylinder, self.box, convex=True)[1] is solver)
+        # and it does not keep the shapes alive
+        refs = map(weakref.ref, self.balls)
+        del self.balls, b0, b1, b2, shapes
+        gc.collect()
+        self.assertTrue(all(ref() is None for ref in refs))
+
+class PointPointContactTestCase(TestCase):
+    """The points of a human on the ground only collide with the plane."""
+
+    def runTest(self):
+        w = World()
+        add_groundplane(w)
+        add_human36(w)
+        contacts = get_all_contacts(w, friction_coeff=0.6)
+        self.assertEqual(len(contacts), 8)
+        for c in contacts:
+            self.assertTrue(isinstance(c._shapes[0], Plane))
+            self.assertTrue(isinstance(c._shapes[1], Point))
+
+class ManifoldContactTestCase(TestCase):
+    """
+    A box sliding on the ground behaves as four points at the corners of
+    its bottom face.
+    """
+
+    def simulate(self, manifold):
+        w = World()
+        add_groundplane(w)
+        add_box(w, half_extents=(0.2, 0.05, 0.1))
+        w.register(WeightController())
+        (ground, box) = w.itershapes()
+        if manifold:
+            contacts = [ManifoldContact((ground, box), 0.5)]
+        else:
+            contacts = []
+            for (x, z) in ((.2, .1), (.2, -.1), (-.2, .1), (-.2, -.1)):
+                frame = SubFrame(box.frame, transl(x, -0.05, z))
+                corner = Sphere(frame, 0.)
+                contacts.append(HardFingerContact((ground, corner), 0.5))
+        for c in contacts:
+            w.register(c)
+        w.init()
+        joint = w.getjoints()[0]
+        joint.gpos[1, 3] = 0.06
+        joint.gvel[3] = 0.3
+        simulate(w, arange(0., 0.3, 1e-3))
+        return joint.gpos
+
+    def runTest(self):
+        gpos = self.simulate(True)
+        self.assertListsAlmostEqual(gpos[0:3, 0:3], eye(3), 5)
+        self.assertAlmostEqual(gpos[1, 3], 0.05, 5)
+        self.assertListsAlmostEqual(gpos, self.simulate(False), 5)
+
+class PlaneOffsetTestCase(TestCase):
+    """The plane/box distances account for the plane offset."""
+
+    def setUp(self):
+        self.world = World()
+        self.plane = Plane(self.world.ground, (0., 1., 0., 1.))
+        self.world.register(self.plane)
+        add_box(self.world, half_extents=(0.4, 0.4, 0.4))
+        self.box = tuple(self.world.itershapes())[1]
+        self.joint = self.world.getjoints()[0]
+        self.joint.gpos[1, 3] = 2.
+
+    def test_distances(self):
+        self.world.update_geometric()
+        points = plane_box_manifold((self.plane, self.box))
+        self.assertEqual(len(points), 4)
+        for (sdist, H_gc0, H_gc1) in points:
+            self.assertAlmostEqual(sdist, 0.6)
+            self.assertAlmostEqual(H_gc0[1, 3], 1.)
+            self.assertAlmostEqual(H_gc1[1, 3], 1.6)
+        self.assertAlmostEqual(
+            plane_box_collision((self.plane, self.box))[0], 0.6)
+        # a sphere inscribed in the box is as far from the plane
+        sphere = Sphere(self.box.frame, 0.4)
+        self.assertAlmostEqual(
+            plane_sphere_collision((self.plane, sphere))[0], 0.6)
+
+    def test_rest(self):
+        self.world.register(WeightController())
+        self.world.register(ManifoldContact((self.plane, self.box), 0.5))
+        simulate(self.world, arange(0., 0.6, 1e-3))
+        self.assertAlmostEqual(self.joint.gpos[1, 3], 1.4, 4)
+
+class BoxBoxManifoldTestCase(TestCase):
+    """A box resting on a rotated box stays on its face."""
+
+    def runTest(self):
+        w = World()
+        frame = SubFrame(w.ground, dot(transl(0., -0.1, 0.), roty(0.3)))
+        w.register(frame)
+        w.register(Box(frame, (1., 0.1, 1.)))
+        add_box(w, half_extents=(0.1, 0.1, 0.1))
+        w.register(WeightController())
+        contacts = get_all_contacts(w, friction_coeff=0.5, manifolds=True)
+        for c in contacts:
+            w.register(c)
+        self.assertEqual(len(contacts), 1)
+        self.assertTrue(isinstance(contacts[0], ManifoldContact))
+        joint = w.getjoints()[0]
+        joint.gpos[0:3, 0:3] = roty(0.3)[0:3, 0:3]
+        joint.gpos[1, 3] = 0.105
+        simulate(w, arange(0., 0.3, 1e-3))
+        self.assertEqual(list(contacts[0]._active), [True]*4)
+        self.assertListsAlmostEqual(joint.gpos[0:3, 0:3], roty(0.3)[0:3, 0:3],
+                                    4)
+        self.assertListsAlmostEqual(joint.gpos[0:3, 3], [0., 0.1, 0.], 4)
+
+class TriangleMeshTestCase(TestCase):
+    """A sphere bounces on a mesh as on the ground plane."""
+
+    vertices = [(-1., 0., -1.), (-1., 0., 1.), (1., 0., 1.), (1., 0., -1.)]
+    triangles = [(0, 1, 2), (0, 2, 3)]
+
+    def simulate(self, mesh):
+        w = World()
+        if mesh:
+            w.register(TriangleMesh(w.ground, self.vertices, self.triangles))
+        else:
+            add_groundplane(w)
+        add_sphere(w, radius=0.1)
+        w.register(WeightController())
+        for c in get_all_contacts(w, friction_coeff=0.5):
+            w.register(c)
+        joint = w.getjoints()[0]
+        joint.gpos[0:3, 3] = [0.3, 0.2, -0.1]
+        joint.gvel[3] = 0.5
+        simulate(w, arange(0., 0.3, 1e-3))
+        return joint.gpos
+
+    def runTest(self):
+        self.assertListsAlmostEqual(self.simulate(True), self.simulate(False))
+
+class ClosedTriangleMeshTestCase(TestCase):
+    """The points near the sharp edges of a closed mesh are inside or
+    outside as expected."""
+
+    def setUp(self):
+        w = World()
+        vertices = [(0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.)]
+        triangles = [(0, 2, 1), (0, 1, 3), (0, 3, 2), (1, 2, 3)]
+        self.mesh = TriangleMesh(w.ground, vertices, triangles)
+        self.point = Point(w.ground)
+
+    def sdist(self, p):
+        return mesh_point_collision((self.mesh, self.point),
+                                    (eye(4), transl(*p)))[0]
+
+    def test_edge(self):
+        # the edge shared by the triangles (0, 2, 1) and (1, 2, 3)
+        q = array([0.5, 0.5, 0.])
+        n1 = array([0., 0., -1.])
+        n2 = array([1., 1., 1.])/sqrt(3.)
+        for d in (n1, n2, n1 + 2*n2, n1 + 3*n2, 2*n1 + n2):
+            d = d/norm(d)
+            self.assertAlmostEqual(self.sdist(q + 0.3*d), 0.3)
+        self.assertTrue(self.sdist(q - 0.01*(n1 + n2)/norm(n1 + n2)) < 0.)
+        self.assertAlmostEqual(self.sdist((0.49, 0.5, 0.005)), -0.005/sqrt(3.))
+
+    def test_vertex(self):
+        for d in ((1., 0., 0.), (1., 1., 0.), (1., 0.1, -0.2), (1., -1., 1.)):
+            d = array(d)/norm(d)
+            self.assertAlmostEqual(self.sdist(array([1., 0., 0.]) + 0.3*d),
+                                   0.3)
+        self.assertTrue(self.sdist((0.9, 0.01, 0.01)) < 0.)
+
+    def test_inside(self):
+        self.assertAlmostEqual(self.sdist((0.1, 0.2, 0.3)), -0.1)
+
+class DistanceMatrixTestCase(TestCase):
+    """distance_matrix matches the pairwise collision solvers."""
+
+    def setUp(self):
+        self.world = World()
+        ground = self.world.ground
+        frames = [SubFrame(ground, dot(transl(x, 0.5*x, 0.), roty(x)))
+                  for x in arange(0., 3., 0.5)]
+        self.shapes_a = [Sphere(frames[0], 0.1), Point(frames[1]),
+                         Box(frames[2], (0.1, 0.2, 0.1)),
+                         Sphere(frames[3], 0.3)]
+        self.shapes_b = [Sphere(frames[4], 0.2), Point(frames[5]),
+                         Box(frames[1], (0.2, 0.1, 0.1)),
+                         Cylinder(frames[5], 0.3, 0.1),
+                         Plane(ground, (0., 1., 0., -0.5))]
+        self.world.update_dynamic()
+
+    def reference(self):
+        dists = []
+        for a in self.shapes_a:
+            row = []
+            for b in self.shapes_b:
+                if isinstance(a, Point) and isinstance(b, Point):
+                    row.append(norm(a.frame.pose[0:3, 3] -
+                                    b.frame.pose[0:3, 3]))
+                else:
+                    (shapes, solver) = choose_solver(a, b, convex=True)
+                    row.append(solver(shapes)[0])
+            dists.append(row)
+        return array(dists)
+
+    def test_mixed(self):
+        self.assertListsAlmostEqual(
+            distance_matrix(self.shapes_a, self.shapes_b), self.reference(),
+            5)
+
+    def test_culling(self):
+        ref = self.reference()
+        for max_distance in (0., 0.5, 1., 2.):
+            dists = distance_matrix(self.shapes_a, self.shapes_b,
+                                    max_distance)
+            for (d, r) in zip(dists.flat, ref.flat):
+                if r > max_distance:
+                    self.assertEqual(d, inf)
+                else:
+                    self.assertAlmostEqual(d, r, 5)
+
+    def test_sparse(self):
+        dists = distance_matrix(self.shapes_a, self.shapes_b, 1.)
+        sparse = distance_matrix(self.shapes_a, self.shapes_b, 1., True)
+        self.assertEqual(sorted(sparse),
+                         sorted(zip(*isfinite(dists).nonzero())))
+        for ((i, j), d) in sparse.items():
+            self.assertEqual(d, dists[i, j])
+
+    def test_cache(self):
+        # the cache of the solvers does not keep the shapes alive
+        distance_matrix(self.shapes_a, self.shapes_b)
+        refs = map(weakref.ref, self.shapes_a + self.shapes_b)
+        del self.shapes_a, self.shapes_b
+        gc.collect()
+        self.assertTrue(all(ref() is None for ref in refs))
+
+class TriangleMeshCacheTestCase(TestCase):
+    """The BVH of a mesh is saved to and loaded from the cache."""
+
+    def runTest(self):
+        cache_dir = os.path.join(tempfile.mkdtemp(), 'cache')
+        try:
+            w = World()
+            vertices = TriangleMeshTestCase.vertices
+            triangles = TriangleMeshTestCase.triangles
+            mesh = TriangleMesh(w.ground, vertices, triangles,
+                                cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cached = TriangleMesh(w.ground, vertices, triangles,
+                                  cache_dir=cache_dir)
+            self.assertEqual(sorted(cached.bvh), sorted(mesh.bvh))
+            for key in mesh.bvh:
+                self.assertListsAlmostEqual(cached.bvh[key], mesh.bvh[key])
+            TriangleMesh(w.ground, vertices, triangles, leaf_size=1,
+                         cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+        finally:
+            shutil.rmtree(os.path.dirname(cache_dir))
+
+class HeightFieldTestCase(TestCase):
+    """
+    A sphere rolls down a sloped height field, memory-mapped from a file,
+    as down a sloped plane.
+    """
+
+    def simulate(self, heights):
+        w = World()
+        if heights is None:
+            w.register(Plane(w.ground, (-3., 4., 0., 0.)))
+        else:
+            w.register(HeightField(w.ground, heights, (0.5, 0.5)))
+        add_sphere(w, radius=0.1)
+        w.register(WeightController())
+        for c in get_all_contacts(w, friction_coeff=0.5):
+            w.register(c)
+        joint = w.getjoints()[0]
+        joint.gpos[0:3, 3] = [2.2, 1.8, 1.1]
+        simulate(w, arange(0., 0.3, 1e-3))
+        return joint.gpos
+
+    def runTest(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, 'heights.npy')
+            save(filename, outer(0.375*arange(10), ones(10)))
+            heights = load(filename, mmap_mode='r')
+            self.assertListsAlmostEqual(self.simulate(heights),
+                                        self.simulate(None))
+            del heights
+        finally:
+            shutil.rmtree(tmp_dir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,338 @@
+# coding=utf-8
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import traceback
+import sys
+import h5py
+from arboristest import TestCase
+from numpy import arange, zeros, dot, pi, ndarray
+from arboris.core import simplearm, simulate, Observer
+from arboris.controllers import WeightController
+from arboris.homogeneousmatrix import encode, decode, rotzyx, rotx, roty, \
+                                      rotz
+from arboris.observers import Hdf5Logger, ThreadedObserver, MemmapLogger, \
+                              load_memmap_log
+
+
+def _simulate(observers, timeline=None):
+    """Simulate a simplearm under gravity, with the given observers."""
+    w = simplearm()
+    w.register(WeightController())
+    w.getjoints()[0].gpos[0] = 0.5
+    if timeline is None:
+        timeline = arange(0., 0.011, 0.001)
+    simulate(w, timeline, observers)
+    return w
+
+
+def _read_hdf5(filename):
+    """Return the datasets of an hdf5 file, as a dict of arrays."""
+    data = {}
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            data[name] = obj[...]
+    with h5py.File(filename, 'r') as f:
+        f.visititems(visit)
+    return data
+
+
+class Hdf5LoggerTestCase(TestCase):
+    """The chunked hdf5 files hold the same data as the default ones."""
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def log(self, **args):
+        filename = os.path.join(self.dirname, 'log{0}.h5'.format(len(
+            os.listdir(self.dirname))))
+        _simulate([Hdf5Logger(filename, save_state=True, save_model=True,
+                              **args)])
+        return _read_hdf5(filename)
+
+    def test_chunked(self):
+        ref = self.log()
+        # the chunk size does not divide the 10 steps
+        for chunk_size in (1, 3, 10, 16):
+            data = self.log(chunk_size=chunk_size)
+            self.assertEqual(sorted(data.keys()), sorted(ref.keys()))
+            for k in ref:
+                self.assertEqual(data[k].shape, ref[k].shape)
+                self.assertListsAlmostEqual(data[k], ref[k])
+
+    def test_compression(self):
+        ref = self.log()
+        data = self.log(chunk_size=4, compression="gzip")
+        for k in ref:
+            self.assertListsAlmostEqual(data[k], ref[k])
+
+    def test_group(self):
+        filename = os.path.join(self.dirname, 'log.h5')
+        _simulate([Hdf5Logger(filename, group='/a/b', chunk_size=4)])
+        with h5py.File(filename, 'r') as f:
+            self.assertEqual(f['a/b/timeline'].shape, (10,))
+            self.assertAlmostEqual(f['a/b/timeline'][-1], 0.009)
+
+
+class MemmapLoggerTestCase(TestCase):
+    """load_memmap_log reads back the data written by a MemmapLogger."""
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_load(self):
+        filename = os.path.join(self.dirname, 'ref.h5')
+        dirname = os.path.join(self.dirname, 'log')
+        _simulate([Hdf5Logger(filename, save_state=True, save_model=True),
+                   MemmapLogger(dirname, save_state=True, save_model=True)])
+        ref = _read_hdf5(filename)
+        log = load_memmap_log(dirname)
+        data = {'timeline': log['timeline']}
+        for (group, v) in log.items():
+            if group != 'timeline':
+                for (name, array) in v.items():
+                    data[group + '/' + name] = array
+        self.assertEqual(sorted(data.keys()), sorted(ref.keys()))
+        for k in ref:
+            self.assertEqual(data[k].shape, ref[k].shape)
+            self.assertListsAlmostEqual(data[k], ref[k])
+
+    def test_unfinished(self):
+        dirname = os.path.join(self.dirname, 'log')
+        obs = MemmapLogger(dirname)
+        w = simplearm()
+        obs.init(w, arange(0., 0.011, 0.001))
+        w.update_dynamic()
+        obs.update(0.001)
+        # the whole arrays are read, the steps not recorded are zeros
+        log = load_memmap_log(dirname)
+        self.assertEqual(log['timeline'].shape, (10,))
+        self.assertListsAlmostEqual(log['transforms']['Hand'][1],
+                                    zeros((4, 4)))
+
+
+class EncodingTestCase(TestCase):
+    """The transforms are restored by decode, for each encoding and dtype."""
+
+    encodings = ("4x4", "3x4", "quaternion")
+
+    def setUp(self):
+        # rotations of about pi give a null quaternion scalar part
+        self.H = [rotzyx(0.5, -1., 2.), rotx(pi), roty(pi - 1e-9),
+                  dot(rotz(pi), rotx(pi/2))]
+        for (i, H) in enumerate(self.H):
+            H[0:3, 3] = (i, -2., 0.5)
+
+    def test_encode(self):
+        for encoding in self.encodings:
+            for (dtype, places) in (("f8", 12), ("f4", 6)):
+                for H in self.H:
+                    T = encode(H, encoding).astype(dtype)
+                    self.assertListsAlmostEqual(decode(T), H, places)
+                T = encode(self.H, encoding).astype(dtype)
+                self.assertListsAlmostEqual(decode(T), self.H, places)
+
+    def test_loggers(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dirname, 'ref.h5')
+            _simulate([Hdf5Logger(filename)])
+            ref = _read_hdf5(filename)
+            for encoding in self.encodings:
+                for (dtype, places) in (("f8", 12), ("f4", 6)):
+                    filename = os.path.join(dirname,
+                                            encoding + dtype + '.h5')
+                    _simulate([Hdf5Logger(filename, dtype=dtype,
+                                          transform_encoding=encoding)])
+                    data = _read_hdf5(filename)
+                    self.assertEqual(sorted(data.keys()), sorted(ref.keys()))
+                    for k in ref:
+                        if k.startswith('transforms/'):
+                            self.assertEqual(data[k].dtype, dtype)
+                            self.assertListsAlmostEqual(decode(data[k]),
+                                                        ref[k], places)
+        finally:
+            shutil.rmtree(dirname)
+
+
+class _TimeRecorder(Observer):
+    """An observer recording its timeline, and the times and durations of
+    its updates."""
+
+    def init(self, world, timeline):
+        self.world = world
+        self.timeline = timeline
+        self.times = []
+        self.dts = []
+
+    def update(self, dt):
+        self.times.append(self.world.current_time)
+        self.dts.append(dt)
+
+    def finish(self):
+        pass
+
+
+class DecimationTestCase(TestCase):
+    """The decimated observers are updated at the expected steps."""
+
+    timeline = arange(0., 0.0105, 0.001)
+
+    def test_decimation(self):
+        obs = _TimeRecorder()
+        obs.decimation = 3
+        obs.phase = 1
+        _simulate([obs], self.timeline)
+        self.assertListsAlmostEqual(obs.times, self.timeline[[1, 4, 7]])
+        self.assertTrue(isinstance(obs.timeline, ndarray))
+        self.assertListsAlmostEqual(obs.timeline, self.timeline[[1, 4, 7, 10]])
+
+    def test_dt(self):
+        # the durations between the times of the observer timeline
+        (obs, ref) = (_TimeRecorder(), _TimeRecorder())
+        obs.decimation = 4
+        obs.phase = 1
+        _simulate([obs, ref], self.timeline)
+        self.assertListsAlmostEqual(ref.dts, [0.001]*10)
+        self.assertListsAlmostEqual(obs.dts, [0.004, 0.004, 0.001])
+        self.assertListsAlmostEqual(obs.dts, obs.timeline[1:] -
+                                    obs.timeline[:-1])
+
+    def test_period(self):
+        (obs, ref) = (_TimeRecorder(), _TimeRecorder())
+        obs.period = 0.002
+        _simulate([obs, ref], self.timeline)
+        self.assertListsAlmostEqual(obs.times, ref.times[0:10:2])
+        self.assertEqual(len(ref.times), 10)
+
+    def test_single_time(self):
+        obs = _TimeRecorder()
+        obs.period = 0.002
+        _simulate([obs], self.timeline[0:1])
+        self.assertEqual(obs.times, [])
+
+
+class _Writer(Observer):
+    """An observer whose snapshots are the numbers of its updates, and
+    whose ``write`` method waits for the ``release`` event."""
+
+    def __init__(self, fail_at=None):
+        Observer.__init__(self)
+        self.fail_at = fail_at
+        self.written = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.finished = False
+        self._count = 0
+
+    def init(self, world, timeline):
+        pass
+
+    def update(self, dt):
+        pass
+
+    def snapshot(self, dt):
+        self._count += 1
+        return self._count - 1
+
+    def write(self, data):
+        self.started.set()
+        self.release.wait()
+        if data == self.fail_at:
+            raise ValueError(data)
+        self.written.append(data)
+
+    def finish(self):
+        self.finished = True
+
+
+class ThreadedObserverTestCase(TestCase):
+    """The worker writes the snapshots as told by the backpressure."""
+
+    def run_observer(self, backpressure):
+        """Queue 6 snapshots while the worker is stuck on the first one."""
+        writer = _Writer()
+        writer.release.clear()
+        obs = ThreadedObserver(writer, maxsize=2, backpressure=backpressure)
+        obs.init(None, arange(0., 0.007, 0.001))
+        obs.update(0.001)
+        writer.started.wait()
+        for i in range(5):
+            obs.update(0.001)
+        writer.release.set()
+        obs.finish()
+        self.assertTrue(writer.finished)
+        return (writer.written, obs.dropped)
+
+    def test_block(self):
+        writer = _Writer()
+        obs = ThreadedObserver(writer, maxsize=2)
+        obs.init(None, arange(0., 0.101, 0.001))
+        for i in range(100):
+            obs.update(0.001)
+        obs.finish()
+        self.assertEqual(writer.written, range(100))
+        self.assertEqual(obs.dropped, 0)
+
+    def test_drop(self):
+        self.assertEqual(self.run_observer("drop"), ([0, 4, 5], 3))
+
+    def test_decimate(self):
+        self.assertEqual(self.run_observer("decimate"), ([0, 1, 2], 3))
+
+    def test_logger(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            (ref, threaded) = (os.path.join(dirname, 'ref.h5'),
+                               os.path.join(dirname, 'threaded.h5'))
+            _simulate([Hdf5Logger(ref, save_state=True, chunk_size=3)])
+            _simulate([ThreadedObserver(Hdf5Logger(threaded, save_state=True,
+                                                   chunk_size=3))])
+            (ref, threaded) = (_read_hdf5(ref), _read_hdf5(threaded))
+            self.assertEqual(sorted(threaded.keys()), sorted(ref.keys()))
+            for k in ref:
+                self.assertListsAlmostEqual(threaded[k], ref[k])
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_error(self):
+        writer = _Writer(fail_at=1)
+        obs = ThreadedObserver(writer)
+        obs.init(None, arange(0., 0.101, 0.001))
+        obs.update(0.001)
+        obs.update(0.001)
+        try:
+            for i in range(100):
+                writer.started.wait()
+                obs.update(0.001)
+            obs.finish()
+        except ValueError:
+            # the traceback goes through the wrapped write method
+            names = [f[2] for f in traceback.extract_tb(sys.exc_info()[2])]
+            self.assertTrue('write' in names)
+        else:
+            self.fail("the error was not raised")
+        self.assertEqual(writer.written, [0])
+
+    def test_decimation(self):
+        writer = _Writer()
+        obs = ThreadedObserver(writer)
+        obs.decimation = 3
+        obs.phase = 1
+        self.assertEqual((writer.decimation, writer.phase), (3, 1))
+        writer.period = 0.002
+        self.assertEqual(obs.period, 0.002)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# coding=utf-8
+
+import unittest
+from arboristest import TestCase
+from numpy import arange, ones
+from arboris.core import simplearm, simulate, Controller
+from arboris.controllers import WeightController
+from arboris.constraints import JointLimits
+from arboris.profiling import Profiler
+
+
+class _Counter(object):
+    """A timer whose time is the number of its calls."""
+
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        self.time += 1
+        return self.time
+
+
+class _FailingController(Controller):
+    """A controller whose update raises an error."""
+
+    def init(self, world):
+        pass
+
+    def update(self, dt):
+        raise ValueError()
+
+
+class ProfilerTestCase(TestCase):
+    """The profiler records a duration per step, phase and item."""
+
+    def setUp(self):
+        self.world = simplearm()
+        self.world.register(WeightController())
+        self.world.register(WeightController())
+        shoulder = self.world.getjoints()['Shoulder']
+        self.world.register(JointLimits(shoulder, -3.14/2, 3.14/2))
+        self.timeline = arange(0., 0.0105, 0.001)
+
+    def test_shapes(self):
+        profiler = Profiler()
+        simulate(self.world, self.timeline, profiler=profiler)
+        self.assertEqual(profiler.phase_times.shape, (10, 5))
+        self.assertEqual(profiler.controller_times.shape, (10, 2))
+        self.assertEqual(profiler.constraint_times.shape, (10, 1))
+        self.assertEqual(profiler.iterations.shape, (10,))
+        self.assertEqual(profiler.residuals.shape, (10,))
+        self.assertTrue((profiler.phase_times >= 0.).all())
+        self.assertTrue(self.world.profiler is None)
+
+    def test_timings(self):
+        # each call to the timer lasts one unit of time, so that each
+        # item update lasts one unit, and each phase one unit more than
+        # the items it contains
+        profiler = Profiler(timer=_Counter())
+        simulate(self.world, self.timeline, profiler=profiler)
+        self.assertListsAlmostEqual(profiler.controller_times, ones((10, 2)))
+        self.assertListsAlmostEqual(profiler.constraint_times, ones((10, 1)))
+        self.assertListsAlmostEqual(profiler.phase_times,
+                                    [[1., 5., 3., 1., 1.]]*10)
+        self.assertEqual(profiler.controllers,
+                         list(self.world.getcontrollers()))
+
+    def test_late_item(self):
+        profiler = Profiler(timer=_Counter())
+        profiler.init(self.world, self.timeline)
+        controller = WeightController()
+        profiler.start_step(3)
+        profiler.start_item()
+        profiler.controller_done(controller)
+        self.assertEqual(profiler.controller_times.shape, (10, 3))
+        self.assertTrue(profiler.controllers[2] is controller)
+        self.assertEqual(profiler.controller_times[3, 2], 1.)
+        self.assertEqual(profiler.controller_times[:, 2].sum(), 1.)
+
+    def test_error(self):
+        self.world.register(_FailingController())
+        self.assertRaises(ValueError, simulate, self.world, self.timeline,
+                          profiler=Profiler())
+        self.assertTrue(self.world.profiler is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# coding=utf-8
+
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+from arboristest import TestCase
+from numpy import array
+from arboris.core import World
+from arboris.shapes import TriangleMesh, read_stl
+
+# a tetrahedron, whose faces are oriented outward
+TETRAHEDRON_VERTICES = array([[0., 0., 0.], [1., 0., 0.], [0., 1., 0.],
+                              [0., 0., 1.]])
+TETRAHEDRON_TRIANGLES = [(0, 2, 1), (0, 1, 3), (0, 3, 2), (1, 2, 3)]
+
+
+def write_binary_stl(filename, vertices, triangles, header='binary'):
+    """Write a binary STL file, with null normals."""
+    f = open(filename, 'wb')
+    f.write(header.ljust(80, ' '))
+    f.write(struct.pack('<I', len(triangles)))
+    for t in triangles:
+        f.write(struct.pack('<3f', 0., 0., 0.))
+        for i in t:
+            f.write(struct.pack('<3f', *vertices[i]))
+        f.write(struct.pack('<H', 0))
+    f.close()
+
+def write_ascii_stl(filename, vertices, triangles):
+    """Write an ascii STL file, with null normals."""
+    f = open(filename, 'w')
+    f.write('solid ascii\n')
+    for t in triangles:
+        f.write('  facet normal 0 0 0\n    outer loop\n')
+        for i in t:
+            f.write('      vertex {0} {1} {2}\n'.format(*vertices[i]))
+        f.write('    endloop\n  endfacet\n')
+    f.write('endsolid ascii\n')
+    f.close()
+
+
+class ReadStlTestCase(TestCase):
+    """read_stl reads the binary and ascii STL files."""
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def check(self, filename):
+        (vertices, triangles) = read_stl(filename)
+        # the vertices shared by the triangles are merged
+        self.assertEqual(vertices.shape, (4, 3))
+        self.assertEqual(triangles.shape, (4, 3))
+        self.assertListsAlmostEqual(
+            [vertices[t] for t in triangles],
+            [TETRAHEDRON_VERTICES[list(t)] for t in TETRAHEDRON_TRIANGLES])
+        mesh = TriangleMesh(World().ground, vertices, triangles)
+        self.assertEqual(len(mesh.triangles), 4)
+
+    def test_binary(self):
+        filename = os.path.join(self.dirname, 'binary.stl')
+        write_binary_stl(filename, TETRAHEDRON_VERTICES,
+                         TETRAHEDRON_TRIANGLES)
+        self.check(filename)
+
+    def test_binary_solid_header(self):
+        # some binary files have a header starting as the ascii ones
+        filename = os.path.join(self.dirname, 'binary.stl')
+        write_binary_stl(filename, TETRAHEDRON_VERTICES,
+                         TETRAHEDRON_TRIANGLES, header='solid binary')
+        self.check(filename)
+
+    def test_ascii(self):
+        filename = os.path.join(self.dirname, 'ascii.stl')
+        write_ascii_stl(filename, TETRAHEDRON_VERTICES, TETRAHEDRON_TRIANGLES)
+        self.check(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# coding=utf-8
+
+import unittest
+import os
+import shutil
+import tempfile
+from arboristest import TestCase
+from numpy import array, eye
+from arboris.core import World
+from arboris.shapes import TriangleMesh
+from arboris.robots.urdf import URDFConverter
+from test_shapes import write_binary_stl, TETRAHEDRON_VERTICES, \
+                        TETRAHEDRON_TRIANGLES
+
+URDF = """<?xml version="1.0"?>
+<robot name="robot">
+  <link name="link">
+    <inertial>
+      <origin xyz="0 0 0" rpy="0 0 0"/>
+      <mass value="1."/>
+      <inertia ixx="1." ixy="0." ixz="0." iyy="1." iyz="0." izz="1."/>
+    </inertial>
+    <collision>
+      <origin xyz="0 0 0.5" rpy="0 0 0"/>
+      <geometry>
+        <mesh filename="{0}" {1}/>
+      </geometry>
+    </collision>
+  </link>
+</robot>
+"""
+
+
+class URDFMeshTestCase(TestCase):
+    """The STL collision meshes of a URDF file are loaded, scaled."""
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        write_binary_stl(os.path.join(self.dirname, 'tetrahedron.stl'),
+                         TETRAHEDRON_VERTICES, TETRAHEDRON_TRIANGLES)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def load(self, mesh_file_name, scale=''):
+        filename = os.path.join(self.dirname, 'robot.urdf')
+        f = open(filename, 'w')
+        f.write(URDF.format(mesh_file_name, scale))
+        f.close()
+        w = World()
+        URDFConverter(filename, w, mesh_cache_dir=os.path.join(self.dirname,
+                                                               'cache'))
+        return w
+
+    def test_mesh(self):
+        w = self.load('tetrahedron.stl')
+        shapes = list(w.getshapes())
+        self.assertEqual(len(shapes), 1)
+        mesh = shapes[0]
+        self.assertTrue(isinstance(mesh, TriangleMesh))
+        self.assertEqual(mesh.frame.body.name, 'link')
+        H = eye(4)
+        H[2, 3] = 0.5
+        self.assertListsAlmostEqual(mesh.frame.bpose, H)
+        self.assertListsAlmostEqual(sorted(mesh.vertices.tolist()),
+                                    sorted(TETRAHEDRON_VERTICES.tolist()))
+        self.assertEqual(len(mesh.triangles), 4)
+
+    def test_scale(self):
+        w = self.load('tetrahedron.stl', 'scale="1 2 3"')
+        mesh = list(w.getshapes())[0]
+        self.assertListsAlmostEqual(
+            sorted(mesh.vertices.tolist()),
+            sorted((TETRAHEDRON_VERTICES*array((1., 2., 3.))).tolist()))
+
+    def test_unsupported(self):
+        # only the STL meshes are loaded
+        w = self.load('tetrahedron.dae')
+        self.assertEqual(len(list(w.getshapes())), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()